@@ -0,0 +1,211 @@
+import os
+import time
+import asyncio
+import inspect
+import functools
+import itertools
+import threading
+from flask import jsonify, make_response
+from gen_sql.tracing import Histogram, LATENCY_BUCKETS
+
+class Overloaded(Exception):
+    """A request could not be admitted; status is 429 (queue full) or 503 (wait timed out)"""
+
+    def __init__(self, workload, status, message):
+        super().__init__(message)
+        self.workload = workload
+        self.status = status
+
+class Workload:
+    """Limits and counters of one workload class"""
+
+    def __init__(self, name, priority, max_concurrent, max_queue, queue_timeout):
+        self.name = name
+        self.priority = priority
+        self.max_concurrent = int(os.getenv(f'WORKLOAD_{name.upper()}_LIMIT', max_concurrent))
+        self.max_queue = int(os.getenv(f'WORKLOAD_{name.upper()}_QUEUE', max_queue))
+        self.queue_timeout = float(os.getenv(f'WORKLOAD_{name.upper()}_TIMEOUT', queue_timeout))
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_seconds = Histogram(f'{name}_queue_wait_seconds', LATENCY_BUCKETS)
+
+class Scheduler:
+    """
+    Priority-aware admission control for request threads.
+
+    Every workload class has its own concurrency limit and bounded wait queue,
+    and all classes share total_slots. When slots free up the waiting request
+    with the best (lowest) priority goes first, so interactive reads overtake
+    queued chat and video work. Requests that find their queue full are
+    rejected at once; queued requests give up after the class timeout.
+
+    A scheduler ranks the requests of one process only. The video app
+    (api.py) and the SQL app (api2.py) run as separate servers, each with its
+    own scheduler, limits and total_slots, so a video stream does not wait
+    behind dashboard reads or the other way round. Within each app the
+    priorities hold; the CPU-heavy counting itself runs in the inference pool
+    processes, whose size (COUNT_WORKERS) bounds it across both apps.
+    """
+
+    def __init__(self, workloads, total_slots):
+        self.workloads = {workload.name: workload for workload in workloads}
+        self.total_slots = total_slots
+        self.in_flight = 0
+        self._waiting = {}
+        self._arrivals = itertools.count()
+        self._cond = threading.Condition()
+
+    def _can_run(self, workload, ticket):
+        if workload.in_flight >= workload.max_concurrent or self.in_flight >= self.total_slots:
+            return False
+        # nobody with a better priority, or an earlier ticket, that could run is waiting
+        for (priority, other_ticket), other in self._waiting.items():
+            if (priority, other_ticket) < (workload.priority, ticket) and other.in_flight < other.max_concurrent:
+                return False
+        return True
+
+    def acquire(self, name):
+        """
+        Wait for a slot of workload name.
+
+        Raises:
+            Overloaded: When the class queue is full or the wait times out
+        """
+        workload = self.workloads[name]
+        started = time.monotonic()
+        with self._cond:
+            ticket = next(self._arrivals)
+            if self._can_run(workload, ticket):
+                self._admit(workload, started)
+                return
+            if workload.queued >= workload.max_queue:
+                workload.rejected += 1
+                raise Overloaded(name, 429, f'Too many queued {name} requests, try again later.')
+            key = (workload.priority, ticket)
+            self._waiting[key] = workload
+            workload.queued += 1
+            deadline = started + workload.queue_timeout
+            try:
+                while not self._can_run(workload, ticket):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        workload.timed_out += 1
+                        raise Overloaded(name, 503, f'Server is busy with {name} requests, try again later.')
+                    self._cond.wait(remaining)
+            finally:
+                del self._waiting[key]
+                workload.queued -= 1
+                # whoever is next in line may be able to run now
+                self._cond.notify_all()
+            self._admit(workload, started)
+
+    async def aacquire(self, name):
+        """
+        acquire for coroutines: the wait runs on a helper thread, so the
+        event loop keeps running. If the caller is cancelled while waiting,
+        a slot the wait still obtains is given back.
+        """
+        waiting = asyncio.ensure_future(asyncio.to_thread(self.acquire, name))
+        try:
+            await asyncio.shield(waiting)
+        except asyncio.CancelledError:
+            def give_back(future):
+                if not future.cancelled() and future.exception() is None:
+                    self.release(name)
+            waiting.add_done_callback(give_back)
+            raise
+
+    def _admit(self, workload, started):
+        workload.in_flight += 1
+        workload.admitted += 1
+        self.in_flight += 1
+        workload.wait_seconds.observe(time.monotonic() - started)
+
+    def release(self, name):
+        with self._cond:
+            self.workloads[name].in_flight -= 1
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            classes = {
+                name: {
+                    'priority': w.priority,
+                    'limit': w.max_concurrent,
+                    'in_flight': w.in_flight,
+                    'queued': w.queued,
+                    'queue_limit': w.max_queue,
+                    'admitted': w.admitted,
+                    'rejected': w.rejected,
+                    'timed_out': w.timed_out
+                }
+                for name, w in self.workloads.items()
+            }
+        for name, w in self.workloads.items():
+            classes[name]['queue_wait_seconds'] = w.wait_seconds.snapshot()
+        return {'total_slots': self.total_slots, 'in_flight': self.in_flight, 'workloads': classes}
+
+# interactive dashboard reads > LLM chat > batch (video counting, batch SQL)
+scheduler = Scheduler([
+    Workload('interactive', priority=0, max_concurrent=16, max_queue=64, queue_timeout=2),
+    Workload('chat', priority=1, max_concurrent=8, max_queue=32, queue_timeout=10),
+    Workload('batch', priority=2, max_concurrent=2, max_queue=4, queue_timeout=1),
+], total_slots=int(os.getenv('WORKLOAD_TOTAL_SLOTS', '20')))
+
+def _overloaded_response(e):
+    response = jsonify({'error': str(e), 'workload': e.workload})
+    response.status_code = e.status
+    response.headers['Retry-After'] = '1' if e.status == 503 else '5'
+    return response
+
+def _hold_until_closed(response, name):
+    """Keep the slot until the response is closed, so streamed bodies stay counted"""
+    response = make_response(response)
+    released = threading.Event()
+
+    def release():
+        if not released.is_set():
+            released.set()
+            scheduler.release(name)
+    response.call_on_close(release)
+    return response
+
+def admit(name):
+    """
+    Route decorator running the view under workload class name.
+
+    Works for sync and async views. The slot is released when the response is
+    closed (after a streamed body has been fully sent or abandoned).
+    """
+    def decorator(view):
+        if inspect.iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def async_wrapper(*args, **kwargs):
+                try:
+                    await scheduler.aacquire(name)
+                except Overloaded as e:
+                    return _overloaded_response(e)
+                try:
+                    return _hold_until_closed(await view(*args, **kwargs), name)
+                except BaseException:
+                    scheduler.release(name)
+                    raise
+            return async_wrapper
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                scheduler.acquire(name)
+            except Overloaded as e:
+                return _overloaded_response(e)
+            try:
+                return _hold_until_closed(view(*args, **kwargs), name)
+            except BaseException:
+                scheduler.release(name)
+                raise
+        return wrapper
+    return decorator
@@ -5,9 +5,15 @@ import uuid
 import createImage
 import counter
 import base64
-from langchain.chat_models import init_chat_model
+from gen_sql.llm_registry import get_chat_model
+from gen_sql.llm_call import get_caller
 from langchain_core.messages import HumanMessage
 import utils
+from admission import admit, scheduler
+import metrics
+import model_registry
+import counting_jobs
+import inference_pool
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -33,6 +39,10 @@ app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max file size
 # Ensure upload folder exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+metrics.install(app, 'video')
+# start the counting workers, which load and warm up the model before the first /api/stream request
+inference_pool.start()
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -76,7 +86,8 @@ def upload_video():
         return jsonify({'error': 'Invalid file type. Allowed types: mp4, avi, mov, mkv'}), 400
     
 @app.route('/api/upload', methods=['POST'])
-def upload_image():
+@admit('chat')
+async def upload_image():
     # Check if a file is included in the request
     if 'image' not in request.files:
         return jsonify({'error': 'No image part in the request'}), 400
@@ -110,23 +121,145 @@ Return: array<Recipe>
             }
         ]
     )
-    llm = init_chat_model(
+    llm = get_chat_model(
         model="gemini-2.0-flash", 
-        google_api_key=os.getenv("GOOGLE_API_KEY"),
         temperature=0.7, 
         model_provider="google_genai"
     )
-    response = llm.invoke([message])
+    # own breaker and latency stats, apart from SQL chat; no hedging, which would resend the image
+    caller = get_caller('google_genai_image', hedge_percentile=None)
+    response = await caller.acall(lambda: llm.ainvoke([message]))
     success, data, err =utils.extract_json(response.content)
     return data, 200
   
 @app.route('/api/stream')
+@admit('batch')
 def stream():
     """Returns a streaming response."""
     video = request.args.get('video')  # Get the value of the 'q' parameter
     line = request.args.get('line') 
     x1,y1,x2,y2=map(int, line.split(','))
-    return Response(counter.count_object(os.path.join(app.config['UPLOAD_FOLDER'], video), (x1,y1), (x2,y2)), mimetype='application/json') 
+    # ?stride=N processes every Nth frame, ?fps=N about N frames per second of video
+    stride = request.args.get('stride', type=int)
+    target_fps = request.args.get('fps', type=float)
+    # ?batch=N detects N frames per forward pass (uploaded videos only)
+    batch_size = request.args.get('batch', type=int)
+    # ?segments=N counts a long video as N segments in parallel workers
+    segments = request.args.get('segments', type=int)
+    # counted in a worker process (COUNT_WORKERS), so this one stays responsive
+    return Response(inference_pool.count_object(os.path.join(app.config['UPLOAD_FOLDER'], video), (x1,y1,x2,y2), stride=stride, target_fps=target_fps, batch_size=batch_size, segments=segments), mimetype='application/json') 
+
+def _whole(value, name, minimum):
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+        raise ValueError(f'{name} must be a whole number of at least {minimum}')
+    return value
+
+def count_job_params(data):
+    """
+    Validate a count job body.
+
+    Returns:
+        tuple: (line as 4 ints, class names, options)
+
+    Raises:
+        ValueError: With the message for a 400 response
+    """
+    line = data['line']
+    if isinstance(line, str):
+        line = line.split(',')
+    if (not isinstance(line, list) or len(line) != 4
+            or any(isinstance(value, (bool, float)) for value in line)):
+        raise ValueError('line must be x1,y1,x2,y2')
+    try:
+        line = [int(value) for value in line]
+    except (TypeError, ValueError):
+        raise ValueError('line must be x1,y1,x2,y2')
+
+    classes = data.get('classes') or counter.DEFAULT_CLASSES
+    if not isinstance(classes, list) or not all(isinstance(name, str) and name for name in classes):
+        raise ValueError('classes must be a list of class names')
+
+    fps = data.get('fps')
+    if fps is not None:
+        if isinstance(fps, bool) or not isinstance(fps, (int, float)) or not 0 < fps < float('inf'):
+            raise ValueError('fps must be a positive number')
+        fps = float(fps)
+    options = {
+        'stride': _whole(data.get('stride'), 'stride', 1),
+        'fps': fps,
+        'batch': _whole(data.get('batch'), 'batch', 1),
+        'segments': _whole(data.get('segments'), 'segments', 0)
+    }
+    return line, classes, options
+
+@app.route('/api/count-jobs', methods=['POST'])
+def submit_count_job():
+    """
+    Start counting a video in the background, or attach to the same job.
+
+    Body: {"video", "line": "x1,y1,x2,y2", "classes": [...], "stride", "fps", "batch", "segments"}
+    """
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict) or not isinstance(data.get('video'), str) or not data['video'] or not data.get('line'):
+        return jsonify({'error': 'video and line are required'}), 400
+    try:
+        line, classes, options = count_job_params(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    video_path = os.path.join(app.config['UPLOAD_FOLDER'], os.path.basename(data['video']))
+    if not os.path.exists(video_path):
+        return jsonify({'error': 'Video not found'}), 404
+    job, created = counting_jobs.get_manager().submit(video_path, line, classes, options)
+    return jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'created': created,
+        'events_url': f'/api/count-jobs/{job.id}/events',
+        'result': job.result
+    }), 202 if created else 200
+
+@app.route('/api/count-jobs')
+def get_count_jobs():
+    return jsonify(counting_jobs.get_manager().stats())
+
+@app.route('/api/count-jobs/<job_id>')
+def get_count_job(job_id):
+    job = counting_jobs.get_manager().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/count-jobs/<job_id>/events')
+def count_job_events(job_id):
+    """Server-sent progress events; resumes after Last-Event-ID (or ?last_event_id=)"""
+    job = counting_jobs.get_manager().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0
+    try:
+        last_event_id = int(last_event_id)
+    except ValueError:
+        last_event_id = 0
+    response = Response(counting_jobs.event_stream(job, last_event_id), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/count-workers')
+def get_count_workers():
+    """Counting worker processes and the tasks they ran"""
+    return jsonify(inference_pool.stats())
+
+@app.route('/api/models')
+def get_models():
+    """Loaded counting models with load/warmup time and sessions handed out"""
+    return jsonify(model_registry.stats())
+
+@app.route('/api/workloads')
+def get_workloads():
+    """Admission control queue depth, wait times and rejections per workload class"""
+    return jsonify(scheduler.stats())
 
 @app.route('/api/time')
 def get_current_time():
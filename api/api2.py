@@ -1,17 +1,27 @@
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, Response, request, jsonify, render_template_string, g
 from flask_sqlalchemy import SQLAlchemy
 import os
+import time
+import asyncio
 #import re
 from datetime import datetime
 from typing import Dict, List
 from sqlalchemy import text, inspect
 #from gen_sql.lc_gen_query import generate_sql_query
-from gen_sql.sql_gen_lg import run_qgn_chatbot, get_messages
-from gen_sql.schema import get_schema
+from gen_sql.sql_gen_lg import arun_qgn_chatbot, get_history, llm_flight
+from gen_sql.single_flight import SingleFlight, normalize_sql
+from gen_sql.batch import iter_batch, DEFAULT_CONCURRENCY, DEFAULT_LLM_RPM
+from gen_sql import tracing
+from gen_sql import profiles
+from gen_sql import sql_gate
+from gen_sql import llm_call
 from sqlalchemy import Column, Integer, String, Date, DateTime, Numeric, Text, ForeignKey
 from sqlalchemy.orm import relationship
 from dotenv import load_dotenv
 from utils import extract_sql
+from admission import admit, scheduler
+from channel import channel_bp, publish
+import metrics
 
 load_dotenv()
 
@@ -20,9 +30,50 @@ app = Flask(__name__)
 
 # Configure SQLAlchemy
 basedir = os.path.abspath(os.path.dirname(__file__))
-app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(basedir, "database.db")}'
+database_path = os.getenv('DATABASE_PATH', os.path.join(basedir, "database.db"))
+app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{database_path}'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app)
+sql_flight = SingleFlight('sql')
+
+def data_epoch():
+    """Version stamp of the database file; changes on every committed write"""
+    stat = os.stat(database_path)
+    return f'{stat.st_mtime_ns}-{stat.st_size}'
+
+with app.app_context():
+    # column value hints for the SQL prompt, profiled in the background and
+    # refreshed after data_epoch changes
+    profiles.configure(db.engine, data_epoch)
+
+def execute_select(sql):
+    """
+    Execute a SELECT and return its rows as dictionaries.
+
+    Concurrent requests for the same normalized SQL at the same data epoch
+    share one execution, so a dashboard opened by many users at once hits the
+    database once.
+    """
+    def run():
+        started = time.perf_counter()
+        # the connection refuses writes, whatever the query says
+        with sql_gate.query_only(lambda statement: db.session.execute(text(statement))):
+            result = db.session.execute(text(sql))
+            # For SELECT queries only - simpler approach
+            rows = result.fetchall()
+            columns = result.keys()
+        metrics.DB_QUERY_SECONDS.labels(operation='select').observe(time.perf_counter() - started)
+        metrics.DB_ROWS.labels(operation='select').inc(len(rows))
+        return [dict(zip(columns, row)) for row in rows]
+    return sql_flight.do((data_epoch(), normalize_sql(sql)), run)
+
+def gate_query(sql):
+    """Run a plan or row-count query for sql_gate"""
+    started = time.perf_counter()
+    with sql_gate.query_only(lambda statement: db.session.execute(text(statement))):
+        rows = db.session.execute(text(sql)).fetchall()
+    metrics.DB_QUERY_SECONDS.labels(operation='gate').observe(time.perf_counter() - started)
+    return rows
 
 # Metadata Models
 class TableDescription(db.Model):
@@ -283,6 +334,34 @@ class SchemaReader:
 # Initialize schema reader
 schema_reader = SchemaReader(db)
 
+# chat, counter progress and dashboard refreshes over one stream per client
+app.register_blueprint(channel_bp)
+metrics.install(app, 'sql', single_flights=[llm_flight, sql_flight])
+
+@app.before_request
+def begin_request_trace():
+    g.trace, g.trace_token = tracing.start_trace()
+
+@app.after_request
+def attach_server_timing(response):
+    """Expose the phases recorded for this request as a Server-Timing header"""
+    trace = g.get('trace')
+    if trace is not None:
+        server_timing = trace.server_timing()
+        if server_timing:
+            response.headers['Server-Timing'] = server_timing
+    return response
+
+@app.teardown_request
+def end_request_trace(exc):
+    token = g.pop('trace_token', None)
+    if token is not None:
+        try:
+            tracing.end_trace(token)
+        except ValueError:
+            # token was created in a different context (e.g. a streamed response)
+            pass
+
 # API Routes
 @app.route('/')
 def index():
@@ -404,14 +483,21 @@ def add_column_comment():
     db.session.commit()
     return jsonify({'message': f'Comment added for {table_name}.{column_name}'})
 
+# LLM-bound routes are async views (needs flask[async]); the graph awaits
+# the provider instead of blocking on it, and blocking SQLite work runs on a
+# thread so the event loop keeps moving. Only when served from asgi.py
+# (uvicorn asgi:application) do they run as tasks on one shared event loop;
+# under app.run or another WSGI server each request still holds a worker
+# thread and its own loop, so concurrency stays bound by the server's threads.
 @app.route('/chatbot', methods=['POST'])
-def chat():
+@admit('chat')
+async def chat():
     user_input = request.json.get('user_input')
     thread_id = request.json.get('thread_id')
     if not user_input:
         return jsonify({"error": "user_input is required"}), 400
     
-    response = run_qgn_chatbot(user_input, thread_id)
+    response = await arun_qgn_chatbot(user_input, thread_id)
     return jsonify({"response": response})
 
 @app.route('/api/login', methods=['POST'])
@@ -429,53 +515,58 @@ def login():
 @app.route("/api/get-bot-messages/<thread_id>")
 def get_bot_messages(thread_id):
     try:
-        messages=get_messages(thread_id)
-        return {'messages': messages}
+        # ?since=<cursor> returns only the messages added after a previous response's cursor
+        since = request.args.get('since', 0, type=int)
+        return get_history(thread_id, since)
         
     except Exception as e:
         print(f'Error: {str(e)}')
         return {'error': str(e)}, 500
     
 @app.route("/api/get-query-result", methods=['POST'])
-def get_query_result():
+@admit('chat')
+async def get_query_result():
     try:
         user_input = request.json.get('user_input')
         thread_id = request.json.get('thread_id')
         if not user_input:
             return jsonify({"error": "user_input is required"}), 400
         
-        sql = run_qgn_chatbot(user_input, thread_id)
+        with tracing.span('graph'):
+            sql = await arun_qgn_chatbot(user_input, thread_id)
         
         if not sql or sql == "Your query description is not sufficient to generate a valid query.":
             return {'query': '', 'data': []}
         sql = extract_sql(sql)
         print('sql:',sql)
-        result = db.session.execute(text(sql))
-        
-        # For SELECT queries only - simpler approach
-        rows = result.fetchall()
-        columns = result.keys()
-        data_rows = [dict(zip(columns, row)) for row in rows]
-        
-        return {'query': sql, 'data': data_rows}
+        with tracing.span('sql_gate'):
+            try:
+                gated_sql, row_cap, cost = await asyncio.to_thread(sql_gate.prepare, sql, gate_query)
+            except sql_gate.QueryRejected as e:
+                return jsonify({'query': sql, 'data': [], 'error': str(e), 'rejected': True}), 422
+        with tracing.span('sql_execute'):
+            # to_thread copies the context, so the app context and db.session come along
+            data_rows = await asyncio.to_thread(execute_select, gated_sql)
+        truncated = row_cap is not None and len(data_rows) > row_cap
+        if truncated:
+            data_rows = data_rows[:row_cap]
+        
+        with tracing.span('serialize'):
+            return jsonify({'query': sql, 'data': data_rows, 'truncated': truncated})
         
     except Exception as e:
         print(f'Error: {str(e)}')
         return {'error': str(e)}, 500
     
 @app.route("/api/get-query-result2", methods=['POST'])
+@admit('interactive')
 def get_query_result2():
     try:
         query = request.json.get('query')
         if not query:
             return jsonify({"error": "query is required"}), 400
         
-        result = db.session.execute(text(query))
-        
-        # For SELECT queries only - simpler approach
-        rows = result.fetchall()
-        columns = result.keys()
-        data_rows = [dict(zip(columns, row)) for row in rows]
+        data_rows = execute_select(query)
         
         return { 'data': data_rows}
         
@@ -483,6 +574,50 @@ def get_query_result2():
         print(f'Error: {str(e)}')
         return {'error': str(e)}, 500
 
+@app.route("/api/batch-query", methods=['POST'])
+@admit('batch')
+def batch_query():
+    """Generate SQL for a list of questions, streaming one JSON line per result"""
+    questions = request.json.get('questions')
+    if not questions or not isinstance(questions, list):
+        return jsonify({"error": "questions must be a non-empty list"}), 400
+    try:
+        concurrency = int(request.json.get('concurrency', DEFAULT_CONCURRENCY))
+        requests_per_minute = float(request.json.get('requests_per_minute', DEFAULT_LLM_RPM))
+    except (TypeError, ValueError):
+        return jsonify({"error": "concurrency and requests_per_minute must be numbers"}), 400
+    if concurrency < 1 or not 0 < requests_per_minute < float('inf'):
+        return jsonify({"error": "concurrency and requests_per_minute must be positive"}), 400
+    return Response(iter_batch(questions, concurrency, requests_per_minute), mimetype='application/x-ndjson')
+
+@app.route("/api/timings")
+def get_timings():
+    """Latency and token histograms for graph nodes, LLM calls, SQL and serialization"""
+    return jsonify(tracing.snapshot())
+
+@app.route("/api/profiles")
+def get_profiles():
+    """Column value profiles of every table at the current data epoch"""
+    try:
+        return jsonify(profiles.get_store().refresh(schema_reader.get_all_tables()))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route("/api/llm-stats")
+def get_llm_stats():
+    """Hedging, retry and circuit breaker state per LLM provider"""
+    return jsonify(llm_call.all_stats())
+
+@app.route("/api/workloads")
+def get_workloads():
+    """Admission control queue depth, wait times and rejections per workload class"""
+    return jsonify(scheduler.stats())
+
+@app.route("/api/single-flight-stats")
+def get_single_flight_stats():
+    """Coalescing counters for LLM and SQL work"""
+    return jsonify([llm_flight.stats(), sql_flight.stats()])
+
 
 # HTML Template
 INDEX_TEMPLATE = '''
@@ -667,6 +802,7 @@ def create_dashboard():
         
         db.session.add(new_dashboard)
         db.session.commit()
+        publish('dashboard', {'action': 'created', 'dashboard_id': new_dashboard.id, 'user_id': new_dashboard.user_id}, key=new_dashboard.user_id)
         
         return jsonify({
             'message': 'Dashboard created successfully',
@@ -719,6 +855,7 @@ def update_user(dashboard_id):
             dashboard.columns=data['columns']
         
         db.session.commit()
+        publish('dashboard', {'action': 'updated', 'dashboard_id': dashboard_id, 'user_id': dashboard.user_id}, key=dashboard.user_id)
         
         return jsonify({
             'message': 'Dashboard updated successfully',
@@ -739,6 +876,7 @@ def delete_user(dashboard_id):
         
         db.session.delete(user)
         db.session.commit()
+        publish('dashboard', {'action': 'deleted', 'dashboard_id': dashboard_id, 'user_id': user.user_id}, key=user.user_id)
         
         return jsonify({'message': 'Dashboard deleted successfully'}), 200
         
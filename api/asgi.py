@@ -0,0 +1,169 @@
+"""
+ASGI entry point for the SQL app (api2.py).
+
+Under a WSGI server (app.run, flask run) every async view still holds a
+worker thread and runs in its own event loop. Served from here, the async
+views (/chatbot, /api/get-query-result) run as tasks on the server's event
+loop instead, so many chats waiting on the LLM share one thread. Every
+other route goes to the WSGI app through asgiref's WsgiToAsgi, on its
+thread pool, as before.
+
+Run from the api directory (pip install uvicorn):
+    uvicorn asgi:application --port 5000
+
+One worker process: admission control, single-flight and the caches are
+per process.
+"""
+import sys
+import asyncio
+import logging
+from io import BytesIO
+from flask import request, request_started
+from werkzeug.exceptions import HTTPException
+from asgiref.wsgi import WsgiToAsgi
+import metrics
+
+def _path(scope):
+    """Request path below the app's root_path"""
+    root, path = scope.get('root_path', ''), scope['path']
+    return path[len(root):] if root and path.startswith(root) else path
+
+def _environ(scope, body):
+    """WSGI environ of an ASGI http scope, for Flask's request context"""
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+        'PATH_INFO': _path(scope).encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('ascii'),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'SERVER_NAME': scope['server'][0] if scope.get('server') else 'localhost',
+        'SERVER_PORT': str(scope['server'][1]) if scope.get('server') else '80',
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        value = value.decode('latin1')
+        environ[name] = f'{environ[name]},{value}' if name in environ else value
+    # the body is read in full, also when it came chunked
+    environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
+
+async def _read_body(receive):
+    """The request body, None if the client went away before sending it"""
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return bytes(body)
+
+def _closing(wsgi_app):
+    """
+    WSGI app that closes the response iterable once it is consumed.
+    WsgiToAsgi iterates the body but never calls close(), which would skip
+    call_on_close hooks (admission slots) and the request metrics.
+    """
+    def app(environ, start_response):
+        body = wsgi_app(environ, start_response)
+        try:
+            yield from body
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+    return app
+
+class AsyncViews:
+    """
+    ASGI app that awaits the Flask app's coroutine views on the event loop.
+
+    Requests whose URL rule points to a coroutine view get their request
+    context on the current task (Flask keeps its contexts in contextvars,
+    so concurrent tasks do not see each other's), run the app's
+    before_request hooks, await the view and send the finalized response.
+    request_started is sent as in full_dispatch_request, and the request is
+    recorded like MetricsMiddleware does. Everything else is handed to the
+    WSGI app.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.wsgi = WsgiToAsgi(_closing(app))
+        self.metrics = app.wsgi_app if isinstance(app.wsgi_app, metrics.MetricsMiddleware) else None
+
+    def _async_view(self, scope):
+        adapter = self.app.url_map.bind(scope['server'][0] if scope.get('server') else 'localhost')
+        try:
+            rule, _ = adapter.match(_path(scope), method=scope['method'], return_rule=True)
+        except HTTPException:
+            return None
+        view = self.app.view_functions.get(rule.endpoint)
+        return view if asyncio.iscoroutinefunction(view) else None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or self._async_view(scope) is None:
+            return await self.wsgi(scope, receive, send)
+        body = await _read_body(receive)
+        if body is None:
+            return
+        environ = _environ(scope, body)
+        finish = self.metrics.track(environ) if self.metrics else None
+        status, size = 500, 0
+        try:
+            response = await self._dispatch(environ)
+            status = response.status_code
+            try:
+                await send({'type': 'http.response.start', 'status': status,
+                            'headers': [(k.lower().encode('latin1'), v.encode('latin1'))
+                                        for k, v in response.headers.items()]})
+                # the async views return JSON, not streams, so the body is at hand
+                for chunk in response.iter_encoded():
+                    size += len(chunk)
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                await send({'type': 'http.response.body', 'body': b''})
+            finally:
+                # call_on_close hooks, e.g. the admission slot
+                response.close()
+        finally:
+            if finish is not None:
+                finish(str(status), size)
+
+    async def _dispatch(self, environ):
+        app = self.app
+        with app.request_context(environ):
+            request_started.send(app, _async_wrapper=app.ensure_sync)
+            try:
+                rv = app.preprocess_request()
+                if rv is None:
+                    rv = await app.view_functions[request.url_rule.endpoint](**request.view_args)
+                return app.finalize_request(rv)
+            except Exception as e:
+                try:
+                    return app.finalize_request(app.handle_user_exception(e))
+                except Exception as e:
+                    logging.exception(f'Error serving {environ["PATH_INFO"]}')
+                    return app.finalize_request(app.handle_exception(e), from_error_handler=True)
+
+_application = None
+
+def __getattr__(name):
+    """application is built on first access, so importing AsyncViews does not load api2"""
+    global _application
+    if name != 'application':
+        raise AttributeError(name)
+    if _application is None:
+        from api2 import app, db
+        with app.app_context():
+            db.create_all()
+        _application = AsyncViews(app)
+    return _application
@@ -0,0 +1,86 @@
+import os
+import numpy as np
+from ultralytics.trackers.track import TRACKER_MAP
+from ultralytics.utils import IterableSimpleNamespace
+from ultralytics.utils.checks import check_yaml
+try:
+    from ultralytics.utils import YAML
+    _load_yaml = YAML.load
+except ImportError:
+    from ultralytics.utils import yaml_load as _load_yaml
+
+# Frames per detection call for offline (uploaded) videos; 1 keeps model.track
+DEFAULT_BATCH_SIZE = int(os.getenv('COUNT_BATCH_SIZE', '1'))
+# model.track defaults, so batched counting sees the same boxes and ids
+TRACKER = os.getenv('COUNT_TRACKER', 'botsort.yaml')
+TRACK_CONF = 0.1
+TRACK_FRAME_RATE = 30
+
+def batched(items, size):
+    """Group an iterable into lists of up to size items"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def make_tracker(tracker=TRACKER, frame_rate=TRACK_FRAME_RATE):
+    """A tracker configured like the one model.track registers"""
+    cfg = IterableSimpleNamespace(**_load_yaml(check_yaml(tracker)))
+    if cfg.tracker_type not in TRACKER_MAP:
+        raise ValueError(f"Unsupported tracker type '{cfg.tracker_type}'")
+    return TRACKER_MAP[cfg.tracker_type](args=cfg, frame_rate=frame_rate)
+
+class BatchTracker:
+    """
+    Detection on batches of frames followed by tracking in frame order.
+
+    model.track runs one frame per forward pass. Offline, frames can be
+    detected several at a time (one predict call on a list, which vectorizes
+    better on CPU) and the tracker can then consume the detections frame by
+    frame, exactly as model.track would have, so track ids and therefore
+    counts stay the same.
+
+    detect and track are separate steps so they can run as separate pipeline
+    stages; track must see batches in order.
+    """
+
+    def __init__(self, model, tracker=TRACKER, conf=TRACK_CONF):
+        self.model = model
+        self.conf = conf
+        self.tracker = make_tracker(tracker)
+
+    def detect(self, batch):
+        """[(index, frame)] -> [(index, frame, Results)]"""
+        results = self.model.predict([frame for _, frame in batch], conf=self.conf, verbose=False)
+        return [(index, frame, result) for (index, frame), result in zip(batch, results)]
+
+    def track(self, detected):
+        """[(index, frame, Results)] -> [(index, frame, boxes, track ids, class ids)]"""
+        tracked = []
+        for index, frame, result in detected:
+            det = result.boxes.cpu().numpy()
+            # x1, y1, x2, y2, track id, score, class, detection index
+            # updated on empty frames too, so lost tracks age as under model.track
+            tracks = np.asarray(self.tracker.update(det, frame)).reshape(-1, 8)
+            if not len(tracks):
+                # model.track leaves such a frame's results untouched, without ids
+                tracked.append((
+                    index,
+                    frame,
+                    det.xyxy.astype(np.int64).reshape(-1, 4),
+                    np.full(len(det), -1, dtype=np.int64),
+                    det.cls.astype(np.int64).reshape(-1)
+                ))
+                continue
+            tracked.append((
+                index,
+                frame,
+                tracks[:, :4].astype(np.int64),
+                tracks[:, 4].astype(np.int64),
+                tracks[:, 6].astype(np.int64)
+            ))
+        return tracked
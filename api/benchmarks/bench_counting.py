@@ -0,0 +1,116 @@
+"""
+CPU benchmark of batched detection for offline video counting.
+
+For each batch size, times detection alone on the first --frames sampled
+frames, and then a full count_object run over the video. It reports frames
+per second and checks that the in/out counts match batch size 1 (tracking
+must see the same detections in the same order).
+
+With --segments it instead times segmented counting in the worker pool for
+each segment count, to check that throughput scales with the workers
+(COUNT_WORKERS) and how far the merged counts are from one pass.
+
+Usage (from the api directory):
+    python -m benchmarks.bench_counting --video static/<upload>.mp4 --batch-sizes 1,2,4,8,16
+    COUNT_WORKERS=4 python -m benchmarks.bench_counting --video static/<upload>.mp4 --segments 1,2,4
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def detection_fps(model, frames, batch_size, conf):
+    from batch_inference import batched
+    started = time.perf_counter()
+    for batch in batched(frames, batch_size):
+        model.predict(batch, conf=conf, verbose=False)
+    return len(frames) / (time.perf_counter() - started)
+
+def count_run(video, line, stride, batch_size):
+    import counter
+    started = time.perf_counter()
+    last = None
+    for event in counter.count_object(video, line[:2], line[2:], stride=stride, batch_size=batch_size):
+        last = json.loads(event)
+    elapsed = time.perf_counter() - started
+    processed = last['stages']['postprocess']['items'] if last else 0
+    return {
+        'seconds': round(elapsed, 2),
+        'fps': round(processed / elapsed, 1) if elapsed else None,
+        'in': last['in'] if last else None,
+        'out': last['out'] if last else None,
+        'stages': last['stages'] if last else {}
+    }
+
+def segmented_run(video, line, stride, segments):
+    import inference_pool
+    started = time.perf_counter()
+    last = None
+    for event in inference_pool.count_object(video, line, stride=stride, segments=segments):
+        last = json.loads(event)
+    elapsed = time.perf_counter() - started
+    return {
+        'seconds': round(elapsed, 2),
+        'in': last['in'] if last else None,
+        'out': last['out'] if last else None,
+        'duplicates': last.get('duplicates') if last else None
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Batched detection benchmark for video counting')
+    parser.add_argument('--video', required=True)
+    parser.add_argument('--line', default='5,218,856,204', help='x1,y1,x2,y2 in the 860x480 frame')
+    parser.add_argument('--batch-sizes', default='1,2,4,8,16')
+    parser.add_argument('--stride', type=int, default=3)
+    parser.add_argument('--frames', type=int, default=64, help='frames for the detection-only timing')
+    parser.add_argument('--skip-full', action='store_true', help='only time detection')
+    parser.add_argument('--segments', help='segment counts to time instead, e.g. 1,2,4')
+    args = parser.parse_args()
+
+    os.chdir(API_DIR)
+    sys.path.insert(0, API_DIR)
+    if args.segments:
+        line = tuple(int(value) for value in args.line.split(','))
+        for segments in [int(count) for count in args.segments.split(',')]:
+            print(f'segments {segments}: {json.dumps(segmented_run(args.video, line, args.stride, segments))}')
+        return 0
+    import cv2
+    import model_registry
+    from video_io import FrameSampler
+    from batch_inference import TRACK_CONF
+
+    batch_sizes = [int(size) for size in args.batch_sizes.split(',')]
+    line = tuple(int(value) for value in args.line.split(','))
+    model = model_registry.get_model()
+
+    frames = []
+    with FrameSampler(args.video, stride=args.stride) as sampler:
+        for _, frame in sampler:
+            frames.append(cv2.resize(frame, (860, 480)))
+            if len(frames) >= args.frames:
+                break
+    if not frames:
+        print(f'No frames could be read from {args.video}')
+        return 1
+
+    results = {}
+    for batch_size in batch_sizes:
+        result = {'detection_fps': round(detection_fps(model, frames, batch_size, TRACK_CONF), 1)}
+        if not args.skip_full:
+            result.update(count_run(args.video, line, args.stride, batch_size))
+        results[batch_size] = result
+        print(f'batch {batch_size}: {json.dumps(result)}')
+
+    if not args.skip_full and 1 in results:
+        reference = (results[1]['in'], results[1]['out'])
+        for batch_size, result in results.items():
+            if (result['in'], result['out']) != reference:
+                print(f"MISMATCH batch {batch_size}: in/out {result['in']}/{result['out']} != {reference[0]}/{reference[1]}")
+                return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
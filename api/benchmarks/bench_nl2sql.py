@@ -0,0 +1,205 @@
+"""
+Offline benchmark for the NL -> SQL pipeline.
+
+Runs the chat graph, chat history, the LCEL generator and the
+/api/get-query-result route against a fake chat model and a database seeded
+from sample_data.sql, then reports throughput, p50/p99 latency and the mean
+time per instrumented phase. No network access is needed.
+
+Usage (from the api directory):
+    python -m benchmarks.bench_nl2sql --requests 200 --concurrency 16 --latency 0.05
+    python -m benchmarks.bench_nl2sql --save-baseline
+"""
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+QUESTIONS = [
+    ('find the total number of orders', 'orders', 'SELECT COUNT(*) AS total_orders FROM orders'),
+    ('get revenue per product category', 'products,order_items',
+     'SELECT p.category, SUM(oi.quantity * oi.unit_price) AS total_revenue FROM order_items oi JOIN products p ON p.product_id = oi.product_id GROUP BY p.category'),
+    ('find customers with completed orders', 'customers,orders',
+     "SELECT DISTINCT c.name, c.email FROM customers c JOIN orders o ON o.customer_id = c.customer_id WHERE o.status = 'Completed'"),
+    ('calculate average order amount per status', 'orders',
+     'SELECT status, AVG(total_amount) AS average_amount FROM orders GROUP BY status'),
+]
+
+def seed_database(path, scale=1):
+    """
+    Create a SQLite database from sample_data.sql.
+
+    The script is written for MySQL, so AUTO_INCREMENT keys are rewritten for
+    SQLite. With scale > 1 the orders and order items are replicated scale
+    times to benchmark larger tables.
+    """
+    with open(os.path.join(API_DIR, 'sample_data.sql'), 'r') as file:
+        script = file.read()
+    script = re.sub(r'\bINT PRIMARY KEY AUTO_INCREMENT\b', 'INTEGER PRIMARY KEY AUTOINCREMENT', script)
+    connection = sqlite3.connect(path)
+    connection.executescript(script)
+    for _ in range(scale - 1):
+        connection.execute(
+            "INSERT INTO order_items (order_id, product_id, quantity, unit_price) "
+            "SELECT order_id, product_id, quantity, unit_price FROM order_items WHERE item_id <= 24")
+        connection.execute(
+            "INSERT INTO orders (customer_id, order_date, total_amount, status) "
+            "SELECT customer_id, order_date, total_amount, status FROM orders WHERE order_id <= 20")
+    connection.commit()
+    connection.close()
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+def phase_breakdown(before, after):
+    """Mean milliseconds per '<phase>_seconds' histogram over the run"""
+    phases = {}
+    for name, hist in after.items():
+        if not name.endswith('_seconds'):
+            continue
+        prev = before.get(name, {'count': 0, 'sum': 0.0})
+        count = hist['count'] - prev['count']
+        if count:
+            phases[name[:-8]] = round((hist['sum'] - prev['sum']) / count * 1000, 2)
+    return phases
+
+def run_scenario(name, fn, requests, concurrency, tracing):
+    """Call fn(i) for i in range(requests) on concurrency threads"""
+    latencies = []
+    errors = 0
+
+    def timed(i):
+        started = time.perf_counter()
+        fn(i)
+        return time.perf_counter() - started
+
+    before = tracing.snapshot()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(timed, i) for i in range(requests)]
+        for future in futures:
+            try:
+                latencies.append(future.result())
+            except Exception as e:
+                errors += 1
+                print(f'{name}: {e}', file=sys.stderr)
+    elapsed = time.perf_counter() - started
+    return {
+        'requests': requests,
+        'errors': errors,
+        'throughput_rps': round(requests / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'phases_ms': phase_breakdown(before, tracing.snapshot())
+    }
+
+def compare(results, baseline, tolerance):
+    """Return the regressions of results against baseline"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result['p99_ms'] > base['p99_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {result['p99_ms']}ms > baseline {base['p99_ms']}ms")
+        if result['throughput_rps'] < base['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {result['throughput_rps']}rps < baseline {base['throughput_rps']}rps")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline NL -> SQL benchmark')
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.02, help='fake LLM latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra deterministic per-prompt latency in seconds')
+    parser.add_argument('--tail-rate', type=float, default=0.0, help='fraction of fake LLM calls that are slow')
+    parser.add_argument('--tail-latency', type=float, default=0.0, help='extra seconds for slow fake LLM calls')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of fake LLM calls that fail')
+    parser.add_argument('--scale', type=int, default=1, help='replicate sample orders this many times')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    os.chdir(API_DIR)
+    workdir = tempfile.mkdtemp(prefix='bench_nl2sql_')
+    database = os.path.join(workdir, 'bench.db')
+    seed_database(database, args.scale)
+    # api2 reads the database location at import time
+    os.environ['DATABASE_PATH'] = database
+    sys.path.insert(0, API_DIR)
+
+    from benchmarks.fake_llm import install_fake_llm
+    fake = install_fake_llm(
+        latency=args.latency,
+        jitter=args.jitter,
+        tail_rate=args.tail_rate,
+        tail_latency=args.tail_latency,
+        error_rate=args.error_rate,
+        table_replies={q: tables for q, tables, _ in QUESTIONS},
+        sql_replies={q: sql for q, _, sql in QUESTIONS}
+    )
+    from gen_sql import tracing
+    from gen_sql.schema import get_schema
+    from gen_sql.sql_gen_lg import run_qgn_chatbot, get_messages
+    from gen_sql import lc_gen_query
+    import api2
+
+    with api2.app.app_context():
+        api2.db.create_all()
+    client = api2.app.test_client()
+
+    def question(i):
+        return QUESTIONS[i % len(QUESTIONS)][0]
+
+    def post_query_result(i):
+        # closing the response releases its admission slot
+        with client.post('/api/get-query-result', json={'user_input': question(i), 'thread_id': f'bench-route-{i}'}) as response:
+            if response.status_code != 200:
+                raise RuntimeError(f'status {response.status_code}: {response.get_data(as_text=True)[:200]}')
+
+    schema_str = get_schema()
+    scenarios = [
+        ('run_qgn_chatbot', lambda i: run_qgn_chatbot(question(i), f'bench-{i}')),
+        ('get_messages', lambda i: get_messages(f'bench-{i}')),
+        ('lc_gen_query.generate_sql_query', lambda i: lc_gen_query.generate_sql_query(schema_str, question(i))),
+        ('/api/get-query-result', post_query_result),
+    ]
+
+    results = {}
+    for name, fn in scenarios:
+        results[name] = run_scenario(name, fn, args.requests, args.concurrency, tracing)
+        print(f'{name}: {json.dumps(results[name])}')
+    print(f'fake LLM calls: {fake.calls}')
+    from gen_sql.llm_call import all_stats
+    print(f'LLM caller: {json.dumps(all_stats())}')
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f'Baseline written to {args.baseline}')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('No baseline found; run with --save-baseline to create one')
+        return 0
+    with open(args.baseline, 'r') as file:
+        regressions = compare(results, json.load(file), args.tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+import time
+import zlib
+import random
+import asyncio
+from typing import Any, Dict, List, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from gen_sql.llm_registry import set_chat_model
+
+class FakeSqlChatModel(BaseChatModel):
+    """
+    Deterministic offline stand-in for the Gemini chat model.
+
+    Table-selection prompts get a comma separated table list, every other
+    prompt gets a fenced SQL statement. Replies are chosen by the first key of
+    table_replies / sql_replies found in the prompt, so canned answers can be
+    matched to questions. Latency is latency + a jitter derived from the prompt
+    text, so repeated runs see identical delays.
+    """
+
+    latency: float = 0.0
+    jitter: float = 0.0
+    seed: int = 7
+    table_replies: Dict[str, str] = {}
+    sql_replies: Dict[str, str] = {}
+    default_tables: str = 'orders'
+    default_sql: str = 'SELECT COUNT(*) AS total_orders FROM orders'
+    error_rate: float = 0.0
+    tail_rate: float = 0.0
+    tail_latency: float = 0.0
+    calls: int = 0
+
+    @property
+    def _llm_type(self):
+        return 'fake-sql'
+
+    def _prompt(self, messages):
+        return '\n'.join(str(msg.content) for msg in messages)
+
+    def _delay(self, prompt):
+        if not self.jitter:
+            return self.latency
+        rng = random.Random(zlib.crc32(prompt.encode()) ^ self.seed)
+        return self.latency + rng.random() * self.jitter
+
+    def _fault(self, call_index):
+        """
+        Extra delay for this call, raising for injected errors.
+
+        Faults are drawn per call index, so a run sees the same sequence of
+        slow and failing calls every time (for exercising hedging and the
+        circuit breaker).
+        """
+        rng = random.Random(self.seed * 1000003 + call_index)
+        if rng.random() < self.error_rate:
+            raise RuntimeError(f'fake provider error (call {call_index})')
+        return self.tail_latency if rng.random() < self.tail_rate else 0.0
+
+    def _next_call(self):
+        index = self.calls
+        self.calls += 1
+        return index
+
+    def _reply(self, prompt):
+        last = prompt[prompt.rfind('description:'):] if 'description:' in prompt else prompt
+        if 'Find expected table names' in prompt:
+            for key, tables in self.table_replies.items():
+                if key in last:
+                    return tables
+            return self.default_tables
+        sql = self.default_sql
+        for key, canned in self.sql_replies.items():
+            if key in last:
+                sql = canned
+                break
+        fence = 'sql' if 'postgresql' in prompt else 'sqlite'
+        return f'```{fence}\n{sql}\n```'
+
+    def _result(self, prompt):
+        content = self._reply(prompt)
+        message = AIMessage(
+            content=content,
+            usage_metadata={
+                'input_tokens': len(prompt) // 4,
+                'output_tokens': len(content) // 4,
+                'total_tokens': (len(prompt) + len(content)) // 4
+            }
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        prompt = self._prompt(messages)
+        extra = self._fault(self._next_call())
+        time.sleep(self._delay(prompt) + extra)
+        return self._result(prompt)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        prompt = self._prompt(messages)
+        extra = self._fault(self._next_call())
+        await asyncio.sleep(self._delay(prompt) + extra)
+        return self._result(prompt)
+
+def install_fake_llm(**kwargs):
+    """
+    Register a FakeSqlChatModel under every key the app looks up.
+
+    Returns:
+        FakeSqlChatModel: The installed model
+    """
+    fake = FakeSqlChatModel(**kwargs)
+    for temperature in (None, 0.3, 0.7):
+        set_chat_model(fake, model="gemini-2.0-flash", model_provider="google_genai", temperature=temperature)
+    return fake
@@ -0,0 +1,313 @@
+import os
+import json
+import time
+import uuid
+import itertools
+import threading
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from admission import scheduler, Overloaded
+from gen_sql.sql_gen_lg import run_qgn_chatbot
+
+# Coalescible events waiting for a client beyond this are dropped oldest first
+MAX_PENDING = int(os.getenv('CHANNEL_MAX_PENDING', '64'))
+# Commands a client may have running at once
+MAX_IN_FLIGHT = int(os.getenv('CHANNEL_MAX_IN_FLIGHT', '4'))
+HEARTBEAT_SECONDS = float(os.getenv('CHANNEL_HEARTBEAT_SECONDS', '15'))
+# A disconnected client may reconnect with its client_id within this time
+RECONNECT_SECONDS = float(os.getenv('CHANNEL_RECONNECT_SECONDS', '60'))
+WORKERS = int(os.getenv('CHANNEL_WORKERS', '8'))
+# Base URL of the video app (api.py), whose counting jobs and worker pool run
+# channel counts. There is no default: both apps listen on port 5000 unless
+# told otherwise, so run the video app on its own port, e.g.
+#     flask --app api run --port 5001
+# and set COUNT_API_URL=http://localhost:5001 for this app.
+COUNT_API_URL = os.getenv('COUNT_API_URL', '').rstrip('/')
+# Longer than the job event stream's keep-alive interval
+COUNT_STREAM_TIMEOUT = 60
+
+# Channels whose events only matter in their latest state, per key
+LATEST_ONLY = {'counter', 'dashboard'}
+
+class Outbox:
+    """
+    Bounded, coalescing queue of events for one client.
+
+    Events on LATEST_ONLY channels replace a pending event with the same
+    (channel, key) in place, so a slow client gets the newest counter progress
+    instead of a backlog. When more than max_pending events wait, the oldest
+    coalescible one is dropped. Other events (chat replies, errors) are never
+    dropped; their number is bounded by rejecting commands instead.
+    """
+
+    def __init__(self, max_pending=MAX_PENDING):
+        self.max_pending = max_pending
+        self._items = OrderedDict()
+        self._seq = itertools.count(1)
+        self._cond = threading.Condition()
+        self.reliable = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def put(self, channel, data, key=None):
+        with self._cond:
+            seq = next(self._seq)
+            if channel in LATEST_ONLY:
+                slot = (channel, key)
+                if slot in self._items:
+                    self.coalesced += 1
+                    self._items[slot] = (seq, channel, data)
+                    return
+                if len(self._items) >= self.max_pending:
+                    self._drop_oldest_coalescible()
+            else:
+                slot = (channel, seq)
+                self.reliable += 1
+            self._items[slot] = (seq, channel, data)
+            self._cond.notify()
+
+    def _drop_oldest_coalescible(self):
+        for slot in self._items:
+            if slot[0] in LATEST_ONLY:
+                del self._items[slot]
+                self.dropped += 1
+                return
+
+    def get(self, timeout):
+        """Next (seq, channel, data), or None after timeout seconds"""
+        with self._cond:
+            if not self._items and not self._cond.wait_for(lambda: self._items, timeout):
+                return None
+            slot, event = self._items.popitem(last=False)
+            if slot[0] not in LATEST_ONLY:
+                self.reliable -= 1
+            self.sent += 1
+            return event
+
+    def stats(self):
+        with self._cond:
+            return {
+                'pending': len(self._items),
+                'sent': self.sent,
+                'coalesced': self.coalesced,
+                'dropped': self.dropped
+            }
+
+class Client:
+    def __init__(self, client_id):
+        self.id = client_id
+        self.outbox = Outbox()
+        self.in_flight = 0
+        self.connected = 0
+        self.disconnected_at = None
+
+class Hub:
+    """Connected clients and command execution for the multiplexed channel"""
+
+    def __init__(self, workers=WORKERS):
+        self.clients = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='channel')
+
+    def connect(self, client_id=None):
+        with self._lock:
+            self._expire()
+            client = self.clients.get(client_id) if client_id else None
+            if client is None:
+                client = Client(client_id or uuid.uuid4().hex)
+                self.clients[client.id] = client
+            client.connected += 1
+            client.disconnected_at = None
+            return client
+
+    def disconnect(self, client):
+        with self._lock:
+            client.connected -= 1
+            if client.connected <= 0:
+                client.disconnected_at = time.monotonic()
+
+    def _expire(self):
+        now = time.monotonic()
+        for client_id, client in list(self.clients.items()):
+            if client.disconnected_at is not None and now - client.disconnected_at > RECONNECT_SECONDS:
+                del self.clients[client_id]
+
+    def get(self, client_id):
+        with self._lock:
+            return self.clients.get(client_id)
+
+    def publish(self, channel, data, key=None, client_id=None):
+        """Send an event to one client, or to every client when client_id is None"""
+        with self._lock:
+            clients = [self.clients.get(client_id)] if client_id else list(self.clients.values())
+        for client in clients:
+            if client is not None:
+                client.outbox.put(channel, data, key)
+
+    def submit(self, client, workload, fn, *args):
+        """
+        Run a command for client on the channel workers.
+
+        Returns:
+            bool: False when the client has too much outstanding work
+        """
+        with self._lock:
+            if client.in_flight >= MAX_IN_FLIGHT or client.outbox.reliable >= client.outbox.max_pending:
+                return False
+            client.in_flight += 1
+
+        def run():
+            try:
+                # channel commands share the request slots of their workload class
+                scheduler.acquire(workload)
+            except Overloaded as e:
+                client.outbox.put('error', {'error': str(e), 'workload': e.workload})
+                return
+            try:
+                fn(client, *args)
+            finally:
+                scheduler.release(workload)
+        future = self._executor.submit(run)
+        future.add_done_callback(lambda _: self._finished(client))
+        return True
+
+    def _finished(self, client):
+        with self._lock:
+            client.in_flight -= 1
+
+    def stats(self):
+        with self._lock:
+            clients = list(self.clients.values())
+        return {
+            'clients': len(clients),
+            'connected': sum(1 for client in clients if client.connected > 0),
+            'in_flight': sum(client.in_flight for client in clients),
+            'outboxes': {client.id: client.outbox.stats() for client in clients}
+        }
+
+hub = Hub()
+
+def publish(channel, data, key=None, client_id=None):
+    hub.publish(channel, data, key, client_id)
+
+def _run_chat(client, command):
+    try:
+        response = run_qgn_chatbot(command['user_input'], command.get('thread_id'))
+        client.outbox.put('chat', {'id': command.get('id'), 'response': response})
+    except Exception as e:
+        client.outbox.put('chat', {'id': command.get('id'), 'error': str(e)})
+
+def _count_job_events(video, line):
+    """
+    Count a video as a job of the video app and follow its event stream.
+
+    The video app owns the uploads and the warmed-up counting workers, so
+    this process starts no model of its own.
+
+    Yields:
+        dict: count_object progress events, the last one with end true
+    """
+    submit = urllib.request.Request(
+        f'{COUNT_API_URL}/api/count-jobs', data=json.dumps({'video': video, 'line': line}).encode(),
+        headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(submit, timeout=COUNT_STREAM_TIMEOUT) as response:
+            job = json.load(response)
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(json.load(e).get('error', str(e)))
+    with urllib.request.urlopen(COUNT_API_URL + job['events_url'], timeout=COUNT_STREAM_TIMEOUT) as stream:
+        event = None
+        for raw in stream:
+            field, _, value = raw.decode().rstrip('\n').partition(': ')
+            if field == 'event':
+                event = value
+            elif field == 'data':
+                data = json.loads(value)
+                if event == 'failed':
+                    raise RuntimeError(data['error'])
+                if event in ('progress', 'done'):
+                    yield data
+                if event == 'done':
+                    return
+    raise RuntimeError('The counting job stream ended without a result')
+
+def _run_count(client, command):
+    job = command.get('id') or uuid.uuid4().hex
+    try:
+        x1, y1, x2, y2 = map(int, command['line'].split(','))
+        for progress in _count_job_events(os.path.basename(command['video']), f'{x1},{y1},{x2},{y2}'):
+            client.outbox.put('counter', dict(progress, id=job), key=job)
+    except Exception as e:
+        client.outbox.put('error', {'id': job, 'error': str(e)})
+
+COMMANDS = {
+    'chat': ('chat', _run_chat),
+    'count': ('batch', _run_count),
+}
+
+def _format(seq, channel, data):
+    return f'id: {seq}\nevent: {channel}\ndata: {json.dumps(data, default=str)}\n\n'
+
+channel_bp = Blueprint('channel', __name__)
+
+@channel_bp.route('/api/channel')
+def open_channel():
+    """
+    Server-sent event stream multiplexing chat replies ('chat'), counter
+    progress ('counter'), dashboard refreshes ('dashboard') and errors for one
+    client. The first event ('hello') carries the client_id to post commands
+    to; pass it back as ?client_id= to resume after a reconnect.
+    """
+    client = hub.connect(request.args.get('client_id'))
+
+    def events():
+        try:
+            yield _format(0, 'hello', {'client_id': client.id})
+            while True:
+                event = client.outbox.get(HEARTBEAT_SECONDS)
+                # a comment line keeps proxies from closing an idle stream
+                yield ': keep-alive\n\n' if event is None else _format(*event)
+        finally:
+            hub.disconnect(client)
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@channel_bp.route('/api/channel/<client_id>', methods=['POST'])
+def post_command(client_id):
+    """
+    Queue a command for a connected client; the result arrives on its stream.
+
+    {"type": "chat", "id": ..., "user_input": ..., "thread_id": ...}
+    {"type": "count", "id": ..., "video": ..., "line": "x1,y1,x2,y2"}
+    """
+    client = hub.get(client_id)
+    if client is None:
+        return jsonify({'error': 'Unknown client, open /api/channel first'}), 404
+    command = request.get_json() or {}
+    if command.get('type') not in COMMANDS:
+        return jsonify({'error': f"type must be one of {', '.join(COMMANDS)}"}), 400
+    if command['type'] == 'chat' and not command.get('user_input'):
+        return jsonify({'error': 'user_input is required'}), 400
+    if command['type'] == 'count' and not (command.get('video') and command.get('line')):
+        return jsonify({'error': 'video and line are required'}), 400
+    if command['type'] == 'count' and not COUNT_API_URL:
+        return jsonify({'error': 'Counting is not configured, set COUNT_API_URL to the video app'}), 503
+
+    workload, fn = COMMANDS[command['type']]
+    if not hub.submit(client, workload, fn, command):
+        response = jsonify({'error': 'Too many pending commands, wait for replies first.'})
+        response.status_code = 429
+        response.headers['Retry-After'] = '1'
+        return response
+    return jsonify({'accepted': True, 'id': command.get('id')}), 202
+
+@channel_bp.route('/api/channel-stats')
+def get_channel_stats():
+    return jsonify(hub.stats())
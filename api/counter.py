@@ -1,8 +1,15 @@
 import cv2
-from ultralytics import YOLO
+import numpy as np
+import model_registry
 import sys
 import json
 import os
+import time
+import metrics
+from video_io import FrameSampler
+from pipeline import Pipeline
+from batch_inference import BatchTracker, batched, DEFAULT_BATCH_SIZE
+from tracks import TrackState, class_mask, IN, OUT
 #import urllib.parse
 
 #resource_dir = os.getcwd().replace('python-scripts','')
@@ -15,83 +22,155 @@ def RGB(event, x, y, flags, param):
 def calculate(x, y, x1, y1, x2, y2):
     return (x-x1)*(y2-y1) - (y-y1)*(x2-x1)
 
-def count_object(videoPath, line_p1, line_p2):
+class DebugWindow:
+    """
+    Debug sink for count_object: draws boxes, the counting line and the in
+    count and shows the frame in an OpenCV window. Needs a display; returns
+    False (stop) when ESC is pressed.
+    """
+
+    def __init__(self, name='RGB'):
+        self.name = name
+        cv2.namedWindow(self.name)
+        cv2.setMouseCallback(self.name, RGB)
+
+    def __call__(self, frame, detections, line_p1, line_p2, car_in, car_out):
+        for (x1, y1, x2, y2), track_id, class_name, crossed in detections:
+            color = (0, 255, 0) if crossed == 'in' else (255, 0, 0)
+            cv2.rectangle(frame, (x1, y1), (x2, y2), color=color, thickness=2)
+        cv2.line(frame, line_p1, line_p2, color=(0, 255, 255), thickness=2)
+        cv2.putText(frame, f'count in:{car_in}', (100, 100), cv2.FONT_HERSHEY_COMPLEX, 3, (0, 255, 255), 2)
+        cv2.imshow(self.name, frame)
+        return cv2.waitKey(1) & 0xFF != 27
+
+    def close(self):
+        cv2.destroyWindow(self.name)
+
+DEFAULT_CLASSES = ['car', 'bus', 'truck', 'cow']
+MODEL = 'yolo11n.pt'
+
+def tracking_pipeline(model, cap, batch_size=None):
+    """
+    Decode, inference and (for batch_size > 1) tracking stages over the
+    frames of cap, a FrameSampler, resized to the 860x480 counting frame.
+
+    Returns:
+        Pipeline: batches of (frame index, frame, boxes, track ids, class ids)
+    """
+    def decoded():
+        for index, frame in cap:
+            yield index, cv2.resize(frame,(860,480))
+
+    def infer(batch):
+        index, frame = batch[0]
+        results = model.track(frame, persist=True, verbose=False)
+        metrics.VIDEO_FRAMES.inc()
+        if not results or results[0].boxes is None:
+            return [(index, frame, np.empty((0, 4), dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))]
+        boxes = results[0].boxes.xyxy.int().cpu().numpy()
+        track_ids = results[0].boxes.id.int().cpu().numpy() if results[0].boxes.id is not None else np.full(len(boxes), -1)
+        class_ids = results[0].boxes.cls.int().cpu().numpy()
+        return [(index, frame, boxes, track_ids, class_ids)]
+
+    batch_size = max(1, batch_size or DEFAULT_BATCH_SIZE)
+    if batch_size == 1:
+        # the tracker is stateful, so a single inference stage keeps frames in order
+        stages = [('inference', infer)]
+    else:
+        batch_tracker = BatchTracker(model)
+
+        def detect(batch):
+            metrics.VIDEO_FRAMES.inc(len(batch))
+            return batch_tracker.detect(batch)
+        stages = [('inference', detect), ('tracking', batch_tracker.track)]
+    return Pipeline(batched(decoded(), batch_size), stages)
+
+def count_object(videoPath, line_p1, line_p2, debug_sink=None, stride=None, target_fps=None, batch_size=None, classes=None):
+    """
+    Count tracked objects crossing the line line_p1-line_p2.
+
+    Runs headless: no windows and no drawing, so it works on servers without
+    a display. Pass debug_sink (e.g. DebugWindow()) to look at the frames; it
+    is called with the frame, the detections ((box, track id, class name,
+    'in'|'out'|None) tuples), the line and the counts, and stops counting
+    when it returns False.
+
+    Only every stride-th frame (default COUNT_FRAME_STRIDE, 3), or target_fps
+    frames per second of video, is decoded and run through the tracker.
+    Decoding, inference and the line-crossing bookkeeping run as pipeline
+    stages on separate threads; the last event reports their throughput.
+
+    For uploaded videos batch_size > 1 (default COUNT_BATCH_SIZE) detects that
+    many frames per forward pass and then tracks them in frame order, which
+    gives the same counts as frame-by-frame model.track with better CPU use.
+    Live sources should keep batch_size 1, as batching adds latency.
+
+    classes lists the class names to count (default DEFAULT_CLASSES).
+
+    Yields:
+        str: JSON progress with in/out counts, frame position and the
+        processed frames per second
+    """
     #videoPath=os.path.join(resource_dir,'public','videos', videoPath)
     print(line_p1, line_p2, videoPath)
-    model= YOLO('yolo11n.pt')
-    cv2.namedWindow('RGB')
-    cv2.setMouseCallback('RGB', RGB)
+    # per-stream tracker state over the shared, pre-warmed weights
+    model= model_registry.new_session(MODEL)
     #print(model.names) 1751231169225-vm.mp4
-    cap=cv2.VideoCapture(videoPath)
-    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) 
+    cap=FrameSampler(videoPath, stride=stride, target_fps=target_fps)
+    frame_count = cap.frame_count
+    pipeline = tracking_pipeline(model, cap, batch_size)
+    postprocess = pipeline.add_stats('postprocess')
+    batches = iter(pipeline)
+    frames = (item for batch in batches for item in batch)
     count=-1
-    allowed_classes=['car', 'bus', 'truck', 'cow']
-    hist={}
-    counted=set()
+    allowed_classes=classes or DEFAULT_CLASSES
+    allowed_ids=np.array([class_id for class_id, name in model.names.items() if name in allowed_classes])
+    tracks=TrackState(line_p1, line_p2)
     car_in=0
     car_out=0
-    while True:    
-        ret,frame = cap.read()
-        if not ret:
-            break
-        count += 1
-        if count % 3 != 0:
-            continue
-        frame=cv2.resize(frame,(860,480))
-        results = model.track(frame, persist=True)
-        if results and results[0].boxes is not None:
-            #print(results[0].boxes)
-            boxes = results[0].boxes.xyxy.int().cpu().tolist()
-            track_ids = results[0].boxes.id.int().cpu().tolist() if results[0].boxes.id is not None else [-1]*len(boxes)
-            class_ids = results[0].boxes.cls.int().cpu().tolist() 
-            
-            for box, track_id, class_id in zip(boxes, track_ids, class_ids):
-                class_name = model.names[class_id]
-                #print(class_name)
-                if class_name not in allowed_classes:
-                    continue
-                x1, y1, x2, y2 = map(int, box)
-                cx=(x1+x2)//2
-                cy=(y1+y2)//2
-                cv2.rectangle(frame, (x1, y1), (x2, y2), color=(255,0,0),thickness= 2)
-                if track_id in hist and track_id not in counted:
-                    prev_cx, prev_cy=hist[track_id]
-                    side_1=calculate(prev_cx, prev_cy, *line_p1, *line_p2)
-                    side_2=calculate(cx, cy, *line_p1, *line_p2)
-                    if side_1*side_2<0:
-                        if side_2<0:
-                            #car in
-                            car_in +=1
-                            print('carIn::', car_in)
-                            cv2.rectangle(frame, (x1, y1), (x2, y2), color=(0,255,0),thickness= 2)
-                        else:
-                            car_out +=1
-                            #cv2.rectangle(frame, (x1, y1), (x2, y2), color=(0,0,255),thickness= 2)
-                        counted.add(track_id)
-                    
-
-                #print(f'x1:{x1}, y1:{y1}, x2:{x2} y2:{y2}, center({cx}, {cy}), id:{track_id} name:{class_name}')
-                
-                cv2.line(frame, line_p1, line_p2, color=(0, 255, 255), thickness=2)
-                cv2.putText(frame,f'count in:{car_in}',(100,100),cv2.FONT_HERSHEY_COMPLEX,3,(0,255,255),2)
-                #cv2.putText(frame,f'count out:{car_out}',(100,200),cv2.FONT_HERSHEY_COMPLEX,3,(0,255,255),2)
-                hist[track_id]=(cx, cy)
-                
-        #print(hist)
-        cv2.imshow("RGB", frame)
-        yield json.dumps({"in":car_in, "out":car_out,"end":False, "totalFrames":frame_count, "currentFrame":count})
-        if cv2.waitKey(1)&0xFF==27:
-            break
-    yield json.dumps({"in":car_in, "out":car_out,"end":True,"totalFrames":frame_count, "currentFrame":count})
-    #print('Total car out: ', car_out)
-    cap.release()
-    cv2.destroyAllWindows()
+    processed=0
+    started=time.perf_counter()
+    fps=0.0
+    metrics.VIDEO_STREAMS.inc()
+    try:
+        for count, frame, boxes, track_ids, class_ids in frames:
+            post_started = time.perf_counter()
+            keep = class_mask(class_ids, allowed_ids)
+            boxes, track_ids, class_ids = boxes[keep], track_ids[keep], class_ids[keep]
+            # side tests and sign flips for every box of the frame at once
+            crossed = tracks.update(boxes, track_ids)
+            car_in, car_out = tracks.total_in, tracks.total_out
+            detections = []
+            if debug_sink is not None:
+                directions = {IN: 'in', OUT: 'out'}
+                detections = [(tuple(int(v) for v in box), int(track_id), model.names[int(class_id)], directions.get(int(c)))
+                              for box, track_id, class_id, c in zip(boxes, track_ids, class_ids, crossed)]
+
+            processed += 1
+            fps = processed / max(time.perf_counter() - started, 1e-9)
+            if debug_sink is not None and debug_sink(frame, detections, line_p1, line_p2, car_in, car_out) is False:
+                break
+            postprocess.record(time.perf_counter() - post_started, 0.0)
+            yield json.dumps({"in":car_in, "out":car_out,"end":False, "totalFrames":frame_count, "currentFrame":count, "fps":round(fps, 1)})
+        yield json.dumps({"in":car_in, "out":car_out,"end":True,"totalFrames":frame_count, "currentFrame":count, "fps":round(fps, 1), "stages":pipeline.snapshot(), "tracks":tracks.stats()})
+        #print('Total car out: ', car_out)
+    finally:
+        # stop the pipeline threads before the capture goes away under them
+        frames.close()
+        batches.close()
+        cap.release()
+        tracks.close()
+        if debug_sink is not None and hasattr(debug_sink, 'close'):
+            debug_sink.close()
+        metrics.VIDEO_STREAMS.dec()
 
 if __name__ == "__main__":
     video='D:\\animal-recogniger\\public\videos\\1751342537992-vm.mp4'
     line='5,218,856,204'
     x1,y1,x2,y2=map(int, line.split(','))
-    for res in count_object(video, (x1,y1), (x2,y2)):
+    # --headless skips the debug window, e.g. to compare frames per second
+    sink = None if '--headless' in sys.argv else DebugWindow()
+    for res in count_object(video, (x1,y1), (x2,y2), debug_sink=sink):
         print(res) 
          
          
@@ -104,4 +183,4 @@ if __name__ == "__main__":
     #   json.dumps({"line":lineText,"fileName":fileName})
     #   counter(fileName, (x1,y1), (x2,y2))
     # else:
-    #   print(json.dumps({"error": "Insufficient arguments provided"})) # Always return valid JSON
\ No newline at end of file
+    #   print(json.dumps({"error": "Insufficient arguments provided"})) # Always return valid JSON
@@ -0,0 +1,267 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+WORKERS = int(os.getenv('COUNT_JOB_WORKERS', '2'))
+# Progress events kept per job for resuming subscribers; older ones are
+# dropped, since every progress event carries the cumulative counts
+MAX_EVENTS = int(os.getenv('COUNT_JOB_MAX_EVENTS', '1000'))
+# Finished jobs kept in memory; older ones are served from the store
+MAX_FINISHED = int(os.getenv('COUNT_JOB_MAX_FINISHED', '100'))
+STORE_PATH = os.getenv('COUNT_JOBS_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'counting_jobs.db'))
+
+def job_id(video_path, line, classes, options=None):
+    """
+    Stable id of a counting job.
+
+    The file's size and modification time are part of the key, so a new
+    upload under the same name is a new job.
+    """
+    stat = os.stat(video_path)
+    key = json.dumps({
+        'video': os.path.abspath(video_path),
+        'file': [stat.st_size, stat.st_mtime_ns],
+        'line': list(line),
+        'classes': sorted(classes),
+        'options': options or {}
+    }, sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+class Job:
+    """A counting run and its event log; subscribers wait on the condition"""
+
+    def __init__(self, job_id, params):
+        self.id = job_id
+        self.params = params
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.events = deque(maxlen=MAX_EVENTS)
+        self.last_event_id = 0
+        # re-entrant, finish() publishes while holding it
+        self._cond = threading.Condition(threading.RLock())
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    def publish(self, event, data):
+        with self._cond:
+            self.last_event_id += 1
+            self.events.append((self.last_event_id, event, data))
+            self._cond.notify_all()
+
+    def finish(self, status, result=None, error=None):
+        # one critical section, so nobody sees the job finished without its final event
+        with self._cond:
+            self.status = status
+            self.result = result
+            self.error = error
+            self.finished_at = time.time()
+            self.publish(status, result if status == 'done' else {'error': error})
+
+    def events_after(self, last_event_id, timeout):
+        """
+        Events with an id above last_event_id, waiting up to timeout seconds
+        for one. A subscriber that fell behind the retained log resumes at
+        its oldest event.
+
+        Returns:
+            tuple: (events, finished)
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self.last_event_id > last_event_id or self.finished, timeout)
+            if self.finished and last_event_id > self.last_event_id and self.events:
+                # an id this job never issued (e.g. from before a restart): send the outcome
+                return [self.events[-1]], True
+            return [e for e in self.events if e[0] > last_event_id], self.finished
+
+    def latest(self):
+        with self._cond:
+            return self.events[-1][2] if self.events else None
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'params': self.params,
+            'progress': self.latest() if not self.finished else None,
+            'result': self.result,
+            'error': self.error,
+            'last_event_id': self.last_event_id,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at
+        }
+
+class JobStore:
+    """
+    Finished job results in SQLite, so they survive restarts.
+
+    The id of a job's final event is stored with it, so a rebuilt job sends
+    its outcome under the same id and subscribers resuming from an earlier
+    id still get it.
+    """
+
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS counting_jobs ('
+                'id TEXT PRIMARY KEY, params TEXT NOT NULL, status TEXT NOT NULL, result TEXT, error TEXT, '
+                'created_at REAL, finished_at REAL, last_event_id INTEGER)')
+            columns = [row[1] for row in connection.execute('PRAGMA table_info(counting_jobs)')]
+            if 'last_event_id' not in columns:
+                connection.execute('ALTER TABLE counting_jobs ADD COLUMN last_event_id INTEGER')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def save(self, job):
+        with self._lock, self._connect() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO counting_jobs '
+                '(id, params, status, result, error, created_at, finished_at, last_event_id) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (job.id, json.dumps(job.params), job.status, json.dumps(job.result), job.error,
+                 job.created_at, job.finished_at, job.last_event_id))
+
+    def load(self, job_id):
+        """A finished Job rebuilt from the store, or None"""
+        with self._lock, self._connect() as connection:
+            row = connection.execute(
+                'SELECT params, status, result, error, created_at, finished_at, last_event_id '
+                'FROM counting_jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = Job(job_id, json.loads(row[0]))
+        job.status, job.result, job.error = row[1], json.loads(row[2]) if row[2] else None, row[3]
+        job.created_at, job.finished_at = row[4], row[5]
+        # subscribers of a stored job get its outcome as the only event, under its original id
+        job.last_event_id = max(0, (row[6] or 1) - 1)
+        job.publish(job.status, job.result if job.status == 'done' else {'error': job.error})
+        return job
+
+def run_count(job):
+    """Default runner: count_object in the worker pool, the job thread only relays progress"""
+    import inference_pool
+    params = job.params
+    for progress in inference_pool.count_object(
+            params['video'], params['line'], classes=params['classes'], stride=params.get('stride'),
+            target_fps=params.get('fps'), batch_size=params.get('batch'), segments=params.get('segments')):
+        event = json.loads(progress)
+        if event.get('end'):
+            return event
+        job.publish('progress', event)
+
+class JobManager:
+    """
+    Counting jobs keyed by their parameters.
+
+    submit() returns the running job for the same (video, line, classes,
+    options), the stored result of a finished one, or starts a new run on a
+    worker. The work no longer depends on an HTTP response being open: any
+    number of subscribers follow a job's events and can resume after a
+    disconnect from the last event id they saw.
+    """
+
+    def __init__(self, runner=run_count, workers=WORKERS, store=None):
+        self.runner = runner
+        self.store = store or JobStore()
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='count-job')
+
+    def submit(self, video_path, line, classes, options=None):
+        """
+        Returns:
+            tuple: (Job, created) where created is False when an existing job or result was reused
+        """
+        options = {key: value for key, value in (options or {}).items() if value is not None}
+        job_key = job_id(video_path, line, classes, options)
+        with self._lock:
+            job = self.jobs.get(job_key)
+            if job is not None and job.status != 'failed':
+                return job, False
+            stored = self.store.load(job_key) if job is None else None
+            if stored is not None and stored.status == 'done':
+                self._remember(stored)
+                return stored, False
+            job = Job(job_key, dict(options, video=video_path, line=list(line), classes=list(classes)))
+            self._remember(job)
+        self._executor.submit(self._run, job)
+        return job, True
+
+    def _remember(self, job):
+        self.jobs[job.id] = job
+        self.jobs.move_to_end(job.id)
+        finished = [key for key, other in self.jobs.items() if other.finished]
+        for key in finished[:max(0, len(finished) - MAX_FINISHED)]:
+            del self.jobs[key]
+
+    def _run(self, job):
+        job.status = 'running'
+        job.publish('status', {'status': 'running'})
+        try:
+            result = self.runner(job)
+            job.finish('done', result=result)
+        except Exception as e:
+            logging.exception(f'Counting job {job.id} failed')
+            job.finish('failed', error=str(e))
+        try:
+            self.store.save(job)
+        except Exception as e:
+            logging.warning(f'Could not store counting job {job.id}: {e}')
+
+    def get(self, job_key):
+        with self._lock:
+            job = self.jobs.get(job_key)
+            if job is None:
+                job = self.store.load(job_key)
+                if job is not None:
+                    self._remember(job)
+            return job
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self.jobs.values())
+        statuses = {}
+        for job in jobs:
+            statuses[job.status] = statuses.get(job.status, 0) + 1
+        return {'jobs': len(jobs), 'statuses': statuses}
+
+def format_event(event_id, event, data):
+    return f'id: {event_id}\nevent: {event}\ndata: {json.dumps(data, default=str)}\n\n'
+
+def event_stream(job, last_event_id=0, heartbeat=15):
+    """Server-sent events of job after last_event_id, ending after its final event"""
+    while True:
+        events, finished = job.events_after(last_event_id, heartbeat)
+        if not events:
+            if finished:
+                return
+            yield ': keep-alive\n\n'
+            continue
+        for event_id, event, data in events:
+            yield format_event(event_id, event, data)
+            last_event_id = event_id
+        if finished and last_event_id >= job.last_event_id:
+            return
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_manager():
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+        return _manager
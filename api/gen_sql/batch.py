@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.messages import HumanMessage
+from gen_sql.sql_gen_lg import batch_graph, extract, rate_limiter
+
+DEFAULT_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '8'))
+# Upper bound for a client's concurrency: it sizes the batch's thread pool
+MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', '32'))
+# Provider limit in LLM requests per minute. Questions take one to several
+# requests depending on their route, so every request takes its own token
+DEFAULT_LLM_RPM = float(os.getenv('BATCH_LLM_RPM', '600'))
+
+class AsyncRateLimiter:
+    """Token bucket shared by the tasks of one event loop"""
+
+    def __init__(self, requests_per_minute, burst=None):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = burst or max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens=1):
+        """Wait until tokens are available and take them"""
+        if tokens > self.capacity:
+            # the bucket never holds that many, waiting would never end
+            raise ValueError(f'Cannot acquire {tokens} tokens from a bucket of {self.capacity}')
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+async def agenerate_sql(question):
+    """
+    Run the SQL generation graph for one standalone question.
+
+    Uses the checkpoint-free graph, so batch questions never touch chat threads.
+    """
+    state = {
+        "messages": [HumanMessage(content=question)],
+        "schema": '',
+        "next": ''
+    }
+    response = await batch_graph.ainvoke(state)
+    return extract(response["messages"][-1].content)
+
+async def agenerate_batch(questions, concurrency=DEFAULT_CONCURRENCY, requests_per_minute=DEFAULT_LLM_RPM):
+    """
+    Generate SQL for many questions concurrently, yielding results as they complete.
+
+    Args:
+        questions (list): Natural language questions
+        concurrency (int): Maximum questions in flight at once (at most MAX_CONCURRENCY)
+        requests_per_minute (float): LLM request rate limit for the whole batch, applied
+            to each request the graph makes (see sql_gen_lg.rate_limiter)
+
+    Yields:
+        dict: {'index', 'question', 'query'} or {'index', 'question', 'error'}
+    """
+    semaphore = asyncio.Semaphore(min(concurrency, MAX_CONCURRENCY))
+    limiter = AsyncRateLimiter(requests_per_minute)
+
+    async def run(index, question):
+        # each task runs in its own copy of the context
+        rate_limiter.set(limiter)
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                query = await agenerate_sql(question)
+                item = {'index': index, 'question': question, 'query': query}
+            except Exception as e:
+                item = {'index': index, 'question': question, 'error': str(e)}
+            item['seconds'] = round(time.monotonic() - started, 3)
+            return item
+
+    tasks = [asyncio.ensure_future(run(index, question)) for index, question in enumerate(questions)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def iter_batch(questions, concurrency=DEFAULT_CONCURRENCY, requests_per_minute=DEFAULT_LLM_RPM):
+    """
+    Synchronous wrapper over agenerate_batch for streaming WSGI responses.
+
+    Drives a private event loop whose default executor is sized to the
+    concurrency limit (the graph's synchronous nodes run there).
+
+    Yields:
+        str: One JSON line per completed question
+    """
+    concurrency = min(concurrency, MAX_CONCURRENCY)
+    loop = asyncio.new_event_loop()
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    loop.set_default_executor(executor)
+    results = agenerate_batch(questions, concurrency, requests_per_minute)
+    try:
+        while True:
+            try:
+                item = loop.run_until_complete(results.__anext__())
+            except StopAsyncIteration:
+                break
+            yield json.dumps(item) + '\n'
+    finally:
+        loop.run_until_complete(results.aclose())
+        loop.close()
+        executor.shutdown(wait=False)
@@ -1,7 +1,10 @@
-from google import genai
 import os
+import sys
 import schema
 import logging
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gen_sql.llm_registry import get_genai_client
+from gen_sql.llm_call import get_caller
 
 def get_query_prompt(tableNames, allSchema, query_description, is_double_quoted_table_name=False, table_alias='', column_alias=''):
 
@@ -71,8 +74,8 @@ def generate_sql_query(schema, query_description, is_double_quoted_table_name=Fa
     Returns:
         str: The generated SQL query
     """
-    # Initialize the Anthropic client
-    client = genai.Client(api_key=os.environ.get('GOOGLE_API_KEY'))
+    # Shared client from the registry (keeps its HTTP session between calls)
+    client = get_genai_client()
     #client = anthropic.Anthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"))
     
     prompt =get_table_name_prompt(schema, query_description, table_alias=table_alias)
@@ -80,9 +83,9 @@ def generate_sql_query(schema, query_description, is_double_quoted_table_name=Fa
     logging.info('Expected table prompt')
     logging.info(prompt)
     # Generate the expected table names
-    response = client.models.generate_content(
+    response = get_caller().call(lambda: client.models.generate_content(
     model="gemini-2.0-flash", contents=prompt
-    )
+    ))
     
     logging.info(f'table names: {response.text}')
     prompt = get_query_prompt(response.text, schema, query_description, is_double_quoted_table_name, table_alias=table_alias, column_alias=column_alias)
@@ -90,9 +93,9 @@ def generate_sql_query(schema, query_description, is_double_quoted_table_name=Fa
     logging.info('Query prompt')
     logging.info(prompt)
     # Generate the SQL query
-    response = client.models.generate_content(
+    response = get_caller().call(lambda: client.models.generate_content(
     model="gemini-2.0-flash", contents=prompt
-    )
+    ))
     logging.info(response.text)
     # Extract and return the SQL query
     return response.text.replace('```sql','').replace('```','')
@@ -1,20 +1,19 @@
-from langchain.chat_models import init_chat_model
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableLambda
 from dotenv import load_dotenv
 import re
 from . import schema
-import os
+from .llm_registry import get_chat_model
+from .llm_call import get_caller
 
 load_dotenv()
 def get_llm():
-    llm = init_chat_model(
+    return get_chat_model(
             model="gemini-2.0-flash", 
-            google_api_key=os.getenv("GOOGLE_API_KEY"),
             temperature=0.3, 
             model_provider="google_genai"
         )
-    return llm
 
 def get_table_name_prompt(schemaStr, query_description):
     tableNames = schema.extract_table_names(schemaStr)
@@ -69,13 +68,15 @@ def generate_sql_query(schemaStr, query_description, is_double_quoted_table_name
 
     query_prompt = ChatPromptTemplate.from_template('{description}')
     llm = get_llm()
+    # each model step goes through the deadline/hedging/circuit-breaker wrapper
+    guarded_llm = RunnableLambda(lambda prompt: get_caller().call(lambda: llm.invoke(prompt)))
     chain =(
         table_prompt
-        | llm
+        | guarded_llm
         | StrOutputParser()
         | (lambda tableNames: {"description": get_query_prompt(tableNames, schemaStr, query_description, is_double_quoted_table_name)})
         | query_prompt
-        | llm
+        | guarded_llm
         | StrOutputParser()
     )
 
@@ -0,0 +1,413 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from gen_sql import tracing
+
+DEFAULT_DEADLINE = float(os.getenv('LLM_DEADLINE_SECONDS', '15'))
+HEDGE_PERCENTILE = float(os.getenv('LLM_HEDGE_PERCENTILE', '0.95'))
+MAX_ATTEMPTS = int(os.getenv('LLM_MAX_ATTEMPTS', '3'))
+BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', '5'))
+BREAKER_RESET_SECONDS = float(os.getenv('LLM_BREAKER_RESET_SECONDS', '30'))
+# Retries and hedges may add at most this fraction on top of first attempts
+RETRY_BUDGET_RATIO = float(os.getenv('LLM_RETRY_BUDGET_RATIO', '0.1'))
+CALL_WORKERS = int(os.getenv('LLM_CALL_WORKERS', '32'))
+
+class CircuitOpenError(Exception):
+    """The provider is marked degraded; the call was not attempted"""
+
+class DeadlineExceeded(TimeoutError):
+    """No attempt finished before the call's deadline"""
+
+def status_code(error):
+    """HTTP status of a provider error or of an error it wraps, None if there is none"""
+    while error is not None:
+        for attribute in ('status_code', 'code'):
+            value = getattr(error, attribute, None)
+            if isinstance(value, int) and 100 <= value < 600:
+                return value
+        error = error.__cause__ or error.__context__
+    return None
+
+def is_retryable(error):
+    """
+    Whether another attempt may succeed: transport errors, timeouts, 429 and
+    5xx. Other 4xx (bad request, auth, payload too large) will fail again and
+    say nothing about the provider's health.
+    """
+    status = status_code(error)
+    return status is None or status in (408, 429) or status >= 500
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    After failure_threshold failures in a row the circuit opens and calls fail
+    fast for reset_timeout seconds; then a single probe is let through and its
+    outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURES, reset_timeout=BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'open':
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = 'half_open'
+            if self.state == 'half_open':
+                if self._probing:
+                    return False
+                self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._probing = False
+
+    def release(self):
+        """Give back a half-open probe whose call ended with neither outcome (e.g. cancelled)"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    logging.warning(f'LLM circuit opened after {self.failures} failures')
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+class RetryBudget:
+    """Token bucket: each call deposits ratio tokens, each retry or hedge spends one"""
+
+    def __init__(self, ratio=RETRY_BUDGET_RATIO, max_tokens=10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+class LatencyTracker:
+    """Recent single-attempt latencies, for the hedging threshold"""
+
+    def __init__(self, size=200, min_samples=20):
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, q):
+        with self._lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class LLMCaller:
+    """
+    Deadline-aware, hedged and circuit-broken wrapper around provider calls.
+
+    A call whose first attempt is still running after the recent
+    hedge_percentile latency gets one duplicate attempt; the first success
+    wins. Failed attempts are retried with backoff while the deadline, the
+    retry budget and the circuit breaker allow it. Non-retryable client
+    errors (see is_retryable) are raised at once and do not count against
+    the breaker.
+    """
+
+    def __init__(self, name, deadline=DEFAULT_DEADLINE, hedge_percentile=HEDGE_PERCENTILE,
+                 max_attempts=MAX_ATTEMPTS, backoff=0.5, breaker=None, budget=None):
+        self.name = name
+        self.deadline = deadline
+        self.hedge_percentile = hedge_percentile
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.budget = budget or RetryBudget()
+        self.latency = LatencyTracker()
+        self.calls = 0
+        self.hedges = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+        self.abandoned = 0
+        self.client_errors = 0
+
+    def _hedge_after(self):
+        if not self.hedge_percentile:
+            return None
+        return self.latency.percentile(self.hedge_percentile)
+
+    def _start(self, deadline):
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise CircuitOpenError(f'{self.name} circuit is open')
+        self.calls += 1
+        self.budget.deposit()
+        return time.monotonic() + (deadline or self.deadline)
+
+    def _should_retry(self, attempt, deadline_at):
+        if attempt >= self.max_attempts or time.monotonic() >= deadline_at:
+            return False
+        if not self.budget.withdraw() or not self.breaker.allow():
+            return False
+        self.retries += 1
+        trace = tracing.current_trace()
+        if trace is not None:
+            trace.add_retries(1)
+        return True
+
+    def _client_error(self, error):
+        """Record a non-retryable error: the provider answered, so a half-open probe is freed"""
+        self.client_errors += 1
+        self.breaker.release()
+        logging.warning(f'{self.name} call failed with a client error, not retrying: {error}')
+
+    def _timed(self, fn):
+        started = time.monotonic()
+        result = fn()
+        self.latency.record(time.monotonic() - started)
+        return result
+
+    def call(self, fn, deadline=None):
+        """
+        Call fn (a zero-argument function doing one provider request).
+
+        Args:
+            fn (callable): Performs the request and returns its result
+            deadline (float, optional): Seconds for the whole call, retries included
+
+        Raises:
+            CircuitOpenError: The provider is failing; nothing was attempted
+            DeadlineExceeded: No attempt succeeded in time
+        """
+        deadline_at = self._start(deadline)
+        attempt = 0
+        try:
+            while True:
+                attempt += 1
+                try:
+                    result = self._hedged(fn, deadline_at)
+                    self.breaker.record_success()
+                    return result
+                except DeadlineExceeded:
+                    self.failures += 1
+                    self.breaker.record_failure()
+                    raise
+                except Exception as e:
+                    if not is_retryable(e):
+                        self._client_error(e)
+                        raise
+                    self.failures += 1
+                    self.breaker.record_failure()
+                    if not self._should_retry(attempt, deadline_at):
+                        raise
+                    logging.warning(f'{self.name} attempt {attempt} failed, retrying: {e}')
+                    time.sleep(min(self.backoff * 2 ** (attempt - 1), max(0.0, deadline_at - time.monotonic())))
+        except BaseException as e:
+            if not isinstance(e, Exception):
+                # cancelled or interrupted (e.g. asyncio.CancelledError): neither outcome
+                # was recorded, but a half-open probe must not stay taken
+                self.breaker.release()
+            raise
+
+    def _hedged(self, fn, deadline_at):
+        """
+        One attempt, plus a hedge if it is slow, on the shared call pool.
+
+        Threads cannot be cancelled: an attempt still running when the call
+        returns (the losing hedge, or every attempt after a deadline) keeps
+        its pool thread until the provider answers, and is counted in
+        abandoned. Queued attempts are cancelled, and no hedge is started
+        while every pool thread is busy, so hedges never queue behind
+        abandoned attempts.
+        """
+        started = time.monotonic()
+        hedge_after = self._hedge_after()
+        pending = {_submit_attempt(self._timed, fn)}
+        hedged = False
+        error = None
+        try:
+            while pending:
+                remaining = deadline_at - time.monotonic()
+                if remaining <= 0:
+                    raise DeadlineExceeded(f'{self.name} call exceeded its deadline')
+                timeout = remaining
+                if not hedged and hedge_after is not None:
+                    timeout = min(remaining, max(0.0, started + hedge_after - time.monotonic()))
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        return future.result()
+                    error = future.exception()
+                if (pending and not hedged and hedge_after is not None
+                        and time.monotonic() - started >= hedge_after
+                        and _running_attempts() < CALL_WORKERS and self.budget.withdraw()):
+                    hedged = True
+                    self.hedges += 1
+                    pending.add(_submit_attempt(self._timed, fn))
+            raise error
+        finally:
+            for future in pending:
+                if not future.cancel():
+                    self.abandoned += 1
+
+    async def acall(self, coro_fn, deadline=None):
+        """Async variant of call; coro_fn is a zero-argument coroutine function"""
+        deadline_at = self._start(deadline)
+        attempt = 0
+        try:
+            while True:
+                attempt += 1
+                try:
+                    result = await self._ahedged(coro_fn, deadline_at)
+                    self.breaker.record_success()
+                    return result
+                except DeadlineExceeded:
+                    self.failures += 1
+                    self.breaker.record_failure()
+                    raise
+                except Exception as e:
+                    if not is_retryable(e):
+                        self._client_error(e)
+                        raise
+                    self.failures += 1
+                    self.breaker.record_failure()
+                    if not self._should_retry(attempt, deadline_at):
+                        raise
+                    logging.warning(f'{self.name} attempt {attempt} failed, retrying: {e}')
+                    await asyncio.sleep(min(self.backoff * 2 ** (attempt - 1), max(0.0, deadline_at - time.monotonic())))
+        except BaseException as e:
+            if not isinstance(e, Exception):
+                # cancelled or interrupted (e.g. asyncio.CancelledError): neither outcome
+                # was recorded, but a half-open probe must not stay taken
+                self.breaker.release()
+            raise
+
+    async def _atimed(self, coro_fn):
+        started = time.monotonic()
+        result = await coro_fn()
+        self.latency.record(time.monotonic() - started)
+        return result
+
+    async def _ahedged(self, coro_fn, deadline_at):
+        started = time.monotonic()
+        hedge_after = self._hedge_after()
+        pending = {asyncio.ensure_future(self._atimed(coro_fn))}
+        hedged = False
+        error = None
+        try:
+            while pending:
+                remaining = deadline_at - time.monotonic()
+                if remaining <= 0:
+                    raise DeadlineExceeded(f'{self.name} call exceeded its deadline')
+                timeout = remaining
+                if not hedged and hedge_after is not None:
+                    timeout = min(remaining, max(0.0, started + hedge_after - time.monotonic()))
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                if (pending and not hedged and hedge_after is not None
+                        and time.monotonic() - started >= hedge_after and self.budget.withdraw()):
+                    hedged = True
+                    self.hedges += 1
+                    pending.add(asyncio.ensure_future(self._atimed(coro_fn)))
+            raise error
+        finally:
+            # losing or abandoned attempts are cancelled, unlike threads
+            for task in pending:
+                task.cancel()
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'calls': self.calls,
+            'hedges': self.hedges,
+            'retries': self.retries,
+            'failures': self.failures,
+            'rejected': self.rejected,
+            'abandoned': self.abandoned,
+            'client_errors': self.client_errors,
+            'circuit': self.breaker.state,
+            'hedge_after_seconds': self._hedge_after()
+        }
+
+_executor = None
+_running = 0
+_callers = {}
+_callers_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    with _callers_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=CALL_WORKERS, thread_name_prefix='llm-call')
+    return _executor
+
+def _attempt_done(_):
+    global _running
+    with _callers_lock:
+        _running -= 1
+
+def _submit_attempt(fn, *args):
+    """Submit an attempt to the call pool; the copied context keeps tracing spans in the caller's trace"""
+    global _running
+    executor = _get_executor()
+    with _callers_lock:
+        _running += 1
+    future = executor.submit(contextvars.copy_context().run, fn, *args)
+    future.add_done_callback(_attempt_done)
+    return future
+
+def _running_attempts():
+    with _callers_lock:
+        return _running
+
+def get_caller(name='google_genai', **options):
+    """
+    Process-wide LLMCaller for a provider; breaker and latency stats are shared.
+
+    options (LLMCaller arguments) apply when the caller is first created,
+    e.g. a separate caller with hedging off for a different kind of request.
+    """
+    with _callers_lock:
+        caller = _callers.get(name)
+        if caller is None:
+            caller = _callers[name] = LLMCaller(name, **options)
+        return caller
+
+def all_stats():
+    with _callers_lock:
+        callers = list(_callers.values())
+    return [caller.stats() for caller in callers]
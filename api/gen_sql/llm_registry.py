@@ -0,0 +1,102 @@
+import os
+import logging
+import threading
+from langchain.chat_models import init_chat_model
+from dotenv import load_dotenv
+from gen_sql.llm_call import DEFAULT_DEADLINE
+
+load_dotenv()
+
+DEFAULT_MODEL = "gemini-2.0-flash"
+DEFAULT_PROVIDER = "google_genai"
+
+# Global client registry, keyed by (provider, model, temperature)
+_clients = {}
+_registry_lock = threading.Lock()
+
+def _get_or_create(key, factory):
+    """
+    Return the client registered under key, creating it once with factory.
+
+    Lookups of an existing client do not take the lock; creation is
+    double-checked under the lock so concurrent first requests build a
+    single client.
+    """
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    with _registry_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = factory()
+            _clients[key] = client
+            logging.info(f"LLM client created for {key}")
+    return client
+
+def get_chat_model(model=DEFAULT_MODEL, model_provider=DEFAULT_PROVIDER, temperature=None):
+    """
+    Get the shared LangChain chat model for (provider, model, temperature).
+
+    The model is built with init_chat_model on first use and reused by every
+    later caller, so auth setup and the underlying HTTP/gRPC channel (with its
+    keep-alive connections) are paid once per process. Chat models are safe to
+    invoke from several request threads at once.
+
+    Retries belong to LLMCaller (with its budget, breaker and deadline), so
+    the client makes a single try per invoke (max_retries=0), and a request
+    times out after the default call deadline instead of holding a call pool
+    thread indefinitely.
+
+    Args:
+        model (str): Model name
+        model_provider (str): LangChain model provider
+        temperature (float, optional): Sampling temperature, None for provider default
+
+    Returns:
+        BaseChatModel: Shared chat model instance
+    """
+    def factory():
+        kwargs = {}
+        if temperature is not None:
+            kwargs['temperature'] = temperature
+        return init_chat_model(
+            model=model,
+            model_provider=model_provider,
+            google_api_key=os.getenv("GOOGLE_API_KEY"),
+            max_retries=0,
+            timeout=DEFAULT_DEADLINE,
+            **kwargs
+        )
+    return _get_or_create((model_provider, model, temperature), factory)
+
+def get_genai_client():
+    """
+    Get the shared google-genai client.
+
+    genai.Client keeps a pooled HTTP session, so one instance serves every
+    model and request. It is registered under ('genai', None, None). Like the
+    chat models, its requests time out after the default call deadline.
+
+    Returns:
+        genai.Client: Shared client instance
+    """
+    def factory():
+        from google import genai
+        # HttpOptions.timeout is in milliseconds
+        return genai.Client(api_key=os.environ.get('GOOGLE_API_KEY'),
+                            http_options={'timeout': int(DEFAULT_DEADLINE * 1000)})
+    return _get_or_create(('genai', None, None), factory)
+
+def set_chat_model(client, model=DEFAULT_MODEL, model_provider=DEFAULT_PROVIDER, temperature=None):
+    """
+    Register a client for a key, replacing any existing one.
+
+    Used to plug in fake or preconfigured models (e.g. for offline runs).
+    """
+    with _registry_lock:
+        _clients[(model_provider, model, temperature)] = client
+
+def clear_clients():
+    """Drop every registered client; the next lookup builds a new one."""
+    with _registry_lock:
+        _clients.clear()
@@ -0,0 +1,244 @@
+import os
+import re
+import time
+import queue
+import logging
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+from sqlalchemy import inspect, text
+
+# Columns with at most this many distinct values get their values listed
+LOW_CARDINALITY = int(os.getenv('PROFILE_LOW_CARDINALITY', '20'))
+# ... and only if they repeat: at most this many distinct values per non-null row
+MAX_DISTINCT_RATIO = float(os.getenv('PROFILE_MAX_DISTINCT_RATIO', '0.2'))
+# Listed values longer than this mean free text, not categories
+MAX_VALUE_LENGTH = int(os.getenv('PROFILE_MAX_VALUE_LENGTH', '32'))
+MAX_VALUES = int(os.getenv('PROFILE_MAX_VALUES', '12'))
+# Values of columns named like these (or with one as a _-separated part) never
+# leave the database: personal data and free text
+SENSITIVE_COLUMNS = set(os.getenv(
+    'PROFILE_SENSITIVE_COLUMNS',
+    'name,username,email,mail,password,passwd,pwd,hash,salt,token,secret,phone,mobile,address,street,'
+    'ssn,iban,card,birth,dob,description,comment,comments,note,notes').lower().split(','))
+# Profiles are computed over at most this many rows per table
+SAMPLE_ROWS = int(os.getenv('PROFILE_SAMPLE_ROWS', '100000'))
+# A table is re-profiled at most this often, however often the data changes
+MIN_REFRESH_SECONDS = float(os.getenv('PROFILE_MIN_INTERVAL', '300'))
+
+class ProfileStore:
+    """
+    Per-table column profiles, computed by a background worker.
+
+    A profile holds, per column, the null ratio, the distinct values of
+    categorical text columns (see is_categorical) and min/max of numeric and
+    date columns.
+
+    get() never profiles on the caller's thread: it returns the latest
+    profile, even one from an older data epoch (value hints change slowly),
+    and queues the table when its profile is missing or stale. A table is
+    re-profiled at most every min_interval seconds, so a stream of writes
+    does not keep the worker busy or make requests pay for profiling.
+    """
+
+    def __init__(self, engine, epoch_fn, min_interval=MIN_REFRESH_SECONDS):
+        self.engine = engine
+        self.epoch_fn = epoch_fn
+        self.min_interval = min_interval
+        # table name -> (epoch, profiled at, profile)
+        self._profiles = {}
+        self._pending = set()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def get(self, table_name):
+        """Latest profile of a table, {} until its first profiling finishes"""
+        epoch = self.epoch_fn()
+        with self._lock:
+            entry = self._profiles.get(table_name)
+        if entry is None or (entry[0] != epoch and time.monotonic() - entry[1] >= self.min_interval):
+            self.schedule([table_name])
+        return entry[2] if entry else {}
+
+    def schedule(self, table_names):
+        """Queue tables for profiling on the background worker"""
+        with self._lock:
+            queued = [name for name in table_names if name not in self._pending]
+            self._pending.update(queued)
+            if queued and self._worker is None:
+                self._worker = threading.Thread(target=self._run, name='column-profiles', daemon=True)
+                self._worker.start()
+        for name in queued:
+            self._queue.put(name)
+
+    def _run(self):
+        while True:
+            table_name = self._queue.get()
+            try:
+                self._profile(table_name)
+            except Exception as e:
+                logging.warning(f"Profiling {table_name} failed: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(table_name)
+
+    def _profile(self, table_name):
+        epoch = self.epoch_fn()
+        profile = profile_table(self.engine, table_name)
+        with self._lock:
+            self._profiles[table_name] = (epoch, time.monotonic(), profile)
+        return profile
+
+    def refresh(self, table_names=None):
+        """Profile every (or the given) table now, on the calling thread; returns the profiles"""
+        if table_names is None:
+            table_names = inspect(self.engine).get_table_names()
+        return {name: self._profile(name) for name in table_names}
+
+def _is_numeric(col_type):
+    return any(t in col_type for t in ('INT', 'NUMERIC', 'DECIMAL', 'REAL', 'FLOAT', 'DOUBLE'))
+
+def _is_temporal(col_type):
+    return any(t in col_type for t in ('DATE', 'TIME'))
+
+def _is_sensitive(column_name):
+    name = column_name.lower()
+    return name in SENSITIVE_COLUMNS or any(part in SENSITIVE_COLUMNS for part in re.split(r'[_\W]+', name))
+
+def _unique_columns(inspector, table_name, columns):
+    """Names of primary key columns and single-column unique constraints or indexes"""
+    unique = {column['name'] for column in columns if column.get('primary_key')}
+    try:
+        groups = [c['column_names'] for c in inspector.get_unique_constraints(table_name)]
+        groups += [i['column_names'] for i in inspector.get_indexes(table_name) if i.get('unique')]
+    except Exception:
+        groups = []
+    unique.update(names[0] for names in groups if len(names) == 1)
+    return unique
+
+def is_categorical(column_name, distinct, non_null, unique=False):
+    """
+    Whether a text column's values may be listed in the prompt: few distinct
+    values that repeat, not a key, and not a personal or free-text column.
+    """
+    if unique or _is_sensitive(column_name) or not 0 < distinct <= LOW_CARDINALITY:
+        return False
+    return distinct / non_null <= MAX_DISTINCT_RATIO
+
+def _plain(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+def profile_table(engine, table_name):
+    """
+    Compute column profiles for one table.
+
+    One aggregate query gathers counts, distinct counts and min/max for every
+    column; categorical text columns then get one GROUP BY each, and keep
+    their values only when none is longer than MAX_VALUE_LENGTH.
+
+    Returns:
+        dict: column name -> {'nulls', 'distinct', 'values' | 'min'/'max'}
+    """
+    quote = engine.dialect.identifier_preparer.quote
+    try:
+        inspector = inspect(engine)
+        columns = inspector.get_columns(table_name)
+    except Exception as e:
+        logging.warning(f"Cannot profile {table_name}: {e}")
+        return {}
+    if not columns:
+        return {}
+    unique = _unique_columns(inspector, table_name, columns)
+
+    source = f'(SELECT * FROM {quote(table_name)} LIMIT {SAMPLE_ROWS}) AS sampled'
+    selects = ['COUNT(*)']
+    for column in columns:
+        name = quote(column['name'])
+        selects += [f'COUNT({name})', f'COUNT(DISTINCT {name})', f'MIN({name})', f'MAX({name})']
+
+    profile = {}
+    with engine.connect() as connection:
+        row = connection.execute(text(f"SELECT {', '.join(selects)} FROM {source}")).fetchone()
+        total = row[0] or 0
+        for idx, column in enumerate(columns):
+            non_null, distinct, min_value, max_value = row[1 + idx * 4: 5 + idx * 4]
+            col_type = str(column['type']).upper()
+            info = {
+                'nulls': round(1 - non_null / total, 3) if total else 0.0,
+                'distinct': distinct
+            }
+            if _is_numeric(col_type) or _is_temporal(col_type):
+                info['min'] = _plain(min_value)
+                info['max'] = _plain(max_value)
+            elif is_categorical(column['name'], distinct, non_null, column['name'] in unique):
+                name = quote(column['name'])
+                values = connection.execute(text(
+                    f'SELECT {name} FROM {source} WHERE {name} IS NOT NULL '
+                    f'GROUP BY {name} ORDER BY COUNT(*) DESC LIMIT {MAX_VALUES}'
+                )).fetchall()
+                values = [_plain(v[0]) for v in values]
+                if all(len(str(value)) <= MAX_VALUE_LENGTH for value in values):
+                    info['values'] = values
+            profile[column['name']] = info
+    return profile
+
+def describe_column(info):
+    """Compact one-line hint, e.g. "values: 'Completed','Pending'; nulls 5%" """
+    parts = []
+    if info.get('values'):
+        parts.append('values: ' + ','.join(f"'{v}'" for v in info['values']))
+    elif info.get('min') is not None:
+        parts.append(f"range: {info['min']}..{info['max']}")
+    if info.get('nulls'):
+        parts.append(f"nulls {round(info['nulls'] * 100)}%")
+    return '; '.join(parts)
+
+_store = None
+
+def configure(engine, epoch_fn):
+    """
+    Enable profiles for the database behind engine; epoch_fn returns its
+    data epoch. Every table is queued for profiling right away.
+    """
+    global _store
+    _store = ProfileStore(engine, epoch_fn)
+    try:
+        _store.schedule(inspect(engine).get_table_names())
+    except Exception as e:
+        logging.warning(f"Cannot list tables to profile: {e}")
+    return _store
+
+def get_store():
+    return _store
+
+def annotate_schema(schemas):
+    """
+    Append value hints to the column lines of a 'Table: ...' schema string.
+
+    Hints are added to the column comment so they survive schema compaction
+    and count towards its relevance ranking. Without a configured store the
+    schema is returned unchanged; tables not profiled yet get no hints.
+    """
+    if _store is None:
+        return schemas
+    lines = []
+    profile = {}
+    for line in schemas.split('\n'):
+        stripped = line.strip()
+        if stripped.lower().startswith('table:'):
+            try:
+                profile = _store.get(stripped[6:].strip())
+            except Exception as e:
+                logging.warning(f"Profile lookup failed: {e}")
+                profile = {}
+        elif stripped and not stripped.startswith('Description:') and '(' in stripped:
+            hint = describe_column(profile.get(stripped.split('(')[0].strip(), {}))
+            if hint:
+                line = f'{line}; {hint}' if ') - ' in line else f'{line} - {hint}'
+        lines.append(line)
+    return '\n'.join(lines)
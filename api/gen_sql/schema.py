@@ -1,9 +1,22 @@
 
+import os
+import re
+
 def get_schema(fileName='schema.txt'):
     with open(fileName, 'r') as file:
       schema = file.read()
     return schema
 
+def get_schema_version(fileName='schema.txt'):
+    """
+    Cheap version stamp of a schema file that changes whenever the file is rewritten.
+
+    Returns:
+        str: '<mtime_ns>-<size>' of the file
+    """
+    stat = os.stat(fileName)
+    return f'{stat.st_mtime_ns}-{stat.st_size}'
+
 def extract_table_names(schemas):
     """
     Extract table names from a schema string and return them as a comma-separated string.
@@ -75,4 +88,179 @@ def filter_schemas_by_table_names(table_names_str, schemas):
             filtered_schema.append(line)
     
     # Join the lines back together
-    return '\n'.join(filtered_schema)
\ No newline at end of file
+    return '\n'.join(filtered_schema)
+
+DEFAULT_TOKEN_BUDGET = int(os.getenv('SCHEMA_TOKEN_BUDGET', '1500'))
+_DEFAULT_DESCRIPTION = re.compile(r'^Represents .* data in the system\.?$', re.IGNORECASE)
+_TYPE_ALIASES = {
+    'CHARACTER VARYING': 'VARCHAR',
+    'DOUBLE PRECISION': 'DOUBLE',
+    'TIMESTAMP WITHOUT TIME ZONE': 'TIMESTAMP',
+    'TIMESTAMP WITH TIME ZONE': 'TIMESTAMPTZ',
+}
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token)"""
+    return (len(text) + 3) // 4
+
+def _split_column_line(line):
+    """Split 'name (TYPE, constraint, ...) - comment' into its parts"""
+    line = line.strip()
+    start = line.find('(')
+    if start == -1:
+        return line, '', [], ''
+    depth = 0
+    end = len(line)
+    for idx in range(start, len(line)):
+        if line[idx] == '(':
+            depth += 1
+        elif line[idx] == ')':
+            depth -= 1
+            if depth == 0:
+                end = idx
+                break
+    parts, depth, current = [], 0, ''
+    for ch in line[start + 1:end]:
+        if ch == ',' and depth == 0:
+            parts.append(current.strip())
+            current = ''
+            continue
+        depth += ch == '('
+        depth -= ch == ')'
+        current += ch
+    parts.append(current.strip())
+    comment = line[end + 1:].strip()
+    if comment.startswith('-'):
+        comment = comment[1:].strip()
+    return line[:start].strip(), parts[0], [p for p in parts[1:] if p], comment
+
+def parse_schema(schemas):
+    """
+    Parse a schema string into table dictionaries.
+
+    Returns:
+        list: [{'name', 'description', 'columns': [{'name', 'type', 'constraints', 'comment'}]}]
+    """
+    tables = []
+    for line in schemas.split('\n'):
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if stripped.lower().startswith('table:'):
+            tables.append({'name': stripped[6:].strip(), 'description': '', 'columns': []})
+        elif not tables:
+            continue
+        elif stripped.startswith('Description:'):
+            tables[-1]['description'] = stripped[12:].strip()
+        else:
+            name, col_type, constraints, comment = _split_column_line(stripped)
+            tables[-1]['columns'].append({
+                'name': name, 'type': col_type, 'constraints': constraints, 'comment': comment
+            })
+    return tables
+
+def _words(text):
+    """Lower-case word stems of an identifier or sentence (camelCase and snake_case aware)"""
+    text = re.sub(r'([a-z0-9])([A-Z])', r'\1 \2', text)
+    stems = set()
+    for word in re.findall(r'[a-zA-Z0-9]+', text.lower()):
+        if len(word) > 3 and word.endswith('s'):
+            word = word[:-1]
+        stems.add(word)
+    return stems
+
+def _is_key(column):
+    return any(c == 'Primary Key' or c.startswith('Foreign Key') for c in column['constraints'])
+
+def _column_score(table_name, column, question_words):
+    name_words = _words(column['name'])
+    score = 3 * len(name_words & question_words)
+    if column['comment']:
+        score += len(_words(column['comment']) & question_words)
+    # "<table> id" style questions point at the key of the table
+    if _is_key(column) and _words(table_name) & question_words:
+        score += 1
+    return score
+
+def _render_column(column):
+    col_type = column['type'].upper()
+    for verbose, alias in _TYPE_ALIASES.items():
+        col_type = col_type.replace(verbose, alias)
+    col_type = re.sub(r'\(\d+\)', '', col_type)
+    text = f"{column['name']} {col_type}".strip()
+    for constraint in column['constraints']:
+        if constraint == 'Primary Key':
+            text += ' PK'
+        elif constraint.startswith('Foreign Key'):
+            target = re.sub(r'^Foreign Key\s*(->|to)?\s*', '', constraint)
+            text += f' FK>{target}'
+    if column['comment']:
+        text += f" /*{column['comment']}*/"
+    return text
+
+def _render_tables(tables, keep):
+    lines = []
+    for table in tables:
+        columns = [c for c in table['columns'] if (table['name'], c['name']) in keep]
+        line = f"{table['name']}({', '.join(_render_column(c) for c in columns)})"
+        description = table['description']
+        if description and not _DEFAULT_DESCRIPTION.match(description):
+            line += f' -- {description}'
+        lines.append(line)
+    return '\n'.join(lines)
+
+def compact_schema(schemas, question, token_budget=DEFAULT_TOKEN_BUDGET, baseline=None):
+    """
+    Render a schema as one dense line per table, pruned to a token budget.
+
+    Auto-generated descriptions ("Represents X data in the system.") are
+    dropped. Primary and foreign key columns are always kept so joins stay
+    possible; the remaining columns are ranked by how well their names and
+    comments match the question, and the lowest ranked are pruned until the
+    estimate fits token_budget.
+
+    Args:
+        schemas (str): Schema text in the 'Table: ...' format
+        question (str): The user's query description
+        token_budget (int): Maximum estimated tokens for the rendered schema
+        baseline (str, optional): Schema text the savings are measured
+            against, e.g. the raw schema when schemas carries added hints
+            (default schemas)
+
+    Returns:
+        tuple: (compact schema str, stats dict with original_tokens,
+               compact_tokens, saved_tokens and dropped_columns)
+    """
+    tables = parse_schema(schemas)
+    question_words = _words(question)
+    keep = set()
+    candidates = []
+    for table in tables:
+        for position, column in enumerate(table['columns']):
+            keep.add((table['name'], column['name']))
+            if not _is_key(column):
+                score = _column_score(table['name'], column, question_words)
+                # prefer dropping unmatched columns from the end of wide tables
+                candidates.append((score, -position, table['name'], column['name']))
+    candidates.sort()
+
+    rendered = {(t['name'], c['name']): _render_column(c) for t in tables for c in t['columns']}
+    length = len(_render_tables(tables, keep))
+    dropped = 0
+    for score, _, table_name, column_name in candidates:
+        if (length + 3) // 4 <= token_budget:
+            break
+        keep.discard((table_name, column_name))
+        # the column text plus its ', ' separator
+        length -= len(rendered[(table_name, column_name)]) + 2
+        dropped += 1
+    compact = _render_tables(tables, keep)
+
+    original_tokens = estimate_tokens(schemas if baseline is None else baseline)
+    compact_tokens = estimate_tokens(compact)
+    return compact, {
+        'original_tokens': original_tokens,
+        'compact_tokens': compact_tokens,
+        'saved_tokens': max(0, original_tokens - compact_tokens),
+        'dropped_columns': dropped
+    }
@@ -0,0 +1,98 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key into a single execution.
+
+    The first caller for a key runs the function; callers arriving while it is
+    still running wait for it and receive the same result (or exception).
+    Nothing is kept once the call finishes, so a later call always recomputes.
+    Flights are shared between threads and event loops, so a synchronous
+    caller can wait on a coroutine started by an async one and vice versa.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def _join(self, key):
+        """Return (future, leader) for key, registering a new flight if none is running"""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            self.executed += 1
+            return future, True
+
+    def _leave(self, key):
+        with self._lock:
+            del self._calls[key]
+
+    def do(self, key, fn):
+        """
+        Run fn once for all concurrent callers with the same key.
+
+        Args:
+            key (hashable): Identity of the work
+            fn (callable): Zero-argument function producing the result
+
+        Returns:
+            Any: fn's result, shared by every caller of this flight
+        """
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._leave(key)
+
+    async def ado(self, key, coro_fn):
+        """
+        Async variant of do; coro_fn is a zero-argument coroutine function.
+
+        Waiting callers do not block their event loop or a thread.
+        """
+        future, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+        try:
+            result = await coro_fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._leave(key)
+
+    def stats(self):
+        """Return execution and coalescing counters"""
+        with self._lock:
+            return {
+                'name': self.name,
+                'executed': self.executed,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._calls)
+            }
+
+def normalize_text(text):
+    """Collapse runs of whitespace so formatting differences share a key"""
+    return ' '.join(text.split())
+
+def normalize_sql(sql):
+    """Normalize whitespace and a trailing semicolon in a SQL statement"""
+    return normalize_text(sql).rstrip(';').strip()
@@ -0,0 +1,186 @@
+import os
+import re
+import math
+from contextlib import contextmanager
+
+# Row cap injected into queries without a LIMIT
+ROW_CAP = int(os.getenv('SQL_ROW_CAP', '1000'))
+# Plans whose estimated row visits exceed this are rejected
+MAX_ESTIMATED_ROWS = int(os.getenv('SQL_MAX_ESTIMATED_ROWS', '10000000'))
+
+_READ_STATEMENTS = {'select', 'values'}
+# one CTE of a WITH clause once its body is collapsed to (): name [(columns)] AS [[NOT] MATERIALIZED] ()
+_CTE = re.compile(r'\s*[\w"`\[\]]+\s*(?:\(\))?\s+as\s+(?:not\s+)?(?:materialized\s+)?\(\)\s*(,)?', re.IGNORECASE)
+_FROM_ITEM = re.compile(r'\b(?:from|join)\s+([\w."`\[\]]+)(?:\s+(?:as\s+)?([a-zA-Z_]\w*))?', re.IGNORECASE)
+_NOT_ALIAS = {'where', 'on', 'using', 'join', 'left', 'right', 'inner', 'outer', 'cross', 'natural', 'full',
+              'group', 'order', 'limit', 'having', 'union', 'except', 'intersect', 'window', 'offset'}
+_PLAN_STEP = re.compile(r'^(SCAN|SEARCH)\s+(\S+)')
+
+class QueryRejected(Exception):
+    """The query is not a single SELECT or its plan is too expensive to run"""
+
+def _strip_literals(sql):
+    """Blank out string literals and comments so keywords inside them are ignored"""
+    sql = re.sub(r"'(?:[^']|'')*'", "''", sql)
+    sql = re.sub(r'--[^\n]*', ' ', sql)
+    return re.sub(r'/\*.*?\*/', ' ', sql, flags=re.DOTALL)
+
+def _top_level(sql):
+    """SQL with every parenthesised part collapsed, leaving the outer statement"""
+    previous = None
+    while previous != sql:
+        previous = sql
+        sql = re.sub(r'\([^()]*\)', '()', sql)
+    return sql
+
+def leading_keyword(sql):
+    """
+    The keyword of the statement sql runs, skipping a WITH clause.
+
+    "WITH x AS (...) DELETE FROM t" is a DELETE, while REPLACE(...) or a
+    column named update inside a SELECT does not matter.
+    """
+    top = _top_level(_strip_literals(sql)).strip()
+    with_clause = re.match(r'^with\s+(?:recursive\s+)?', top, re.IGNORECASE)
+    if with_clause:
+        top = top[with_clause.end():]
+        while True:
+            cte = _CTE.match(top)
+            if not cte:
+                break
+            top = top[cte.end():]
+            if not cte.group(1):
+                break
+    keyword = re.match(r'\s*(\w+)', top)
+    return keyword.group(1).lower() if keyword else ''
+
+def check_statement(sql):
+    """
+    Validate that sql is one read-only SELECT statement.
+
+    Returns:
+        str: The statement without a trailing semicolon
+
+    Raises:
+        QueryRejected: For anything other than a single SELECT/WITH query
+    """
+    sql = sql.strip().rstrip(';').strip()
+    bare = _strip_literals(sql).strip()
+    if ';' in bare:
+        raise QueryRejected('Only a single statement can be executed.')
+    if not re.match(r'^(select|with|values)\b', bare, re.IGNORECASE):
+        raise QueryRejected('Only SELECT queries can be executed.')
+    if leading_keyword(bare) not in _READ_STATEMENTS:
+        raise QueryRejected('The query contains a data-modifying statement.')
+    return sql
+
+@contextmanager
+def query_only(execute):
+    """
+    PRAGMA query_only around a block: SQLite itself refuses any write, so
+    check_statement only has to give good error messages, not be airtight.
+
+    Args:
+        execute (callable): Runs one SQL statement on the connection used in the block
+    """
+    execute('PRAGMA query_only = ON')
+    try:
+        yield
+    finally:
+        execute('PRAGMA query_only = OFF')
+
+def has_limit(sql):
+    """True when the outermost query already has a LIMIT clause"""
+    return re.search(r'\blimit\b', _top_level(_strip_literals(sql)), re.IGNORECASE) is not None
+
+def table_aliases(sql):
+    """Map every table name and alias in FROM/JOIN clauses to its table name"""
+    aliases = {}
+    for table, alias in _FROM_ITEM.findall(_strip_literals(sql)):
+        table = table.strip('"`[]')
+        if table == '(' or not table:
+            continue
+        aliases[table] = table
+        if alias and alias.lower() not in _NOT_ALIAS:
+            aliases[alias] = table
+    return aliases
+
+def estimate_cost(plan, row_counts, aliases):
+    """
+    Estimate row visits of an EXPLAIN QUERY PLAN result.
+
+    Top-level SCAN/SEARCH steps are nested loops, so their factors multiply:
+    a SCAN visits every row of its table, a SEARCH about log2 of them.
+    Steps inside subqueries and materialized CTEs are added on. Unknown names
+    (e.g. CTEs) are charged like the largest known table.
+
+    Args:
+        plan (list): (id, parent, notused, detail) rows
+        row_counts (dict): table name -> row count
+        aliases (dict): alias or table -> table name
+
+    Returns:
+        int: Estimated number of row visits
+    """
+    largest = max(row_counts.values(), default=1)
+    nested, extra = 1, 0
+    for _, parent, _, detail in plan:
+        step = _PLAN_STEP.match(detail)
+        if not step:
+            continue
+        kind, name = step.groups()
+        if name == 'CONSTANT':
+            continue
+        rows = row_counts.get(aliases.get(name, name), largest)
+        factor = rows if kind == 'SCAN' else max(1, int(math.log2(rows + 1)))
+        if parent == 0:
+            nested *= max(1, factor)
+        else:
+            extra += factor
+    return nested + extra
+
+def prepare(sql, run, row_cap=ROW_CAP, max_estimated_rows=MAX_ESTIMATED_ROWS):
+    """
+    Gate a generated query before execution.
+
+    Rejects anything but a single SELECT, estimates its cost from
+    EXPLAIN QUERY PLAN and table sizes, rejects explosive plans and wraps
+    queries without a LIMIT so at most row_cap + 1 rows come back (the extra
+    row tells the caller the result was truncated).
+
+    Args:
+        sql (str): Query to check
+        run (callable): sql -> list of row tuples, on the target SQLite database
+        row_cap (int): Rows returned for queries without LIMIT (0 disables)
+        max_estimated_rows (int): Cost above which the query is rejected
+
+    Returns:
+        tuple: (sql to execute, applied row cap or None, estimated cost)
+
+    Raises:
+        QueryRejected: When the query must not be executed
+    """
+    sql = check_statement(sql)
+    try:
+        plan = run(f'EXPLAIN QUERY PLAN {sql}')
+    except Exception as e:
+        raise QueryRejected(f'Invalid query: {e}')
+
+    aliases = table_aliases(sql)
+    row_counts = {}
+    for table in set(aliases.values()):
+        try:
+            # MAX(rowid) is an index lookup and an upper bound of the row count
+            row_counts[table] = run(f'SELECT MAX(rowid) FROM "{table}"')[0][0] or 0
+        except Exception:
+            continue
+
+    cost = estimate_cost(plan, row_counts, aliases)
+    if cost > max_estimated_rows:
+        raise QueryRejected(
+            f'The query is too expensive to run (about {cost:,} row visits, limit {max_estimated_rows:,}). '
+            'Check the join conditions or add filters.')
+
+    if row_cap and not has_limit(sql):
+        return f'SELECT * FROM ({sql}) LIMIT {row_cap + 1}', row_cap, cost
+    return sql, None, cost
@@ -1,19 +1,30 @@
+import logging
 import os
 import re
+import copy
+import threading
+import contextvars
+from collections import OrderedDict
 from dotenv import load_dotenv
 from typing import Annotated
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
-from langchain.chat_models import init_chat_model
 #from pydantic import BaseModel, Field
 from langchain_core.messages import HumanMessage,AIMessage, SystemMessage
 from typing_extensions import TypedDict
 #from langchain_openai import ChatOpenAI
 from langgraph.checkpoint.memory import InMemorySaver
+from langchain_core.runnables import RunnableLambda
 #from langgraph.types import Command, interrupt
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from gen_sql.schema import  get_schema, extract_table_names, filter_schemas_by_table_names
+from gen_sql.schema import  get_schema, get_schema_version, extract_table_names, filter_schemas_by_table_names, compact_schema
+from gen_sql.llm_registry import get_chat_model
+from gen_sql.single_flight import SingleFlight, normalize_text
+from gen_sql.table_selection import get_catalog, use_sharding, select_tables, aselect_tables
+from gen_sql.profiles import annotate_schema
+from gen_sql.llm_call import get_caller
+from gen_sql.tracing import span, traced, record_llm_usage, RetryCounter, observe, annotate, TOKEN_BUCKETS
 load_dotenv()
 
 class State(TypedDict):
@@ -21,11 +32,52 @@ class State(TypedDict):
   schema: str
   next: str # ''|'query'|'extended_query'
 
-llm = init_chat_model(
-        model="gemini-2.0-flash",
-        #temperature=0.7, 
-        model_provider="google_genai"
-)
+llm_flight = SingleFlight('llm')
+# Set by batch generation (gen_sql.batch): an async LLM request of the task
+# first takes one token, so the rate limit follows the calls the graph makes
+rate_limiter = contextvars.ContextVar('llm_rate_limiter', default=None)
+
+def get_llm():
+  return get_chat_model(model="gemini-2.0-flash", model_provider="google_genai")
+
+def _flight_key(messages):
+  return (get_schema_version(), tuple((msg.type, normalize_text(str(msg.content))) for msg in messages))
+
+def invoke_llm(messages):
+  """
+  Invoke the chat model, sharing one completion between concurrent identical prompts.
+
+  The flight key is the normalized prompt (every message's type and content)
+  plus the schema version, so callers only coalesce while their request is
+  really the same; nothing is cached after the call returns.
+  """
+  def call():
+    retries = RetryCounter()
+    with span('llm'):
+      # deadline, hedging, retry budget and circuit breaker around the provider call
+      reply = get_caller().call(lambda: get_llm().invoke(messages, config={'callbacks': [retries]}))
+    record_llm_usage(reply)
+    retries.flush()
+    return reply
+  reply = llm_flight.do(_flight_key(messages), call)
+  # each thread's checkpoint gets its own message object
+  return copy.copy(reply)
+
+async def ainvoke_llm(messages):
+  """Async variant of invoke_llm; waits on the network without holding a thread"""
+  async def call():
+    limiter = rate_limiter.get()
+    if limiter is not None:
+      # coalesced callers share this request and take no token
+      await limiter.acquire()
+    retries = RetryCounter()
+    with span('llm'):
+      reply = await get_caller().acall(lambda: get_llm().ainvoke(messages, config={'callbacks': [retries]}))
+    record_llm_usage(reply)
+    retries.flush()
+    return reply
+  reply = await llm_flight.ado(_flight_key(messages), call)
+  return copy.copy(reply)
 
 def analyze_input(state:State):
   if not state["messages"]:
@@ -44,24 +96,23 @@ def analyze_input(state:State):
     return {**state, 'next':intent }
   return state
 
-def get_table_names(state:State):
-  last_message = state["messages"][-1]
-  human_message = HumanMessage(content=f"""
+def _table_names_message(table_names, question):
+  return HumanMessage(content=f"""
      Given this database table names with description([tableName] - [description]):
     ```
-    {extract_table_names(get_schema())}
+    {table_names}
     default -
     ```
     Find expected table names that would be used to create sql query using the following query description:
-    {last_message.content}
+    {question}
 
     If no table names match the provided table names, return: ""
     Please provide only the comma separated table names without any explanations.
-    """)  
-                            
-  reply = llm.invoke([human_message])
-  print('TABLES:',reply.content)
-  schema = filter_schemas_by_table_names(reply.content, get_schema())
+    """)
+
+def _table_names_update(state:State, table_names, all_schema):
+  print('TABLES:',table_names)
+  schema = filter_schemas_by_table_names(table_names, all_schema)
  
   if not schema:
     return{
@@ -75,13 +126,47 @@ def get_table_names(state:State):
     'next': 'query'
   }
 
-def get_query(state:State):
+# Very large catalogs are split into shards that are asked in parallel
+# (see gen_sql.table_selection); small ones keep the single prompt.
+def get_table_names(state:State):
+  question = state["messages"][-1].content
+  all_schema = get_schema()
+  catalog = get_catalog(all_schema)
+  if use_sharding(catalog):
+    table_names = select_tables(catalog, question, _table_names_message, invoke_llm)
+  else:
+    table_names = invoke_llm([_table_names_message(extract_table_names(all_schema), question)]).content
+  return _table_names_update(state, table_names, all_schema)
+
+async def aget_table_names(state:State):
+  question = state["messages"][-1].content
+  all_schema = get_schema()
+  catalog = get_catalog(all_schema)
+  if use_sharding(catalog):
+    table_names = await aselect_tables(catalog, question, _table_names_message, ainvoke_llm)
+  else:
+    reply = await ainvoke_llm([_table_names_message(extract_table_names(all_schema), question)])
+    table_names = reply.content
+  return _table_names_update(state, table_names, all_schema)
+
+def _prompt_schema(schema, question):
+  # value hints from the column profiles, then a dense, question-pruned
+  # rendering of the selected tables for the query prompt
+  # savings against the raw schema, not the one the hints made longer
+  compact, stats = compact_schema(annotate_schema(schema), question, baseline=schema)
+  logging.debug(f'schema tokens: {stats}')
+  observe('schema_tokens_saved', stats['saved_tokens'], TOKEN_BUCKETS)
+  annotate('schema_tokens', f"saved={stats['saved_tokens']} sent={stats['compact_tokens']}")
+  return compact
+
+def _append_query_messages(state:State):
   last_message = state["messages"][-1]
+  schema = _prompt_schema(state.get('schema'), last_message.content)
   system_message = SystemMessage(content="When writing SQL queries with aggregate functions, always assign meaningful alias names to aggregated columns using AS. For example: SELECT COUNT(*) AS total_records, AVG(price) AS average_price, SUM(quantity) AS total_quantity FROM table_name")
   human_message = HumanMessage(content=f"""
     Given this database schema:
     ```
-    {state.get('schema')}
+    {schema}
     ```                           
     Generate a SQL query for sqlite3 using the following query description:
     {last_message.content}
@@ -93,18 +178,34 @@ def get_query(state:State):
     """)
   state['messages'].append(system_message)
   state['messages'].append(human_message)
+
+def get_query(state:State):
+  _append_query_messages(state)
   return get_extended_query(state) 
 
+async def aget_query(state:State):
+  _append_query_messages(state)
+  return await aget_extended_query(state)
+
 def get_extended_query(state: State):
-  return {'messages':[llm.invoke(state["messages"])]}
+  return {'messages':[invoke_llm(state["messages"])]}
+
+async def aget_extended_query(state: State):
+  return {'messages':[await ainvoke_llm(state["messages"])]}
 
 
 graph_builder = StateGraph(State)
 
-graph_builder.add_node('analyze_input', analyze_input)
-graph_builder.add_node('table_names', get_table_names)
-graph_builder.add_node('query', get_query)
-graph_builder.add_node('extended_query', get_extended_query)
+def _node(name, func, afunc):
+  # every node is timed into the '<name>_seconds' histogram and the request trace
+  return RunnableLambda(traced(name)(func), afunc=traced(name)(afunc))
+
+graph_builder.add_node('analyze_input', traced('analyze_input')(analyze_input))
+# LLM-bound nodes carry both implementations: graph.invoke runs the sync one,
+# graph.ainvoke awaits the async one instead of parking a thread on the network
+graph_builder.add_node('table_names', _node('table_names', get_table_names, aget_table_names))
+graph_builder.add_node('query', _node('query', get_query, aget_query))
+graph_builder.add_node('extended_query', _node('extended_query', get_extended_query, aget_extended_query))
 
 graph_builder.add_edge(START, 'analyze_input')
 graph_builder.add_conditional_edges(
@@ -121,33 +222,66 @@ graph_builder.add_edge('extended_query', END)
 graph_builder.add_edge('query', END)
 
 graph = graph_builder.compile(checkpointer=InMemorySaver())
+# Same pipeline without a checkpointer, for standalone (batch) questions
+batch_graph = graph_builder.compile()
 
-def get_messages(thread_id):
+# Rendered chat entries per (thread_id, message id); None for hidden messages
+MESSAGE_CACHE_SIZE = int(os.getenv('MESSAGE_CACHE_SIZE', '10000'))
+_rendered = OrderedDict()
+_rendered_lock = threading.Lock()
+
+def _render(msg):
+   if isinstance(msg, SystemMessage) or msg.content.strip().startswith('Given this database schema:'):
+      return None
+   #{ id: 1, text: "Hello! How can I help you today?", sender: "bot", timestamp: new Date() }
+   if isinstance(msg, HumanMessage):
+      return {'text':msg.content, 'sender': 'user' }
+   return {'text':extract(msg.content), 'sender': 'bot' }
+
+def _cached_render(thread_id, index, msg):
+   key = (thread_id, msg.id or index)
+   with _rendered_lock:
+      if key in _rendered:
+         _rendered.move_to_end(key)
+         return _rendered[key]
+   entry = _render(msg)
+   with _rendered_lock:
+      _rendered[key] = entry
+      while len(_rendered) > MESSAGE_CACHE_SIZE:
+         _rendered.popitem(last=False)
+   return entry
+
+def get_history(thread_id, since=0):
+   """
+   Chat entries of a thread added after the cursor since.
+
+   The cursor is the number of graph messages already seen, including hidden
+   system and schema prompts. When the thread holds fewer messages than since
+   (e.g. it was reset) the whole history is returned with reset set.
+
+   Returns:
+      dict: {'messages': [{'text', 'sender'}], 'cursor': int, 'reset': bool}
+   """
    if not thread_id:
-        return []
-   print(thread_id)
+      return {'messages': [], 'cursor': 0, 'reset': False}
    config = {"configurable": {"thread_id": thread_id}}
    current_state = graph.get_state(config)
-   if not current_state.values:
-      return []
-   
-   messages=current_state.values['messages']
-   messages=[msg for msg in messages if not (isinstance(msg, SystemMessage) or msg.content.strip().startswith('Given this database schema:'))]
-   res=[]
-   #{ id: 1, text: "Hello! How can I help you today?", sender: "bot", timestamp: new Date() }
-   for msg in messages:
-      if isinstance(msg, HumanMessage):
-        res.append({'text':msg.content, 'sender': 'user' })
-      else:
-         res.append({'text':extract(msg.content), 'sender': 'bot' })
-   return res
+   messages = current_state.values.get('messages', []) if current_state.values else []
+   since = max(0, since or 0)
+   reset = since > len(messages)
+   if reset:
+      since = 0
+   res = []
+   for index in range(since, len(messages)):
+      entry = _cached_render(thread_id, index, messages[index])
+      if entry is not None:
+         res.append(entry)
+   return {'messages': res, 'cursor': len(messages), 'reset': reset}
 
-def run_qgn_chatbot(user_input, thread_id):
-    if not thread_id:
-        thread_id = "1"
-    
-    config = {"configurable": {"thread_id": thread_id}}
-    current_state = graph.get_state(config)
+def get_messages(thread_id):
+   return get_history(thread_id)['messages']
+
+def _initial_state(current_state, user_input):
     # Initialize state if it doesn't exist
     if not current_state.values:
         initial_state = {
@@ -160,10 +294,29 @@ def run_qgn_chatbot(user_input, thread_id):
 
     user_message = HumanMessage(content=user_input)
     initial_state["messages"].append(user_message)
+    return initial_state
+
+def run_qgn_chatbot(user_input, thread_id):
+    if not thread_id:
+        thread_id = "1"
+    
+    config = {"configurable": {"thread_id": thread_id}}
+    initial_state = _initial_state(graph.get_state(config), user_input)
     response = graph.invoke(initial_state, config=config)
     print("len:", len(response["messages"]))
     return response["messages"][-1].content
 
+async def arun_qgn_chatbot(user_input, thread_id):
+    """Async variant of run_qgn_chatbot built on graph.ainvoke"""
+    if not thread_id:
+        thread_id = "1"
+    
+    config = {"configurable": {"thread_id": thread_id}}
+    initial_state = _initial_state(await graph.aget_state(config), user_input)
+    response = await graph.ainvoke(initial_state, config=config)
+    print("len:", len(response["messages"]))
+    return response["messages"][-1].content
+
 def extract(text, substr='sqlite'):
     json_regex = rf'```{substr}\s*([\s\S]*?)\s*```'
     match = re.search(json_regex, text)
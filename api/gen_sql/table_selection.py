@@ -0,0 +1,174 @@
+import os
+import re
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from gen_sql.schema import parse_schema, get_schema_version
+
+# Catalogs with more tables than this are selected shard by shard
+SHARD_THRESHOLD = int(os.getenv('TABLE_SHARD_THRESHOLD', '200'))
+SHARD_SIZE = int(os.getenv('TABLE_SHARD_SIZE', '100'))
+SHARD_STRATEGY = os.getenv('TABLE_SHARD_STRATEGY', 'fk')  # 'fk' | 'prefix' | 'size'
+SHARD_WORKERS = int(os.getenv('TABLE_SHARD_WORKERS', '16'))
+FK_CLOSURE_DEPTH = int(os.getenv('TABLE_FK_CLOSURE_DEPTH', '2'))
+
+_catalog_cache = {}
+_cache_lock = threading.Lock()
+_executor = None
+
+class Catalog:
+    """Table list of a schema with its foreign key graph"""
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.names = [table['name'] for table in tables]
+        self.by_name = {table['name']: table for table in tables}
+        self.references = {}
+        for table in tables:
+            targets = set()
+            for column in table['columns']:
+                for constraint in column['constraints']:
+                    if constraint.startswith('Foreign Key'):
+                        target = re.sub(r'^Foreign Key\s*(->|to)?\s*', '', constraint).split('.')[0].strip()
+                        if target in self.by_name and target != table['name']:
+                            targets.add(target)
+            self.references[table['name']] = targets
+        self._shards = {}
+
+    def description_line(self, name):
+        """'[tableName] - [description]' line, as produced by extract_table_names"""
+        return f"{name} - {self.by_name[name]['description']}"
+
+    def fk_components(self):
+        """Groups of tables connected by foreign keys (in either direction)"""
+        neighbours = {name: set(targets) for name, targets in self.references.items()}
+        for name, targets in self.references.items():
+            for target in targets:
+                neighbours[target].add(name)
+        seen, components = set(), []
+        for name in self.names:
+            if name in seen:
+                continue
+            component, stack = [], [name]
+            seen.add(name)
+            while stack:
+                current = stack.pop()
+                component.append(current)
+                for neighbour in neighbours[current]:
+                    if neighbour not in seen:
+                        seen.add(neighbour)
+                        stack.append(neighbour)
+            components.append(component)
+        return components
+
+    def prefix_groups(self):
+        """Groups of tables sharing a name prefix (snake_case or CamelCase head)"""
+        groups = {}
+        for name in self.names:
+            head = re.split(r'_|(?<=[a-z0-9])(?=[A-Z])', name)[0].lower()
+            groups.setdefault(head, []).append(name)
+        return list(groups.values())
+
+    def shards(self, strategy=SHARD_STRATEGY, shard_size=SHARD_SIZE):
+        """
+        Partition the table names into shards of at most shard_size tables.
+
+        Groups ('fk' components or 'prefix' groups) are packed whole where they
+        fit so related tables are judged together; 'size' simply chunks the
+        catalog in order.
+        """
+        key = (strategy, shard_size)
+        if key in self._shards:
+            return self._shards[key]
+        if strategy == 'fk':
+            groups = self.fk_components()
+        elif strategy == 'prefix':
+            groups = self.prefix_groups()
+        else:
+            groups = [[name] for name in self.names]
+
+        shards, current = [], []
+        for group in sorted(groups, key=len, reverse=True):
+            for start in range(0, len(group), shard_size):
+                piece = group[start:start + shard_size]
+                if len(current) + len(piece) > shard_size:
+                    shards.append(current)
+                    current = []
+                current = current + piece
+        if current:
+            shards.append(current)
+        self._shards[key] = shards
+        return shards
+
+    def fk_closure(self, names, depth=FK_CLOSURE_DEPTH):
+        """Add the tables referenced by foreign keys of names, up to depth hops"""
+        selected = [name for name in names if name in self.by_name]
+        frontier = set(selected)
+        for _ in range(depth):
+            frontier = {target for name in frontier for target in self.references[name]} - set(selected)
+            if not frontier:
+                break
+            selected.extend(sorted(frontier))
+        return selected
+
+def get_catalog(schemas, fileName='schema.txt'):
+    """Parsed catalog of a schema, cached per schema file version"""
+    version = get_schema_version(fileName)
+    with _cache_lock:
+        cached = _catalog_cache.get(fileName)
+        if cached and cached[0] == version:
+            return cached[1]
+    catalog = Catalog(parse_schema(schemas))
+    with _cache_lock:
+        _catalog_cache[fileName] = (version, catalog)
+    return catalog
+
+def use_sharding(catalog):
+    return len(catalog.names) > SHARD_THRESHOLD
+
+def _get_executor():
+    global _executor
+    with _cache_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=SHARD_WORKERS, thread_name_prefix='table-shard')
+    return _executor
+
+def _parse_reply(text, catalog):
+    return [name.strip() for name in text.split(',') if name.strip() in catalog.by_name]
+
+def select_tables(catalog, question, build_message, invoke):
+    """
+    Select candidate tables by querying every shard in parallel.
+
+    Args:
+        catalog (Catalog): Parsed schema
+        question (str): User query description
+        build_message (callable): (catalog_text, question) -> prompt message
+        invoke (callable): [messages] -> reply with .content
+
+    Returns:
+        str: Comma separated table names, FK closure included
+    """
+    executor = _get_executor()
+    futures = []
+    for shard in catalog.shards():
+        message = build_message('\n'.join(catalog.description_line(name) for name in shard), question)
+        # copy the context so tracing spans land in the request's trace
+        futures.append(executor.submit(contextvars.copy_context().run, invoke, [message]))
+    names = []
+    for future in futures:
+        names.extend(_parse_reply(future.result().content, catalog))
+    return ','.join(catalog.fk_closure(names))
+
+async def aselect_tables(catalog, question, build_message, ainvoke):
+    """Async variant of select_tables; shards are awaited concurrently"""
+    messages = [
+        build_message('\n'.join(catalog.description_line(name) for name in shard), question)
+        for shard in catalog.shards()
+    ]
+    replies = await asyncio.gather(*[ainvoke([message]) for message in messages])
+    names = []
+    for reply in replies:
+        names.extend(_parse_reply(reply.content, catalog))
+    return ','.join(catalog.fk_closure(names))
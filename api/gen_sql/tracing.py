@@ -0,0 +1,197 @@
+import time
+import bisect
+import inspect
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from langchain_core.callbacks import BaseCallbackHandler
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+class Histogram:
+    """Cumulative fixed-bucket histogram"""
+
+    def __init__(self, name, buckets):
+        self.name = name
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        """Estimate a quantile as the upper bound of the bucket that contains it"""
+        with self._lock:
+            if not self.count:
+                return None
+            rank = q * self.count
+            seen = 0
+            for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+                seen += count
+                if seen >= rank:
+                    return bound
+        return float('inf')
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self.counts)
+            count, total = self.count, self.sum
+        return {
+            'count': count,
+            'sum': round(total, 6),
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], counts))
+        }
+
+class Trace:
+    """Phases recorded while serving one request"""
+
+    def __init__(self):
+        self.spans = []
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.retries = 0
+        self.notes = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, name, seconds):
+        with self._lock:
+            self.spans.append((name, seconds))
+
+    def add_usage(self, prompt_tokens, completion_tokens):
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+    def add_retries(self, retries):
+        with self._lock:
+            self.retries += retries
+
+    def annotate(self, name, value):
+        """Attach a per-request value that is reported in Server-Timing as a description"""
+        with self._lock:
+            self.notes[name] = value
+
+    def totals(self):
+        """Summed wall time and call count per phase, in first-seen order"""
+        totals = {}
+        with self._lock:
+            for name, seconds in self.spans:
+                total, calls = totals.get(name, (0.0, 0))
+                totals[name] = (total + seconds, calls + 1)
+        return totals
+
+    def server_timing(self):
+        """Render the trace as a Server-Timing header value"""
+        parts = [f'{name};dur={total * 1000:.1f}' for name, (total, calls) in self.totals().items()]
+        if self.prompt_tokens or self.completion_tokens:
+            parts.append(f'llm_tokens;desc="prompt={self.prompt_tokens} completion={self.completion_tokens}"')
+        if self.retries:
+            parts.append(f'llm_retries;desc="{self.retries}"')
+        for name, value in self.notes.items():
+            parts.append(f'{name};desc="{value}"')
+        return ', '.join(parts)
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+
+def get_histogram(name, buckets=LATENCY_BUCKETS):
+    histogram = _histograms.get(name)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault(name, Histogram(name, buckets))
+    return histogram
+
+def observe(name, value, buckets=LATENCY_BUCKETS):
+    get_histogram(name, buckets).observe(value)
+
+def snapshot():
+    """Snapshot of every histogram, keyed by name"""
+    with _histograms_lock:
+        histograms = list(_histograms.values())
+    return {h.name: h.snapshot() for h in histograms}
+
+def start_trace():
+    """Begin collecting phases for the current request context"""
+    trace = Trace()
+    return trace, _current_trace.set(trace)
+
+def end_trace(token):
+    _current_trace.reset(token)
+
+def current_trace():
+    return _current_trace.get()
+
+@contextmanager
+def span(name):
+    """Time a block into the '<name>_seconds' histogram and the current trace"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        observe(f'{name}_seconds', seconds)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_span(name, seconds)
+
+def traced(name):
+    """Decorator form of span for sync and async functions (e.g. graph nodes)"""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def annotate(name, value):
+    """Attach a value to the current trace, if any"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.annotate(name, value)
+
+def record_llm_usage(reply):
+    """Record prompt and completion token counts from a chat model reply"""
+    usage = getattr(reply, 'usage_metadata', None) or {}
+    prompt_tokens = usage.get('input_tokens', 0)
+    completion_tokens = usage.get('output_tokens', 0)
+    observe('llm_prompt_tokens', prompt_tokens, TOKEN_BUCKETS)
+    observe('llm_completion_tokens', completion_tokens, TOKEN_BUCKETS)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_usage(prompt_tokens, completion_tokens)
+
+class RetryCounter(BaseCallbackHandler):
+    """LangChain callback that counts retries into the 'llm_retries' histogram and the trace"""
+
+    def __init__(self):
+        self.retries = 0
+
+    def on_retry(self, retry_state, **kwargs):
+        self.retries += 1
+
+    def flush(self):
+        observe('llm_retries', self.retries, (0, 1, 2, 3, 5, 10))
+        trace = _current_trace.get()
+        if trace is not None and self.retries:
+            trace.add_retries(self.retries)
@@ -0,0 +1,269 @@
+import os
+import queue
+import logging
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import metrics
+
+# Counting worker processes; 0 counts on threads of the API process instead
+POOL_SIZE = int(os.getenv('COUNT_WORKERS', '2'))
+# Cancelled task ids kept for the workers to see; a worker checks every CANCEL_CHECK frames
+CANCEL_SLOTS = 256
+# Split uploaded videos into this many segments counted in parallel; 0 or 1 counts in one pass
+DEFAULT_SEGMENTS = int(os.getenv('COUNT_SEGMENTS', '0'))
+CANCEL_CHECK = 10
+# Progress events waiting for a slow consumer beyond this are dropped; they
+# carry cumulative counts, so the next one replaces them
+MAX_PENDING = int(os.getenv('COUNT_MAX_PENDING', '64'))
+
+# set in each worker process by _init_worker
+_events = None
+_cancelled = None
+
+def _init_worker(events, cancelled, threads):
+    """Pool initializer: keep the channels and load the model once per process"""
+    global _events, _cancelled
+    _events, _cancelled = events, cancelled
+    if threads:
+        # share the cores between the workers instead of each torch using all of them
+        import torch
+        torch.set_num_threads(threads)
+    import model_registry
+    model_registry.preload()
+
+def _ready():
+    return os.getpid()
+
+def _stream(task_id, events):
+    """Send every event of the generator back on the events queue"""
+    try:
+        for n, progress in enumerate(events):
+            # the JSON string as the generator produced it, no re-encoding
+            _events.put((task_id, progress))
+            if n % CANCEL_CHECK == 0 and task_id in _cancelled[:]:
+                break
+    finally:
+        events.close()
+        # end of this task's events; its outcome follows on the future
+        _events.put((task_id, None))
+
+def _count(task_id, video_path, line, options):
+    """Runs in a worker: count_object over the whole video"""
+    import counter
+    _stream(task_id, counter.count_object(
+        video_path, tuple(line[:2]), tuple(line[2:]), stride=options.get('stride'),
+        target_fps=options.get('fps'), batch_size=options.get('batch'), classes=options.get('classes')))
+
+def _count_segment(task_id, video_path, line, segment, options):
+    """Runs in a worker: one frame range of a segmented count"""
+    import segments
+    _stream(task_id, segments.count_segment(
+        video_path, line, segment, classes=options.get('classes'), stride=options.get('stride'),
+        batch_size=options.get('batch')))
+
+class InferencePool:
+    """
+    Process pool that runs count_object away from the API process.
+
+    Decoding, YOLO and the NumPy/OpenCV post-processing hold the GIL for most
+    of a frame, so counting on request threads slows every other request of
+    the process. The workers are spawned processes (no fork of a threaded
+    server) that load the model once in their initializer. A video goes to
+    them as a file path and options, never as frames, and every progress
+    event comes back on one shared multiprocessing queue, which a dispatcher
+    thread routes to the generator of the task that produced it.
+
+    Frames processed are counted in this process as progress arrives; stage
+    histograms and track gauges stay with the worker, the last event still
+    reports them.
+
+    Workers do not wait for the HTTP client. When a task's consumer falls
+    more than MAX_PENDING events behind, further intermediate progress is
+    dropped instead of buffered; end events and the end marker always get
+    through.
+    """
+
+    def __init__(self, size=POOL_SIZE):
+        self.size = size
+        self._context = multiprocessing.get_context('spawn')
+        self._events = self._context.Queue()
+        self._cancelled = self._context.Array('q', CANCEL_SLOTS)
+        self._threads = max(1, (os.cpu_count() or 1) // size)
+        self._lock = threading.Lock()
+        self._executor = self._new_executor()
+        self._tasks = {}
+        self._ids = itertools.count(1)
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.restarts = 0
+        self.dropped = 0
+        threading.Thread(target=self._dispatch, name='count-pool-events', daemon=True).start()
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(
+            max_workers=self.size, mp_context=self._context, initializer=_init_worker,
+            initargs=(self._events, self._cancelled, self._threads))
+
+    def warmup(self):
+        """Start all workers now, so their model loads before the first video"""
+        with self._lock:
+            executor = self._executor
+        return [executor.submit(_ready) for _ in range(self.size)]
+
+    def _dispatch(self):
+        while True:
+            task_id, progress = self._events.get()
+            intermediate = progress is not None and '"end": false' in progress
+            if intermediate:
+                metrics.VIDEO_FRAMES.inc()
+            with self._lock:
+                inbox = self._tasks.get(task_id)
+                # events of a cancelled task arrive after its generator is gone
+                if inbox is None:
+                    continue
+                if intermediate and inbox.qsize() >= MAX_PENDING:
+                    self.dropped += 1
+                    continue
+            inbox.put(progress)
+
+    def _submit(self, *args):
+        with self._lock:
+            try:
+                return self._executor.submit(*args)
+            except BrokenProcessPool:
+                # a worker died (e.g. out of memory); the old pool cannot take work
+                logging.warning('Counting worker pool broken, starting a new one')
+                self.restarts += 1
+                self._executor = self._new_executor()
+                return self._executor.submit(*args)
+
+    def count(self, video_path, line, classes=None, stride=None, target_fps=None, batch_size=None):
+        """
+        count_object(video_path, ...) in a worker process.
+
+        Args:
+            line (sequence): x1, y1, x2, y2
+
+        Yields:
+            str: count_object's JSON progress events
+        """
+        options = {'classes': classes, 'stride': stride, 'fps': target_fps, 'batch': batch_size}
+        return self._follow(_count, video_path, [int(v) for v in line], options)
+
+    def count_segment(self, video_path, line, segment, classes=None, stride=None, batch_size=None):
+        """segments.count_segment in a worker process; yields its JSON events"""
+        options = {'classes': classes, 'stride': stride, 'batch': batch_size}
+        return self._follow(_count_segment, video_path, [int(v) for v in line], segment, options)
+
+    def _follow(self, task, *args):
+        task_id = next(self._ids)
+        inbox = queue.Queue()
+        with self._lock:
+            self._tasks[task_id] = inbox
+            self.submitted += 1
+        future = None
+        outcome = 'cancelled'
+        metrics.VIDEO_STREAMS.inc()
+        try:
+            future = self._submit(task, task_id, *args)
+            while True:
+                try:
+                    progress = inbox.get(timeout=1)
+                except queue.Empty:
+                    # a crashed worker never sends its end marker
+                    if future.done() and future.exception() is not None:
+                        future.result()
+                    continue
+                if progress is None:
+                    future.result()
+                    outcome = 'completed'
+                    return
+                yield progress
+        except Exception:
+            outcome = 'failed'
+            raise
+        finally:
+            with self._lock:
+                del self._tasks[task_id]
+                setattr(self, outcome, getattr(self, outcome) + 1)
+            if outcome == 'cancelled' and future is not None and not future.cancel():
+                # the consumer went away while a worker runs the task: tell it to stop
+                self._cancelled[task_id % CANCEL_SLOTS] = task_id
+            metrics.VIDEO_STREAMS.dec()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.size,
+                'threads_per_worker': self._threads,
+                'running': len(self._tasks),
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'cancelled': self.cancelled,
+                'restarts': self.restarts,
+                'dropped': self.dropped
+            }
+
+    def shutdown(self):
+        with self._lock:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = InferencePool()
+        return _pool
+
+def count_object(video_path, line, classes=None, stride=None, target_fps=None, batch_size=None, segments=None):
+    """
+    counter.count_object for the API: in the worker pool, or on the calling
+    thread when COUNT_WORKERS is 0. With segments > 1 (default
+    COUNT_SEGMENTS) a long video is split and its segments are counted in
+    parallel (see segments.count_segmented).
+
+    Yields:
+        str: JSON progress events
+    """
+    if segments is None:
+        segments = DEFAULT_SEGMENTS
+    if segments > 1:
+        import segments as segmented
+        return segmented.count_segmented(video_path, line, classes=classes, stride=stride,
+                                         target_fps=target_fps, batch_size=batch_size, segments=segments)
+    if POOL_SIZE > 0:
+        return get_pool().count(video_path, line, classes=classes, stride=stride,
+                                target_fps=target_fps, batch_size=batch_size)
+    import counter
+    return counter.count_object(video_path, tuple(line[:2]), tuple(line[2:]), stride=stride,
+                                target_fps=target_fps, batch_size=batch_size, classes=classes)
+
+def count_segment(video_path, line, segment, classes=None, stride=None, batch_size=None):
+    """segments.count_segment in the worker pool, or on the calling thread when COUNT_WORKERS is 0"""
+    if POOL_SIZE > 0:
+        return get_pool().count_segment(video_path, line, segment, classes=classes, stride=stride,
+                                        batch_size=batch_size)
+    import segments
+    return segments.count_segment(video_path, line, segment, classes=classes, stride=stride, batch_size=batch_size)
+
+def start():
+    """Start the workers (and their model loads) or, without a pool, preload in this process"""
+    if POOL_SIZE > 0:
+        get_pool().warmup()
+    else:
+        import model_registry
+        model_registry.preload_in_background()
+
+def stats():
+    if POOL_SIZE <= 0:
+        return {'workers': 0}
+    return get_pool().stats()
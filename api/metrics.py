@@ -0,0 +1,367 @@
+import os
+import time
+import bisect
+import itertools
+import threading
+from flask import Response, request, request_started
+
+# Counter updates take one of this many locks, picked by thread, so request
+# threads rarely contend
+SHARDS = int(os.getenv('METRICS_SHARDS', '16'))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_thread_shard = threading.local()
+_next_shard = itertools.count()
+
+def _shard():
+    """Shard index of the calling thread, handed out round robin"""
+    shard = getattr(_thread_shard, 'index', None)
+    if shard is None:
+        shard = _thread_shard.index = next(_next_shard) % SHARDS
+    return shard
+
+class _Sharded:
+    """A vector of numbers split over SHARDS lock-protected copies; reads sum them"""
+
+    def __init__(self, size):
+        self._shards = [([0] * size, threading.Lock()) for _ in range(SHARDS)]
+
+    def add(self, index, value):
+        values, lock = self._shards[_shard()]
+        with lock:
+            values[index] += value
+
+    def add_pair(self, index, value, total_index, total):
+        values, lock = self._shards[_shard()]
+        with lock:
+            values[index] += value
+            values[total_index] += total
+
+    def totals(self):
+        totals = None
+        for values, lock in self._shards:
+            with lock:
+                copy = list(values)
+            totals = copy if totals is None else [a + b for a, b in zip(totals, copy)]
+        return totals
+
+class _CounterChild:
+    def __init__(self):
+        self._value = _Sharded(1)
+
+    def inc(self, amount=1):
+        self._value.add(0, amount)
+
+    def samples(self, name, labels):
+        return [(name, labels, self._value.totals()[0])]
+
+class _GaugeChild(_CounterChild):
+    def dec(self, amount=1):
+        self._value.add(0, -amount)
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # one slot per bucket, one for +Inf and the running sum
+        self._values = _Sharded(len(buckets) + 2)
+
+    def observe(self, value):
+        self._values.add_pair(bisect.bisect_left(self.buckets, value), 1, len(self.buckets) + 1, value)
+
+    def samples(self, name, labels):
+        values = self._values.totals()
+        return _histogram_samples(name, labels, self.buckets, values[:-1], values[-1])
+
+def _histogram_samples(name, labels, buckets, counts, total):
+    samples = []
+    cumulative = 0
+    for bound, count in zip(list(buckets) + ['+Inf'], counts):
+        cumulative += count
+        samples.append((f'{name}_bucket', dict(labels, le=str(bound)), cumulative))
+    samples.append((f'{name}_sum', labels, total))
+    samples.append((f'{name}_count', labels, cumulative))
+    return samples
+
+class _Family:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self._new_child()
+        (registry or REGISTRY).register(self)
+
+    def labels(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def collect(self):
+        with self._lock:
+            children = list(self._children.items())
+        if not self.labelnames:
+            children.append(((), self._default))
+        samples = []
+        for key, child in children:
+            samples.extend(child.samples(self.name, dict(zip(self.labelnames, key))))
+        return [(self.name, self.kind, self.documentation, samples)]
+
+class Counter(_Family):
+    """Monotonic counter; exposed as <name>_total"""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        super().__init__(name if name.endswith('_total') else f'{name}_total', documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+class Gauge(_Family):
+    """Up/down value such as requests in flight"""
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def dec(self, amount=1):
+        self._default.dec(amount)
+
+class Histogram(_Family):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+class Registry:
+    """Metric families plus collectors that turn other stats into families at scrape time"""
+
+    def __init__(self):
+        self._families = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, family):
+        with self._lock:
+            self._families.append(family)
+
+    def register_collector(self, collector):
+        """collector() returns a list of (name, kind, help, [(sample name, labels, value)])"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        """Prometheus text exposition format"""
+        with self._lock:
+            sources = [family.collect for family in self._families] + list(self._collectors)
+        lines = []
+        for collect in sources:
+            try:
+                families = collect()
+            except Exception as e:
+                lines.append(f'# collector error: {_escape(str(e))}')
+                continue
+            for name, kind, documentation, samples in families:
+                lines.append(f'# HELP {name} {_escape(documentation)}')
+                lines.append(f'# TYPE {name} {kind}')
+                for sample, labels, value in samples:
+                    lines.append(f'{sample}{_labels(labels)} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(str(value))}"' for key, value in labels.items()) + '}'
+
+def _number(value):
+    if value is None:
+        return 'NaN'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = Counter('http_requests', 'HTTP responses by route and status', ['app', 'method', 'route', 'status'])
+HTTP_LATENCY = Histogram('http_request_duration_seconds', 'Time until the response body was fully sent', ['app', 'method', 'route'])
+HTTP_RESPONSE_BYTES = Histogram('http_response_size_bytes', 'Response body size', ['app', 'route'], buckets=SIZE_BUCKETS)
+HTTP_IN_FLIGHT = Gauge('http_requests_in_flight', 'Requests being served, including open streams', ['app'])
+
+DB_QUERY_SECONDS = Histogram('db_query_duration_seconds', 'SQL execution time', ['operation'])
+DB_ROWS = Counter('db_rows_returned', 'Rows returned by SQL queries', ['operation'])
+VIDEO_FRAMES = Counter('video_frames_processed', 'Frames run through the detector')
+VIDEO_STAGE_SECONDS = Histogram('video_stage_duration_seconds', 'Busy time per item of each counting pipeline stage', ['stage'])
+VIDEO_TRACKS = Gauge('video_tracks', 'Tracks held in memory by counting streams')
+VIDEO_TRACK_BYTES = Gauge('video_track_state_bytes', 'Bytes of track state held by counting streams')
+VIDEO_TRACKS_EVICTED = Counter('video_tracks_evicted', 'Tracks dropped after not being seen for COUNT_TRACK_MAX_AGE frames')
+VIDEO_STREAMS = Gauge('video_streams_active', 'Counting streams being processed')
+
+class _Body:
+    """Response iterable that counts bytes and records the request when closed"""
+
+    def __init__(self, body, finish):
+        self._body = body
+        self._finish = finish
+        self.size = 0
+
+    def __iter__(self):
+        for chunk in self._body:
+            self.size += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self._body, 'close'):
+                self._body.close()
+        finally:
+            self._finish(self.size)
+
+class MetricsMiddleware:
+    """
+    WSGI middleware recording per-route request counts, latency, response size
+    and in-flight requests.
+
+    The route label is the matched URL rule (e.g. /api/dashboard/<int:dashboard_id>)
+    so paths with ids do not create a label per id. Latency runs until the body
+    is closed, which for streamed responses is the length of the stream.
+    """
+
+    def __init__(self, wsgi_app, app_name):
+        self.wsgi_app = wsgi_app
+        self.app_name = app_name
+        self.in_flight = HTTP_IN_FLIGHT.labels(app=app_name)
+
+    def track(self, environ):
+        """
+        Start recording a request; call the returned finish(status, size)
+        once its body is closed. Also used for requests served outside WSGI.
+        """
+        started = time.perf_counter()
+        self.in_flight.inc()
+
+        def finish(status, size):
+            route = _route(environ)
+            method = environ.get('REQUEST_METHOD', '')
+            HTTP_REQUESTS.labels(app=self.app_name, method=method, route=route, status=status).inc()
+            HTTP_LATENCY.labels(app=self.app_name, method=method, route=route).observe(time.perf_counter() - started)
+            HTTP_RESPONSE_BYTES.labels(app=self.app_name, route=route).observe(size)
+            self.in_flight.dec()
+        return finish
+
+    def __call__(self, environ, start_response):
+        status = ['500']
+        finish = self.track(environ)
+
+        def recording_start_response(code, headers, exc_info=None):
+            status[0] = code.split(' ', 1)[0]
+            return start_response(code, headers, exc_info)
+
+        try:
+            body = self.wsgi_app(environ, recording_start_response)
+        except BaseException:
+            finish('500', 0)
+            raise
+        return _Body(body, lambda size: finish(status[0], size))
+
+def _route(environ):
+    return environ.get('metrics.route', 'unmatched')
+
+def _record_route(sender, **extra):
+    """
+    request_started: keep the matched rule in the environ. finish runs when
+    the body is closed, after the request context (and its url_rule) is gone.
+    """
+    if request.url_rule is not None:
+        request.environ['metrics.route'] = request.url_rule.rule
+
+def histogram_families(prefix, snapshots):
+    """Families for tracing.Histogram snapshots (per-bucket counts)"""
+    families = []
+    for name, snap in snapshots.items():
+        buckets = [bound for bound in snap['buckets'] if bound != '+Inf']
+        samples = _histogram_samples(f'{prefix}_{name}', {}, buckets, list(snap['buckets'].values()), snap['sum'])
+        families.append((f'{prefix}_{name}', 'histogram', f'{name} recorded by request tracing', samples))
+    return families
+
+def stats_families(name, documentation, rows, label, counters, gauges=()):
+    """Families from a list of stats dicts, one labelled series per dict"""
+    families = []
+    for field in counters:
+        samples = [(f'{name}_{field}_total', {label: row[label]}, row[field]) for row in rows]
+        families.append((f'{name}_{field}_total', 'counter', f'{documentation}: {field}', samples))
+    for field in gauges:
+        samples = [(f'{name}_{field}', {label: row[label]}, row[field]) for row in rows]
+        families.append((f'{name}_{field}', 'gauge', f'{documentation}: {field}', samples))
+    return families
+
+def _admission_families():
+    from admission import scheduler
+    stats = scheduler.stats()
+    rows = [dict(w, workload=name) for name, w in stats['workloads'].items()]
+    families = stats_families('admission', 'Admission control per workload class', rows, 'workload',
+                              ['admitted', 'rejected', 'timed_out'], ['in_flight', 'queued'])
+    for name, w in stats['workloads'].items():
+        families.extend(histogram_families(f'admission_{name}', {'queue_wait_seconds': w['queue_wait_seconds']}))
+    return families
+
+CIRCUIT_STATES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+def _llm_families():
+    from gen_sql.llm_call import all_stats
+    rows = [dict(row, circuit_state=CIRCUIT_STATES.get(row['circuit'], -1)) for row in all_stats()]
+    return stats_families('llm_caller', 'LLM provider calls', rows, 'name',
+                          ['calls', 'hedges', 'retries', 'failures', 'rejected', 'abandoned', 'client_errors'], ['circuit_state'])
+
+def _tracing_families():
+    from gen_sql import tracing
+    return histogram_families('phase', tracing.snapshot())
+
+def install(app, app_name, single_flights=(), registry=REGISTRY):
+    """
+    Wrap app with MetricsMiddleware and serve registry at /metrics.
+
+    Args:
+        app (Flask): Application to instrument
+        app_name (str): Value of the 'app' label
+        single_flights (iterable): SingleFlight instances whose counters are exported
+    """
+    app.wsgi_app = MetricsMiddleware(app.wsgi_app, app_name)
+    request_started.connect(_record_route, app)
+    if not getattr(registry, '_defaults', False):
+        registry._defaults = True
+        registry.register_collector(_admission_families)
+        registry.register_collector(_llm_families)
+        registry.register_collector(_tracing_families)
+    flights = list(single_flights)
+    if flights:
+        registry.register_collector(lambda: stats_families(
+            'single_flight', 'Coalesced executions', [flight.stats() for flight in flights], 'name',
+            ['executed', 'coalesced'], ['in_flight']))
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(registry.render(), content_type=CONTENT_TYPE)
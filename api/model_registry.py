@@ -0,0 +1,89 @@
+import os
+import copy
+import time
+import logging
+import threading
+import numpy as np
+from ultralytics import YOLO
+
+DEFAULT_MODEL = os.getenv('COUNT_MODEL', 'yolo11n.pt')
+# Frame size used by the counting endpoints, also used for the warmup inference
+WARMUP_SHAPE = (480, 860, 3)
+
+_models = {}
+_stats = {}
+_lock = threading.Lock()
+_load_locks = {}
+
+def _load(model_path):
+    started = time.perf_counter()
+    model = YOLO(model_path)
+    loaded = time.perf_counter()
+    # first inference builds the predictor and fuses layers; pay it here, not on the first frame
+    model.predict(np.zeros(WARMUP_SHAPE, dtype=np.uint8), verbose=False)
+    # the warmup predictor is not needed; sessions build their own
+    model.predictor = None
+    with _lock:
+        _stats[model_path] = {
+            'load_seconds': round(loaded - started, 3),
+            'warmup_seconds': round(time.perf_counter() - loaded, 3),
+            'sessions': 0
+        }
+    logging.info(f'Loaded {model_path} in {loaded - started:.2f}s')
+    return model
+
+def get_model(model_path=DEFAULT_MODEL):
+    """
+    Shared, warmed-up YOLO model for model_path, loaded once per process.
+
+    Do not call track/predict on it directly from concurrent streams; use
+    new_session for per-stream predictor and tracker state.
+    """
+    model = _models.get(model_path)
+    if model is not None:
+        return model
+    with _lock:
+        load_lock = _load_locks.setdefault(model_path, threading.Lock())
+    # one loader per variant; other variants load in parallel
+    with load_lock:
+        model = _models.get(model_path)
+        if model is None:
+            model = _models[model_path] = _load(model_path)
+    return model
+
+def new_session(model_path=DEFAULT_MODEL):
+    """
+    Per-stream view of the shared model.
+
+    The returned YOLO shares the network weights with the registry copy but
+    has its own predictor, tracker callbacks and overrides, so model.track(...,
+    persist=True) keeps track ids per stream.
+    """
+    shared = get_model(model_path)
+    session = copy.copy(shared)
+    session.predictor = None
+    session.callbacks = {event: list(callbacks) for event, callbacks in shared.callbacks.items()}
+    session.overrides = dict(shared.overrides)
+    with _lock:
+        _stats[model_path]['sessions'] += 1
+    return session
+
+def preload(model_paths=None):
+    """Load and warm up models, by default those listed in COUNT_PRELOAD_MODELS"""
+    if model_paths is None:
+        model_paths = [path for path in os.getenv('COUNT_PRELOAD_MODELS', DEFAULT_MODEL).split(',') if path]
+    for model_path in model_paths:
+        try:
+            get_model(model_path)
+        except Exception as e:
+            logging.warning(f'Could not preload {model_path}: {e}')
+
+def preload_in_background(model_paths=None):
+    """Start preload on a daemon thread so the server accepts requests meanwhile"""
+    thread = threading.Thread(target=preload, args=(model_paths,), name='model-preload', daemon=True)
+    thread.start()
+    return thread
+
+def stats():
+    with _lock:
+        return {path: dict(values) for path, values in _stats.items()}
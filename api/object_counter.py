@@ -1,6 +1,8 @@
 import cv2
 import numpy as np
-from ultralytics import YOLO
+import model_registry
+from video_io import FrameSampler
+from tracks import TrackState, IN, OUT
 from collections import defaultdict
 import time
            
@@ -16,14 +18,13 @@ class LiveObjectCounter:
             model_path: Path to YOLOv11 model (will download if not exists)
             confidence_threshold: Minimum confidence for detections
         """
-        self.model = YOLO(model_path)
+        self.model = model_registry.new_session(model_path)
         self.confidence_threshold = confidence_threshold
         self.class_names = self.model.names
         self.colors = self._generate_colors()
-        self.hist = {}
+        self.tracks = TrackState(line_p1, line_p2)
         self.object_in = 0
         self.object_out = 0
-        self.counted = set()
         self.line_p1 = line_p1
         self.line_p2 = line_p2
         
@@ -58,45 +59,39 @@ class LiveObjectCounter:
             boxes = results[0].boxes.xyxy.cpu().numpy()
             confidences = results[0].boxes.conf.cpu().numpy()
             class_ids = results[0].boxes.cls.cpu().numpy().astype(int)
-            track_ids = results[0].boxes.id.int().cpu().numpy()#.tolist() if results[0].boxes.id is not None else [-1]*len(boxes)
-            #print('ids:::',track_ids, 'boxes::', boxes)
-            for box, conf, class_id, track_id in zip(boxes, confidences, class_ids, track_ids):
-                if conf >= self.confidence_threshold:
-                    # Get class name and increment count
-                    class_name = self.class_names[class_id]
-                    object_counts[class_name] += 1
+            track_ids = results[0].boxes.id.int().cpu().numpy() if results[0].boxes.id is not None else np.full(len(boxes), -1)
+            keep = confidences >= self.confidence_threshold
+            boxes, confidences, class_ids, track_ids = boxes[keep], confidences[keep], class_ids[keep], track_ids[keep]
+            # line crossings of all boxes in one vectorized update
+            crossed = self.tracks.update(boxes.astype(int), track_ids)
+            self.object_in, self.object_out = self.tracks.total_in, self.tracks.total_out
+            for box, conf, class_id, track_id, direction in zip(boxes, confidences, class_ids, track_ids, crossed):
+                # Get class name and increment count
+                class_name = self.class_names[class_id]
+                object_counts[class_name] += 1
                     
-                    # Draw bounding box
-                    x1, y1, x2, y2 = map(int, box)
-                    cx=(x1+x2)//2
-                    cy=(y1+y2)//2
-                    if track_id in self.hist and track_id not in self.counted:
-                        prev_cx, prev_cy=self.hist[track_id]
-                        side_1=calculate(prev_cx, prev_cy, *self.line_p1, *self.line_p2)
-                        side_2=calculate(cx, cy, *self.line_p1, *self.line_p2)
-                        if side_1*side_2<0:
-                            if side_2<0:
-                                self.object_in +=1
-                                cv2.circle(annotated_frame, (cx, cy), 15, color=(0,255,0),thickness= -1)
-                            else:
-                                self.object_out +=1
-                                cv2.rectangle(annotated_frame, (cx, cy), 15, color=(0,0,255),thickness= -1)
-                            self.counted.add(track_id)
+                # Draw bounding box
+                x1, y1, x2, y2 = map(int, box)
+                cx=(x1+x2)//2
+                cy=(y1+y2)//2
+                if direction == IN:
+                    cv2.circle(annotated_frame, (cx, cy), 15, color=(0,255,0),thickness= -1)
+                elif direction == OUT:
+                    cv2.circle(annotated_frame, (cx, cy), 15, color=(0,0,255),thickness= -1)
 
-                    self.hist[track_id]=(cx, cy)
-                    color = self.colors[class_id]
+                color = self.colors[class_id]
                     
-                    cv2.rectangle(annotated_frame, (x1, y1), (x2, y2), color, 2)
+                cv2.rectangle(annotated_frame, (x1, y1), (x2, y2), color, 2)
                     
-                    # Draw label with confidence
-                    label = f"{class_name}-{track_id}: {conf:.2f}"
-                    label_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)[0]
+                # Draw label with confidence
+                label = f"{class_name}-{track_id}: {conf:.2f}"
+                label_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)[0]
                     
-                    cv2.line(annotated_frame, self.line_p1, self.line_p2, color=(0, 255, 255), thickness=2)
-                    cv2.rectangle(annotated_frame, (x1, y1 - label_size[1] - 10), 
-                                (x1 + label_size[0], y1), color, -1)
-                    cv2.putText(annotated_frame, label, (x1, y1 - 5), 
-                              cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
+                cv2.line(annotated_frame, self.line_p1, self.line_p2, color=(0, 255, 255), thickness=2)
+                cv2.rectangle(annotated_frame, (x1, y1 - label_size[1] - 10), 
+                            (x1 + label_size[0], y1), color, -1)
+                cv2.putText(annotated_frame, label, (x1, y1 - 5), 
+                          cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
         
         return annotated_frame, dict(object_counts)
     
@@ -147,13 +142,15 @@ class LiveObjectCounter:
         
         return frame
     
-    def run_live_counting(self, camera_index=0, save_video=False):
+    def run_live_counting(self, camera_index=0, save_video=False, stride=None, target_fps=None):
         """
         Run live object counting from camera
         
         Args:
             camera_index: Camera index (0 for default camera)
             save_video: Whether to save the output video
+            stride: Process every Nth frame (default COUNT_FRAME_STRIDE)
+            target_fps: Process about this many frames per second of video instead
         """
         
         # Initialize camera
@@ -182,15 +179,8 @@ class LiveObjectCounter:
         
         print("Starting live object counting...")
         print("Press 'q' to quit, 's' to save current frame")
-        xp=0
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                print("Error: Could not read frame")
-                break
-            xp +=1
-            if xp % 3 !=0:
-                continue
+        # skipped frames are grabbed but not converted or processed
+        for xp, frame in FrameSampler(cap, stride=stride, target_fps=target_fps):
             
             # Process frame
             start_time = time.time()
@@ -233,6 +223,7 @@ class LiveObjectCounter:
         
         # Cleanup
         cap.release()
+        self.tracks.close()
         if out is not None:
             out.release()
         cv2.destroyAllWindows()
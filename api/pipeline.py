@@ -0,0 +1,147 @@
+import os
+import time
+import queue
+import threading
+import metrics
+
+# Items buffered between two stages; a full queue blocks the stage before it
+QUEUE_SIZE = int(os.getenv('COUNT_QUEUE_SIZE', '8'))
+
+_END = object()
+
+class _Failed:
+    def __init__(self, error):
+        self.error = error
+
+class StageStats:
+    """Items, busy time and time spent blocked on neighbours for one stage"""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.histogram = metrics.VIDEO_STAGE_SECONDS.labels(stage=name)
+
+    def record(self, busy, wait):
+        self.items += 1
+        self.busy_seconds += busy
+        self.wait_seconds += wait
+        self.histogram.observe(busy)
+
+    def snapshot(self):
+        return {
+            'items': self.items,
+            'busy_seconds': round(self.busy_seconds, 3),
+            'wait_seconds': round(self.wait_seconds, 3),
+            # what the stage could sustain on its own
+            'items_per_second': round(self.items / self.busy_seconds, 1) if self.busy_seconds else None
+        }
+
+class Pipeline:
+    """
+    Run a source and a chain of stages on their own threads, connected by
+    bounded queues.
+
+    The source (e.g. a FrameSampler) is iterated on a producer thread; each
+    stage function is applied to every item on its own thread, in order, and
+    the results come out of iterating the pipeline. While inference runs on
+    frame n the producer is already decoding frame n+1, so throughput tends
+    to the slowest stage instead of the sum of all stages. Full queues stall
+    the stage upstream, which bounds memory. Closing the iterator (e.g. the
+    client went away) stops every thread.
+
+    Args:
+        source (iterable): Items to process
+        stages (list): (name, fn) pairs; fn(item) returns the next item
+        queue_size (int): Capacity of each queue
+    """
+
+    def __init__(self, source, stages, queue_size=QUEUE_SIZE, source_name='decode'):
+        self.source = source
+        self.stages = stages
+        self.queue_size = queue_size
+        self.stats = {name: StageStats(name) for name in [source_name] + [name for name, _ in stages]}
+        self._source_stats = self.stats[source_name]
+        self._stop = threading.Event()
+
+    def _put(self, q, item):
+        """Put item on q unless the pipeline stops; returns seconds blocked"""
+        started = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        return time.perf_counter() - started
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _produce(self, out):
+        try:
+            iterator = iter(self.source)
+            while not self._stop.is_set():
+                started = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                busy = time.perf_counter() - started
+                self._source_stats.record(busy, self._put(out, item))
+        except Exception as e:
+            self._put(out, _Failed(e))
+        self._put(out, _END)
+
+    def _work(self, name, fn, inbox, out):
+        stats = self.stats[name]
+        while True:
+            waited = time.perf_counter()
+            item = self._get(inbox)
+            waited = time.perf_counter() - waited
+            if item is _END or isinstance(item, _Failed):
+                self._put(out, item)
+                return
+            started = time.perf_counter()
+            try:
+                result = fn(item)
+            except Exception as e:
+                self._put(out, _Failed(e))
+                self._put(out, _END)
+                return
+            busy = time.perf_counter() - started
+            stats.record(busy, waited + self._put(out, result))
+
+    def __iter__(self):
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._produce, args=(queues[0],), name='pipeline-decode', daemon=True)]
+        for (name, fn), inbox, out in zip(self.stages, queues, queues[1:]):
+            threads.append(threading.Thread(target=self._work, args=(name, fn, inbox, out), name=f'pipeline-{name}', daemon=True))
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = self._get(queues[-1])
+                if item is _END:
+                    return
+                if isinstance(item, _Failed):
+                    raise item.error
+                yield item
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+
+    def add_stats(self, name):
+        """Stats for work done by the consumer of the pipeline, reported with the stages"""
+        self.stats[name] = StageStats(name)
+        return self.stats[name]
+
+    def snapshot(self):
+        return {name: stats.snapshot() for name, stats in self.stats.items()}
@@ -0,0 +1,296 @@
+import os
+import json
+import math
+import time
+import queue
+import threading
+import numpy as np
+import inference_pool
+
+# Shorter segments are not worth a worker, the overlap would dominate
+MIN_SEGMENT_FRAMES = int(os.getenv('COUNT_SEGMENT_MIN_FRAMES', '1800'))
+# Source frames before each boundary decoded by both neighbours, so the next
+# segment's tracker is warmed up and its tracks can be matched to the previous one's
+OVERLAP_FRAMES = int(os.getenv('COUNT_SEGMENT_OVERLAP', '90'))
+# Mean box IoU over the overlap for two tracks to be the same object
+ASSOCIATE_IOU = 0.5
+# Seconds between aggregated progress events
+PROGRESS_INTERVAL = 0.5
+
+def plan_segments(frame_count, segments, stride=1, overlap=OVERLAP_FRAMES, min_frames=MIN_SEGMENT_FRAMES):
+    """
+    Split [0, frame_count) into up to segments frame ranges.
+
+    Boundaries and overlaps are multiples of stride, so neighbouring segments
+    sample the same frames in their overlap. Each segment decodes from start,
+    counts crossings from count_from (its boundary with the previous segment)
+    and keeps its tracks' boxes after tail_from for the next segment to match.
+
+    The last segment has no end (None) and reads to the end of the video:
+    frame_count is often only the container's estimate.
+
+    Returns:
+        list: dicts with index, start, count_from, end and tail_from
+    """
+    stride = max(1, int(stride))
+    segments = max(1, min(segments, frame_count // max(1, min_frames)))
+    length = math.ceil(frame_count / segments / stride) * stride
+    overlap = math.ceil(overlap / stride) * stride
+    plan = []
+    for index in range(segments):
+        count_from = index * length
+        if count_from >= frame_count:
+            break
+        end = count_from + length
+        last = index == segments - 1 or end >= frame_count
+        plan.append({
+            'index': index,
+            'start': max(0, count_from - overlap),
+            'count_from': count_from,
+            'end': None if last else end,
+            'tail_from': None if last else max(count_from, end - overlap)
+        })
+        if last:
+            break
+    return plan
+
+def _planned_frames(segment, frame_count):
+    """Source frames a segment spans, the last one up to the estimated frame_count"""
+    end = frame_count if segment['end'] is None else segment['end']
+    return max(0, end - segment['start'])
+
+def count_segment(video_path, line, segment, classes=None, stride=None, batch_size=None):
+    """
+    Count one planned segment: crossings on frames from count_from on, plus
+    the tracked boxes of the overlap windows at both ends.
+
+    Yields:
+        str: JSON progress; the last event (end true) carries the crossings
+        as [frame, track id, IN|OUT] and the head/tail boxes as
+        [frame, track id, x1, y1, x2, y2]
+    """
+    import counter
+    import model_registry
+    from video_io import FrameSampler
+    from tracks import TrackState, class_mask
+
+    model = model_registry.new_session(counter.MODEL)
+    # target_fps=0: the planned stride as is, never COUNT_TARGET_FPS, so the overlaps line up
+    cap = FrameSampler(video_path, stride=stride, target_fps=0, start=segment['start'], end=segment['end'])
+    pipeline = counter.tracking_pipeline(model, cap, batch_size)
+    batches = iter(pipeline)
+    frames = (item for batch in batches for item in batch)
+    allowed_classes = classes or counter.DEFAULT_CLASSES
+    allowed_ids = np.array([class_id for class_id, name in model.names.items() if name in allowed_classes])
+    tracks = TrackState(line[:2], line[2:])
+    count_from, tail_from = segment['count_from'], segment['tail_from']
+    crossings, head, tail = [], [], []
+    car_in = car_out = processed = 0
+    started = time.perf_counter()
+    fps = 0.0
+    try:
+        for index, _, boxes, track_ids, class_ids in frames:
+            keep = class_mask(class_ids, allowed_ids)
+            boxes, track_ids = boxes[keep], track_ids[keep]
+            crossed = tracks.update(boxes, track_ids)
+            if index < count_from:
+                # warm-up: the previous segment counts these frames
+                head.extend([index, int(t), *map(int, b)] for b, t in zip(boxes, track_ids) if t >= 0)
+            else:
+                for track_id, direction in zip(track_ids[crossed != 0], crossed[crossed != 0]):
+                    crossings.append([index, int(track_id), int(direction)])
+                    car_in += int(direction > 0)
+                    car_out += int(direction < 0)
+                if tail_from is not None and index >= tail_from:
+                    tail.extend([index, int(t), *map(int, b)] for b, t in zip(boxes, track_ids) if t >= 0)
+            processed += 1
+            fps = processed / max(time.perf_counter() - started, 1e-9)
+            yield json.dumps({"segment": segment['index'], "in": car_in, "out": car_out, "end": False,
+                              "currentFrame": index, "fps": round(fps, 1)})
+        yield json.dumps({"segment": segment['index'], "in": car_in, "out": car_out, "end": True,
+                          "frames": processed, "fps": round(fps, 1), "crossings": crossings,
+                          "head": head, "tail": tail, "stages": pipeline.snapshot(), "tracks": tracks.stats()})
+    finally:
+        frames.close()
+        batches.close()
+        cap.release()
+        tracks.close()
+
+def _iou(a, b):
+    """(n, 4) x (m, 4) boxes -> (n, m) intersection over union"""
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1)
+
+def associate(tail, head, min_iou=ASSOCIATE_IOU):
+    """
+    Re-associate the next segment's tracks with the previous segment's.
+
+    tail and head are the [frame, track id, x1, y1, x2, y2] boxes the two
+    segments tracked over the same overlap frames. A pair scores the IoU of
+    its boxes summed over the frames and divided by the frames either track
+    was seen on; pairs are matched greedily from the best score down.
+
+    Returns:
+        dict: next segment track id -> previous segment track id
+    """
+    tail = np.asarray(tail, dtype=np.float64).reshape(-1, 6)
+    head = np.asarray(head, dtype=np.float64).reshape(-1, 6)
+    if not len(tail) or not len(head):
+        return {}
+    scores = {}
+    for frame in np.intersect1d(tail[:, 0], head[:, 0]):
+        prev, nxt = tail[tail[:, 0] == frame], head[head[:, 0] == frame]
+        iou = _iou(prev[:, 2:], nxt[:, 2:])
+        for i, j in zip(*np.nonzero(iou)):
+            pair = (int(prev[i, 1]), int(nxt[j, 1]))
+            scores[pair] = scores.get(pair, 0.0) + iou[i, j]
+    prev_ids, prev_frames = np.unique(tail[:, 1], return_counts=True)
+    next_ids, next_frames = np.unique(head[:, 1], return_counts=True)
+    prev_frames = dict(zip(prev_ids.astype(int).tolist(), prev_frames.tolist()))
+    next_frames = dict(zip(next_ids.astype(int).tolist(), next_frames.tolist()))
+    links, used = {}, set()
+    ranked = sorted(((total / max(prev_frames[a], next_frames[b]), a, b) for (a, b), total in scores.items()), reverse=True)
+    for score, a, b in ranked:
+        if score < min_iou:
+            break
+        if b not in links and a not in used:
+            links[b] = a
+            used.add(a)
+    return links
+
+def merge(results):
+    """
+    Combine segment results, ordered by index, into one count.
+
+    Each crossing belongs to the segment whose range holds its frame. An
+    object is counted once, like in a single pass: a track re-associated
+    with an earlier segment's track that was already counted adds nothing.
+
+    Returns:
+        dict: in, out, duplicates (crossings dropped) and associated (tracks linked)
+    """
+    roots = {}
+    counted = set()
+    car_in = car_out = duplicates = associated = 0
+    for k, result in enumerate(results):
+        if k:
+            links = associate(results[k - 1]['tail'], result['head'])
+            for track_id, previous in links.items():
+                roots[(k, track_id)] = roots.get((k - 1, previous), (k - 1, previous))
+            associated += len(links)
+        for frame, track_id, direction in sorted(result['crossings']):
+            root = roots.get((k, track_id), (k, track_id))
+            if root in counted:
+                duplicates += 1
+                continue
+            counted.add(root)
+            car_in += direction > 0
+            car_out += direction < 0
+    return {'in': car_in, 'out': car_out, 'duplicates': duplicates, 'associated': associated}
+
+def _pump(index, events, out, stop):
+    """Thread: forward one segment's events to out until it ends or stop is set"""
+    try:
+        for progress in events:
+            if stop.is_set():
+                break
+            out.put((index, progress, None))
+    except Exception as e:
+        out.put((index, None, e))
+        return
+    finally:
+        events.close()
+    out.put((index, None, None))
+
+def count_segmented(video_path, line, classes=None, stride=None, target_fps=None, batch_size=None, segments=None):
+    """
+    Count a long video as segments in parallel workers.
+
+    The video is split into up to segments frame ranges (default one per
+    worker), each counted by
+    inference_pool.count_segment and so by its own worker process. Each
+    segment also decodes OVERLAP_FRAMES before its range to warm up its
+    tracker; merge() re-associates tracks across each overlap so an object
+    is not counted twice. Videos too short to split are counted in one pass.
+
+    A target_fps (or COUNT_TARGET_FPS) is turned into a whole-frame stride
+    once, here; the segments use that stride as is, so neighbouring
+    segments sample the same overlap frames.
+
+    Yields:
+        str: JSON progress with the summed counts and frames done over all
+        segments; the last event has the merged counts and per-segment stats
+    """
+    from video_io import FrameSampler
+    sampler = FrameSampler(video_path, stride=stride, target_fps=target_fps)
+    frame_count, step = sampler.frame_count, sampler.step
+    sampler.release()
+    stride = max(1, int(round(step)))
+    wanted = segments or max(1, inference_pool.POOL_SIZE)
+    plan = plan_segments(frame_count, wanted, stride)
+    if len(plan) <= 1:
+        yield from inference_pool.count_object(video_path, line, classes=classes, stride=stride, target_fps=0,
+                                               batch_size=batch_size, segments=1)
+        return
+
+    out = queue.Queue()
+    stop = threading.Event()
+    threads = []
+    for segment in plan:
+        events = inference_pool.count_segment(video_path, line, segment, classes=classes, stride=stride,
+                                              batch_size=batch_size)
+        thread = threading.Thread(target=_pump, args=(segment['index'], events, out, stop),
+                                  name=f'count-segment-{segment["index"]}', daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    planned = sum(_planned_frames(segment, frame_count) for segment in plan)
+    progress = {segment['index']: {'in': 0, 'out': 0, 'frames': 0, 'fps': 0.0} for segment in plan}
+    results = {}
+    started = time.perf_counter()
+    last_sent = 0.0
+    try:
+        while len(results) < len(plan):
+            index, event, error = out.get()
+            if error is not None:
+                raise error
+            if event is None:
+                if index not in results:
+                    raise RuntimeError(f'Segment {index} ended without a result')
+                continue
+            event = json.loads(event)
+            segment = plan[index]
+            if event['end']:
+                results[index] = event
+                progress[index].update(frames=_planned_frames(segment, frame_count), fps=0.0)
+                continue
+            progress[index].update(
+                {'in': event['in'], 'out': event['out'], 'fps': event['fps'],
+                 'frames': event['currentFrame'] - segment['start'] + 1})
+            now = time.perf_counter()
+            if now - last_sent >= PROGRESS_INTERVAL:
+                last_sent = now
+                done = sum(p['frames'] for p in progress.values())
+                # counts are provisional until the segments are merged
+                yield json.dumps({"in": sum(p['in'] for p in progress.values()),
+                                  "out": sum(p['out'] for p in progress.values()), "end": False,
+                                  "totalFrames": frame_count, "currentFrame": min(frame_count - 1, frame_count * done // planned),
+                                  "fps": round(sum(p['fps'] for p in progress.values()), 1), "segments": len(plan)})
+        ordered = [results[segment['index']] for segment in plan]
+        merged = merge(ordered)
+        elapsed = time.perf_counter() - started
+        processed = sum(result['frames'] for result in ordered)
+        yield json.dumps({"in": merged['in'], "out": merged['out'], "end": True, "totalFrames": frame_count,
+                          "currentFrame": frame_count - 1, "fps": round(processed / max(elapsed, 1e-9), 1),
+                          "duplicates": merged['duplicates'], "associated": merged['associated'],
+                          "segments": [dict(segment, frames=result['frames'], fps=result['fps'], stages=result['stages'])
+                                       for segment, result in zip(plan, ordered)]})
+    finally:
+        # stops the other segments' workers when one failed or the consumer went away
+        stop.set()
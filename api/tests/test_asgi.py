@@ -0,0 +1,87 @@
+"""
+Coroutine views served by asgi.AsyncViews share the event loop.
+
+Run from the api directory:
+    python -m unittest discover tests
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+import unittest
+from flask import Flask, jsonify, request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics
+from admission import admit, scheduler
+from asgi import AsyncViews
+
+def make_app():
+    app = Flask('asgi-test')
+
+    @app.route('/slow', methods=['POST'])
+    @admit('chat')
+    async def slow():
+        await asyncio.sleep(0.2)
+        return jsonify({'echo': request.json['n'], 'thread': threading.get_ident()})
+
+    @app.route('/sync')
+    @admit('interactive')
+    def sync():
+        return {'ok': True}
+
+    metrics.install(app, 'asgi-test')
+    return AsyncViews(app)
+
+async def call(app, method, path, body=b''):
+    scope = {'type': 'http', 'method': method, 'path': path, 'root_path': '', 'query_string': b'',
+             'http_version': '1.1', 'headers': [(b'content-type', b'application/json')],
+             'server': ('testserver', 80), 'client': ('127.0.0.1', 1234), 'scheme': 'http'}
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    status = next(m['status'] for m in sent if m['type'] == 'http.response.start')
+    return status, b''.join(m.get('body', b'') for m in sent if m['type'] == 'http.response.body')
+
+class AsyncViewsTest(unittest.TestCase):
+
+    def test_concurrent_coroutine_views_run_on_one_thread(self):
+        app = make_app()
+
+        async def main():
+            started = time.perf_counter()
+            replies = await asyncio.gather(*(call(app, 'POST', '/slow', json.dumps({'n': n}).encode())
+                                             for n in range(8)))
+            return time.perf_counter() - started, replies
+
+        elapsed, replies = asyncio.run(main())
+        bodies = [json.loads(body) for _, body in replies]
+        self.assertEqual([status for status, _ in replies], [200] * 8)
+        self.assertEqual([body['echo'] for body in bodies], list(range(8)))
+        self.assertEqual(len({body['thread'] for body in bodies}), 1)
+        # eight 0.2 s waits overlap instead of queueing
+        self.assertLess(elapsed, 1.0)
+        # the admission slots were released when the responses closed
+        self.assertEqual(scheduler.stats()['workloads']['chat']['in_flight'], 0)
+        self.assertIn('app="asgi-test",method="POST",route="/slow",status="200"} 8', metrics.REGISTRY.render())
+
+    def test_other_routes_go_to_the_wsgi_app(self):
+        status, body = asyncio.run(call(make_app(), 'GET', '/sync'))
+        self.assertEqual((status, json.loads(body)), (200, {'ok': True}))
+        self.assertEqual(scheduler.stats()['workloads']['interactive']['in_flight'], 0)
+        self.assertIn('app="asgi-test",method="GET",route="/sync",status="200"} 1', metrics.REGISTRY.render())
+
+if __name__ == '__main__':
+    unittest.main()
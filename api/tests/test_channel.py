@@ -0,0 +1,46 @@
+"""
+Channel commands that cannot run are rejected when posted.
+
+Run from the api directory:
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+from unittest import mock
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import channel
+
+class CountCommandTest(unittest.TestCase):
+
+    def setUp(self):
+        app = Flask('channel-test')
+        app.register_blueprint(channel.channel_bp)
+        self.client = app.test_client()
+        self.channel = channel.hub.connect()
+        self.addCleanup(channel.hub.disconnect, self.channel)
+
+    def post_count(self):
+        return self.client.post(f'/api/channel/{self.channel.id}', json={
+            'type': 'count', 'id': 'c1', 'video': 'cars.mp4', 'line': '0,10,100,10'})
+
+    def test_count_without_video_app_is_rejected(self):
+        with mock.patch.object(channel, 'COUNT_API_URL', ''):
+            response = self.post_count()
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('COUNT_API_URL', response.get_json()['error'])
+
+    def test_count_is_sent_to_the_video_app(self):
+        with mock.patch.object(channel, 'COUNT_API_URL', 'http://video:5001'), \
+             mock.patch.object(channel, '_count_job_events', return_value=iter([{'count': 2, 'end': True}])):
+            response = self.post_count()
+            self.assertEqual(response.status_code, 202)
+            event = self.channel.outbox.get(timeout=5)
+        self.assertEqual(event[1], 'counter')
+        self.assertEqual(event[2]['count'], 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+"""
+Counting job events across a restart, with a fake runner.
+
+Run from the api directory:
+    python -m unittest discover tests
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import counting_jobs
+
+def fake_runner(job):
+    for frame in range(5):
+        job.publish('progress', {'in': frame, 'out': 0, 'end': False, 'currentFrame': frame})
+    return {'in': 5, 'out': 0, 'end': True}
+
+def events(job, last_event_id):
+    stream = ''.join(counting_jobs.event_stream(job, last_event_id, heartbeat=0.1))
+    return [block.split('\n') for block in stream.strip().split('\n\n') if block.startswith('id:')]
+
+class RestartTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.video = os.path.join(self.workdir, 'video.mp4')
+        with open(self.video, 'wb') as f:
+            f.write(b'video')
+        self.store_path = os.path.join(self.workdir, 'jobs.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def finished_job(self):
+        manager = counting_jobs.JobManager(runner=fake_runner, store=counting_jobs.JobStore(self.store_path))
+        job, _ = manager.submit(self.video, [0, 1, 2, 3], ['car'])
+        events(job, 0)
+        # the result is stored right after the final event
+        manager._executor.shutdown(wait=True)
+        return job
+
+    def test_resume_after_restart_gets_the_outcome(self):
+        before = self.finished_job()
+        # a new process: the job comes back from the store
+        manager = counting_jobs.JobManager(runner=fake_runner, store=counting_jobs.JobStore(self.store_path))
+        job = manager.get(before.id)
+        self.assertEqual(job.last_event_id, before.last_event_id)
+        resumed = events(job, before.last_event_id - 2)
+        self.assertEqual([block[:2] for block in resumed], [[f'id: {before.last_event_id}', 'event: done']])
+        # the client already saw the outcome
+        self.assertEqual(events(job, before.last_event_id), [])
+
+    def test_unknown_event_id_gets_the_outcome(self):
+        job = self.finished_job()
+        self.assertEqual([block[1] for block in events(job, job.last_event_id + 50)], ['event: done'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+"""
+Route labels of the request metrics, through a Flask test client.
+
+Run from the api directory:
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+from flask import Flask, Response
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics
+
+def make_app(name):
+    app = Flask(name)
+
+    @app.route('/items/<int:item_id>')
+    def item(item_id):
+        return {'id': item_id}
+
+    @app.route('/stream')
+    def stream():
+        return Response(iter([b'a', b'b']))
+
+    metrics.install(app, name)
+    return app
+
+class RouteLabelTest(unittest.TestCase):
+
+    def test_requests_are_labelled_with_their_url_rule(self):
+        client = make_app('routes').test_client()
+        for path in ('/items/3', '/items/4', '/stream', '/missing'):
+            with client.get(path) as response:
+                response.get_data()
+        with client.get('/metrics') as response:
+            exported = response.get_data(as_text=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('app="routes",method="GET",route="/items/<int:item_id>",status="200"} 2', exported)
+        self.assertIn('app="routes",method="GET",route="/stream",status="200"} 1', exported)
+        self.assertIn('app="routes",method="GET",route="unmatched",status="404"} 1', exported)
+
+if __name__ == '__main__':
+    unittest.main()
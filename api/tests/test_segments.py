@@ -0,0 +1,79 @@
+"""
+Planning and merging of segmented counts, on synthetic tracks.
+
+Run from the api directory:
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from segments import plan_segments, associate, merge
+
+def boxes(track_id, frames, x, dx=0):
+    """[frame, track id, x1, y1, x2, y2] rows of a box moving dx per frame"""
+    return [[frame, track_id, x + dx * frame, 100, x + dx * frame + 40, 140] for frame in frames]
+
+def segment_result(crossings, head=(), tail=()):
+    return {'crossings': crossings, 'head': list(head), 'tail': list(tail)}
+
+class PlanSegmentsTest(unittest.TestCase):
+
+    def test_segments_cover_the_video_on_stride_boundaries(self):
+        plan = plan_segments(10000, 4, stride=3, overlap=90, min_frames=1000)
+        self.assertEqual([segment['index'] for segment in plan], [0, 1, 2, 3])
+        self.assertEqual(plan[0]['start'], 0)
+        for previous, segment in zip(plan, plan[1:]):
+            self.assertEqual(segment['count_from'], previous['end'])
+            self.assertEqual(segment['start'], segment['count_from'] - 90)
+            self.assertEqual(previous['tail_from'], previous['end'] - 90)
+            for key in ('start', 'count_from'):
+                self.assertEqual(segment[key] % 3, 0)
+
+    def test_last_segment_reads_to_the_end(self):
+        # the frame count is only an estimate, the last segment must not stop at it
+        plan = plan_segments(10000, 4, stride=3, overlap=90, min_frames=1000)
+        self.assertIsNone(plan[-1]['end'])
+        self.assertIsNone(plan[-1]['tail_from'])
+        self.assertTrue(all(segment['end'] is not None for segment in plan[:-1]))
+
+    def test_short_video_is_one_segment(self):
+        self.assertEqual(plan_segments(500, 4, min_frames=1800),
+                         [{'index': 0, 'start': 0, 'count_from': 0, 'end': None, 'tail_from': None}])
+
+class AssociateTest(unittest.TestCase):
+
+    def test_links_tracks_seen_in_the_same_place(self):
+        overlap = range(900, 990, 3)
+        tail = boxes(5, overlap, 0, dx=1) + boxes(6, overlap, 400)
+        # the next segment's tracker gave the same objects new ids, a pixel off
+        head = boxes(1, overlap, 401) + boxes(2, overlap, 1, dx=1) + boxes(3, overlap, 200)
+        self.assertEqual(associate(tail, head), {1: 6, 2: 5})
+
+    def test_empty_overlap(self):
+        self.assertEqual(associate([], boxes(1, range(3), 0)), {})
+
+class MergeTest(unittest.TestCase):
+
+    def test_associated_track_is_counted_once(self):
+        overlap = range(900, 990, 3)
+        results = [
+            segment_result([[950, 5, 1], [600, 7, -1]], tail=boxes(5, overlap, 0)),
+            # track 1 is track 5 again: it crosses back in this segment, a new object 2 crosses too
+            segment_result([[1200, 1, -1], [1500, 2, 1]], head=boxes(1, overlap, 0)),
+        ]
+        self.assertEqual(merge(results), {'in': 2, 'out': 1, 'duplicates': 1, 'associated': 1})
+
+    def test_links_chain_across_segments(self):
+        first, second = range(900, 990, 3), range(1900, 1990, 3)
+        results = [
+            segment_result([[100, 5, 1]], tail=boxes(5, first, 0)),
+            segment_result([], head=boxes(1, first, 0), tail=boxes(1, second, 300)),
+            segment_result([[2100, 9, 1]], head=boxes(9, second, 300)),
+        ]
+        self.assertEqual(merge(results), {'in': 1, 'out': 0, 'duplicates': 1, 'associated': 2})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+"""
+TrackState against the dict-and-set loop counter.count_object used before it.
+
+Run from the api directory:
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tracks import TrackState, IN, OUT
+
+LINE = ((0, 300), (640, 300))
+
+def calculate(x, y, x1, y1, x2, y2):
+    return (x - x1) * (y2 - y1) - (y - y1) * (x2 - x1)
+
+def reference_count(frames, line_p1, line_p2):
+    """The previous per-box loop; returns the (track id, 'in'|'out') crossings of each frame"""
+    hist = {}
+    counted = set()
+    crossings = []
+    for boxes, track_ids in frames:
+        crossed = []
+        for (x1, y1, x2, y2), track_id in zip(boxes, track_ids):
+            cx = (x1 + x2) // 2
+            cy = (y1 + y2) // 2
+            if track_id in hist and track_id not in counted:
+                prev_cx, prev_cy = hist[track_id]
+                side_1 = calculate(prev_cx, prev_cy, *line_p1, *line_p2)
+                side_2 = calculate(cx, cy, *line_p1, *line_p2)
+                if side_1 * side_2 < 0:
+                    crossed.append((track_id, 'in' if side_2 < 0 else 'out'))
+                    counted.add(track_id)
+            hist[track_id] = (cx, cy)
+        crossings.append(crossed)
+    return crossings
+
+def random_frames(rng, count, ids=40, max_boxes=12):
+    """Frames of boxes with distinct track ids per frame, jittering around the line"""
+    frames = []
+    for _ in range(count):
+        n = int(rng.integers(0, max_boxes + 1))
+        track_ids = rng.choice(ids, size=n, replace=False)
+        x1 = rng.integers(0, 600, size=n)
+        y1 = rng.integers(240, 340, size=n)
+        boxes = np.stack((x1, y1, x1 + rng.integers(2, 40, size=n), y1 + rng.integers(2, 40, size=n)), axis=1)
+        frames.append((boxes.tolist(), track_ids.tolist()))
+    return frames
+
+class TrackStateTest(unittest.TestCase):
+
+    def test_matches_reference_loop(self):
+        rng = np.random.default_rng(46)
+        for _ in range(20):
+            frames = random_frames(rng, 200)
+            expected = reference_count(frames, *LINE)
+            # the old loop never forgot a track
+            tracks = TrackState(*LINE, max_age=len(frames))
+            for (boxes, track_ids), crossed_before in zip(frames, expected):
+                crossed = tracks.update(boxes, track_ids)
+                names = {IN: 'in', OUT: 'out'}
+                got = [(track_id, names[int(c)]) for track_id, c in zip(track_ids, crossed) if c]
+                self.assertEqual(got, crossed_before)
+            self.assertEqual(tracks.total_in, sum(c == 'in' for frame in expected for _, c in frame))
+            self.assertEqual(tracks.total_out, sum(c == 'out' for frame in expected for _, c in frame))
+            tracks.close()
+
+    def test_untracked_boxes_are_ignored(self):
+        # the old loop kept every untracked box under id -1, so two unrelated
+        # boxes on either side of the line counted as a crossing
+        frames = [([[10, 200, 20, 210]], [-1]), ([[10, 400, 20, 410]], [-1])]
+        self.assertEqual(reference_count(frames, *LINE)[1], [(-1, 'in')])
+        tracks = TrackState(*LINE)
+        for boxes, track_ids in frames:
+            self.assertFalse(tracks.update(boxes, track_ids).any())
+        self.assertEqual((tracks.total_in, tracks.total_out, len(tracks)), (0, 0, 0))
+        tracks.close()
+
+if __name__ == '__main__':
+    unittest.main()
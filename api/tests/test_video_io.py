@@ -0,0 +1,67 @@
+"""
+FrameSampler's sample grid when a seek lands after the requested frame.
+
+Run from the api directory:
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+from unittest import mock
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from video_io import FrameSampler
+
+class FakeCapture:
+    """A capture of frames frames whose seeks land overshoot frames late"""
+
+    def __init__(self, frames=300, fps=30.0, overshoot=0):
+        self.frames, self.fps, self.overshoot = frames, fps, overshoot
+        self.pos = 0
+
+    def get(self, prop):
+        return {cv2.CAP_PROP_FPS: self.fps, cv2.CAP_PROP_FRAME_COUNT: self.frames,
+                cv2.CAP_PROP_POS_FRAMES: self.pos}[prop]
+
+    def set(self, prop, value):
+        self.pos = min(self.frames, int(value) + self.overshoot)
+        return True
+
+    def grab(self):
+        if self.pos >= self.frames:
+            return False
+        self.pos += 1
+        return True
+
+    def retrieve(self, *args):
+        return True, self.pos - 1
+
+    def isOpened(self):
+        return True
+
+    def release(self):
+        pass
+
+def sampled(overshoot=0, **kwargs):
+    # FrameSampler takes an open capture as is
+    with mock.patch.object(cv2, 'VideoCapture', FakeCapture):
+        return [index for index, _ in FrameSampler(FakeCapture(overshoot=overshoot), **kwargs)]
+
+class SampleGridTest(unittest.TestCase):
+
+    def test_late_seek_stays_on_the_grid(self):
+        exact = sampled(stride=3, target_fps=0, start=90, end=180)
+        late = sampled(stride=3, target_fps=0, start=90, end=180, overshoot=4)
+        self.assertEqual(exact[:3], [90, 93, 96])
+        self.assertEqual(late, [i for i in exact if i >= 94])
+
+    def test_late_seek_with_a_fractional_step(self):
+        # 7 fps out of 30 is a step of 4.29 frames
+        exact = sampled(target_fps=7, start=61)
+        late = sampled(target_fps=7, start=61, overshoot=5)
+        self.assertEqual(late, [i for i in exact if i >= 66])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import os
+import numpy as np
+import metrics
+
+# Tracks not seen for this many processed frames are forgotten; keep it above
+# the tracker's own lost-track buffer (30 frames) so a returning track keeps
+# its counted flag
+MAX_AGE = int(os.getenv('COUNT_TRACK_MAX_AGE', '300'))
+# Stale tracks are dropped every this many frames, in one compaction
+EVICT_INTERVAL = int(os.getenv('COUNT_TRACK_EVICT_INTERVAL', '30'))
+
+IN = 1
+OUT = -1
+
+def side_of_line(points, line_p1, line_p2):
+    """Vectorized calculate(): sign tells which side of the line each (x, y) point is on"""
+    (x1, y1), (x2, y2) = line_p1, line_p2
+    return (points[:, 0] - x1) * (y2 - y1) - (points[:, 1] - y1) * (x2 - x1)
+
+class TrackState:
+    """
+    Line side, counted flag and last-seen frame per track id, in sorted
+    NumPy arrays (17 bytes per track).
+
+    update() handles all detections of a frame at once: one searchsorted to
+    find the known tracks, one side-of-line evaluation for the new centroids,
+    and boolean masks for the sign flips, instead of a dict lookup and two
+    calculate() calls per box. A track is counted at most once, on the first
+    frame its centroid changes side, like the hist/counted dictionaries did.
+
+    Tracks unseen for max_age frames are evicted, so memory stays flat on a
+    camera that runs for days instead of growing with every id ever seen.
+    Live track counts and bytes are reported to the video_tracks gauges;
+    call close() when the stream ends.
+    """
+
+    def __init__(self, line_p1, line_p2, max_age=MAX_AGE, evict_interval=EVICT_INTERVAL):
+        self.line_p1 = tuple(line_p1)
+        self.line_p2 = tuple(line_p2)
+        self.max_age = max_age
+        self.evict_interval = evict_interval
+        self.frame = 0
+        self.ids = np.empty(0, dtype=np.int32)
+        self.sides = np.empty(0, dtype=np.int64)
+        self.counted = np.empty(0, dtype=bool)
+        self.last_seen = np.empty(0, dtype=np.int32)
+        self.total_in = 0
+        self.total_out = 0
+        self.evicted = 0
+        self._reported = (0, 0)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def update(self, boxes, track_ids):
+        """
+        Record one frame of tracked boxes and count line crossings.
+
+        Args:
+            boxes (array): (n, 4) x1, y1, x2, y2
+            track_ids (array): (n,) track ids; negative ids (untracked boxes) are ignored
+
+        Returns:
+            np.ndarray: (n,) IN, OUT or 0 per box
+        """
+        boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+        track_ids = np.asarray(track_ids, dtype=np.int64).reshape(-1)
+        crossed = np.zeros(len(track_ids), dtype=np.int8)
+        self.frame += 1
+        if self.frame % self.evict_interval == 0:
+            self.evict()
+        if not len(track_ids):
+            return crossed
+
+        centroids = np.stack(((boxes[:, 0] + boxes[:, 2]) // 2, (boxes[:, 1] + boxes[:, 3]) // 2), axis=1)
+        sides = side_of_line(centroids, self.line_p1, self.line_p2)
+
+        tracked = track_ids >= 0
+        pos = np.searchsorted(self.ids, track_ids)
+        known = tracked & (pos < len(self.ids))
+        known[known] = self.ids[pos[known]] == track_ids[known]
+
+        flips = np.zeros(len(track_ids), dtype=bool)
+        flips[known] = ~self.counted[pos[known]] & (self.sides[pos[known]] * sides[known] < 0)
+        if np.count_nonzero(flips) > 1:
+            # an id seen twice in one frame is counted once, for its first box
+            index = np.flatnonzero(flips)
+            _, first = np.unique(pos[index], return_index=True)
+            flips[:] = False
+            flips[index[first]] = True
+        crossed[flips & (sides < 0)] = IN
+        crossed[flips & (sides > 0)] = OUT
+        self.total_in += int(np.count_nonzero(crossed == IN))
+        self.total_out += int(np.count_nonzero(crossed == OUT))
+
+        self.counted[pos[flips]] = True
+        self.sides[pos[known]] = sides[known]
+        self.last_seen[pos[known]] = self.frame
+
+        new = tracked & ~known
+        if new.any():
+            # keep the last box of an id that appears more than once
+            new_ids, first = np.unique(track_ids[new][::-1], return_index=True)
+            last = np.flatnonzero(new)[::-1][first]
+            self._insert(new_ids, sides[last])
+            self._report()
+        return crossed
+
+    def _insert(self, ids, sides):
+        self.ids = np.concatenate((self.ids, ids.astype(np.int32)))
+        self.sides = np.concatenate((self.sides, sides))
+        self.counted = np.concatenate((self.counted, np.zeros(len(ids), dtype=bool)))
+        self.last_seen = np.concatenate((self.last_seen, np.full(len(ids), self.frame, dtype=np.int32)))
+        order = np.argsort(self.ids, kind='stable')
+        self.ids, self.sides, self.counted, self.last_seen = (
+            self.ids[order], self.sides[order], self.counted[order], self.last_seen[order])
+
+    def evict(self):
+        """Drop tracks unseen for more than max_age frames; returns how many"""
+        keep = self.frame - self.last_seen <= self.max_age
+        dropped = len(keep) - int(np.count_nonzero(keep))
+        if dropped:
+            self.ids, self.sides, self.counted, self.last_seen = (
+                self.ids[keep], self.sides[keep], self.counted[keep], self.last_seen[keep])
+            self.evicted += dropped
+            metrics.VIDEO_TRACKS_EVICTED.inc(dropped)
+            self._report()
+        return dropped
+
+    @property
+    def nbytes(self):
+        return self.ids.nbytes + self.sides.nbytes + self.counted.nbytes + self.last_seen.nbytes
+
+    def _report(self):
+        """Move the process-wide gauges by this state's change since the last report"""
+        tracks, nbytes = len(self.ids), self.nbytes
+        metrics.VIDEO_TRACKS.inc(tracks - self._reported[0])
+        metrics.VIDEO_TRACK_BYTES.inc(nbytes - self._reported[1])
+        self._reported = (tracks, nbytes)
+
+    def close(self):
+        """Withdraw this state from the gauges"""
+        metrics.VIDEO_TRACKS.dec(self._reported[0])
+        metrics.VIDEO_TRACK_BYTES.dec(self._reported[1])
+        self._reported = (0, 0)
+
+    def stats(self):
+        return {'tracks': len(self.ids), 'evicted': self.evicted, 'bytes': self.nbytes, 'frames': self.frame}
+
+def class_mask(class_ids, allowed_ids):
+    """Boolean mask of detections whose class id is in allowed_ids"""
+    return np.isin(np.asarray(class_ids), allowed_ids)
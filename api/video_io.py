@@ -0,0 +1,90 @@
+import os
+import math
+import cv2
+
+# Process every Nth frame unless a target rate is given
+DEFAULT_STRIDE = int(os.getenv('COUNT_FRAME_STRIDE', '3'))
+DEFAULT_TARGET_FPS = float(os.getenv('COUNT_TARGET_FPS', '0')) or None
+
+class FrameSampler:
+    """
+    Iterate over a subset of a capture's frames.
+
+    Every frame is grab()bed, and only sampled frames are retrieve()d. With
+    OpenCV's FFmpeg backend grab() still decodes the frame (later frames
+    depend on it), so the video decode cost does not fall with the stride;
+    what skipped frames save is the conversion to a BGR image and everything
+    downstream (resize, inference, tracking).
+
+    With target_fps the stride follows the source frame rate, e.g. 5 fps out
+    of a 30 fps video is every 6th frame; when the source does not report a
+    rate the fixed stride is used. target_fps=0 uses the stride even when
+    COUNT_TARGET_FPS is set.
+
+    start and end restrict sampling to the frames [start, end); the capture
+    seeks to start (FFmpeg goes to the keyframe before it and decodes
+    forward), so a segment of a long video does not decode what precedes it.
+
+    Yields:
+        tuple: (frame index in the source, BGR frame)
+    """
+
+    def __init__(self, source, stride=None, target_fps=None, start=0, end=None):
+        self.cap = source if isinstance(source, cv2.VideoCapture) else cv2.VideoCapture(source)
+        self.source_fps = self.cap.get(cv2.CAP_PROP_FPS) or 0.0
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if target_fps is None:
+            target_fps = DEFAULT_TARGET_FPS
+        if target_fps and self.source_fps > 0:
+            self.step = max(1.0, self.source_fps / target_fps)
+        else:
+            self.step = float(max(1, stride or DEFAULT_STRIDE))
+        self.start = start
+        self.end = end
+        self.grabbed = 0
+        self.retrieved = 0
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def __iter__(self):
+        index = -1
+        if self.start:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.start)
+            # where the backend actually landed
+            index = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES)) - 1
+        # the sample grid is start + k * step wherever the backend landed, so
+        # neighbouring segments sample the same frames in their overlap
+        # (frame i samples the grid points in (i - 1, i])
+        next_sample = float(self.start)
+        if index >= next_sample:
+            next_sample += (math.floor((index - next_sample) / self.step) + 1) * self.step
+        while (self.end is None or index + 1 < self.end) and self.cap.grab():
+            index += 1
+            self.grabbed += 1
+            if index < next_sample:
+                continue
+            # a fractional step keeps the average rate exact, e.g. 29.97 -> 5 fps
+            next_sample += self.step
+            ok, frame = self.cap.retrieve()
+            if not ok:
+                break
+            self.retrieved += 1
+            yield index, frame
+
+    def stats(self):
+        return {
+            'source_fps': self.source_fps,
+            'step': round(self.step, 3),
+            'grabbed': self.grabbed,
+            'retrieved': self.retrieved
+        }
+
+    def release(self):
+        self.cap.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
@@ -100,40 +100,56 @@ const CattleImageEnhancer = () => {
     }
     try {
       setIsUploading(true)
-      const response = await fetch(
-        `/api/stream?video=${store.video}&line=${line.startX},${line.startY},${line.endX},${line.endY}`,
-      )
-
+      // a background job: it keeps counting when this page disconnects or
+      // reloads, and counting the same video and line again attaches to it
+      const response = await fetch('/api/count-jobs', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          video: store.video,
+          line: `${line.startX},${line.startY},${line.endX},${line.endY}`,
+        }),
+      })
+      const job = await response.json()
       if (!response.ok) {
-        throw new Error(`HTTP error! status: ${response.status}`)
+        throw new Error(job.error || `HTTP error! status: ${response.status}`)
       }
-
-      const reader = response.body.getReader()
-      const decoder = new TextDecoder()
-
-      while (true) {
-        const { done, value } = await reader.read()
-
-        if (done) {
-          console.log('Stream completed')
-          break
-        }
-
-        const chunk = decoder.decode(value)
-        const obj = JSON.parse(chunk)
-        //console.log(obj)
-        setUploadStatus(() => `Count: ${obj.in + obj.out}`)
-        const percentComplete = (obj.currentFrame / obj.totalFrames) * 100
-        setUploadProgress(Math.round(percentComplete))
+      if (job.result) {
+        showProgress(job.result)
+        return
       }
+      await followJob(job.events_url)
     } catch (err) {
-      console.error('Streaming error:', err)
-      //setError(err.message)
+      console.error('Counting error:', err)
+      setUploadStatus(err.message)
     } finally {
       setIsUploading(false)
     }
   }
 
+  const showProgress = (obj) => {
+    setUploadStatus(() => `Count: ${obj.in + obj.out}`)
+    if (obj.totalFrames) {
+      setUploadProgress(Math.round((obj.currentFrame / obj.totalFrames) * 100))
+    }
+  }
+
+  // EventSource reconnects by itself and resumes after the last event id it saw
+  const followJob = (eventsUrl) =>
+    new Promise((resolve, reject) => {
+      const events = new EventSource(eventsUrl)
+      events.addEventListener('progress', (e) => showProgress(JSON.parse(e.data)))
+      events.addEventListener('done', (e) => {
+        events.close()
+        showProgress(JSON.parse(e.data))
+        resolve()
+      })
+      events.addEventListener('failed', (e) => {
+        events.close()
+        reject(new Error(JSON.parse(e.data).error))
+      })
+    })
+
  
   if (!store.uploaded) return <div></div>
   return (